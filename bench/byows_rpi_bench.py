@@ -0,0 +1,321 @@
+#!/usr/bin/env python
+"""
+Copyright 2019 Jardi A. Martinez Jordan <jardiamj@gmail.com>
+
+Benchmarks of the byows_rpi driver hot paths and of the end-to-end loop,
+run against the simulator backend so they need no hardware.
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+invoke this as follows from the root dir of this repo, with weeWX in the path:
+    PYTHONPATH=bin:/path/to/weewx/bin python bench/byows_rpi_bench.py -o bench.json
+and compare two runs with:
+    python bench/byows_rpi_bench.py --compare old.json new.json
+"""
+import argparse
+import gc
+import json
+import logging
+import math
+import os
+import platform
+import sys
+import threading
+import time
+import tracemalloc
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCH_DIR, "..", "bin"))
+
+# Imported by main, so --compare does not need weeWX
+byows_rpi = None
+
+# Results where a higher value is better, all the others are better lower
+HIGHER_IS_BETTER = ("per_sec",)
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    if not values:
+        return None
+    return values[min(int(fraction * len(values)), len(values) - 1)]
+
+
+def summary(seconds):
+    """ Returns the statistics of a list of durations, in microseconds. """
+    return {
+        "mean_us": 1e6 * math.fsum(seconds) / len(seconds),
+        "p50_us": 1e6 * percentile(seconds, 0.50),
+        "p95_us": 1e6 * percentile(seconds, 0.95),
+        "p99_us": 1e6 * percentile(seconds, 0.99),
+        "max_us": 1e6 * max(seconds),
+    }
+
+
+def simulated_params(**extra):
+    """ Returns the ByowsRpi options of a simulated station. """
+    stn_dict = dict(
+        backend="simulator",
+        simulator=dict(wind_speed=40, wind_speed_variation=20, rain_rate=20, seed=1),
+    )
+    stn_dict.update(extra)
+    return stn_dict
+
+
+def bench_packet_build(packets):
+    """ Latency of ByowsRpiStation.get_data with the samplers running. """
+    driver = byows_rpi.ByowsRpi(**simulated_params())
+    station = driver.station
+    station.start()
+    try:
+        durations = []
+        for _ in range(packets):
+            start = time.perf_counter()
+            station.get_data()
+            durations.append(time.perf_counter() - start)
+    finally:
+        driver.closePort()
+    return dict(packets=packets, **summary(durations))
+
+
+def bench_cold_start(runs):
+    """ Time from loading the driver to its first packet, the sensor probes
+    and the first readings of the samplers included. """
+    durations = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        driver = byows_rpi.ByowsRpi(**simulated_params())
+        try:
+            next(driver.genLoopPackets())
+            durations.append(time.perf_counter() - start)
+        finally:
+            driver.closePort()
+    return dict(runs=runs, **summary(durations))
+
+
+def bench_loop(packets, interval):
+    """ Cadence and CPU cost of the complete genLoopPackets loop. """
+    driver = byows_rpi.ByowsRpi(**simulated_params(loop_interval=interval))
+    generator = driver.genLoopPackets()
+    next(generator)  # Starts the station
+    jitters = []
+    cpu_start = time.process_time()
+    wall_start = time.monotonic()
+    try:
+        for _ in range(packets):
+            next(generator)
+            jitters.append(driver.scheduler.last_jitter)
+    finally:
+        cpu = time.process_time() - cpu_start
+        wall = time.monotonic() - wall_start
+        driver.closePort()
+    stats = driver.scheduler.stats()
+    result = dict(
+        packets=packets,
+        interval_s=interval,
+        overruns=stats["overruns"],
+        missed=stats["missed"],
+        cpu_per_packet_us=1e6 * cpu / packets,
+        cpu_load=cpu / wall,
+    )
+    result.update(("jitter_" + k, v) for k, v in summary(jitters).items())
+    return result
+
+
+def bench_pulses(edges):
+    """ Throughput of the anemometer edge callback, with a consumer taking the
+    edges concurrently, as the wind sampler does. The ring is big enough to
+    hold the edges of a consumer period at full speed, lost edges would show
+    a race between the producer and the consumer. """
+    ring = byows_rpi.PulseRing(1 << 18)
+    cursor = ring.cursor()
+    taken = [0]
+    done = threading.Event()
+
+    def consume():
+        while not done.wait(0.001):
+            taken[0] += cursor.take_count()
+
+    consumer = threading.Thread(target=consume)
+    consumer.start()
+    start = time.perf_counter()
+    for _ in range(edges):
+        ring.append()
+    elapsed = time.perf_counter() - start
+    done.set()
+    consumer.join()
+    taken[0] += cursor.take_count()
+    return dict(
+        edges=edges,
+        edges_per_sec=edges / elapsed,
+        callback_us=1e6 * elapsed / edges,
+        lost=edges - taken[0],
+        overruns=cursor.overruns,
+    )
+
+
+class FakeAdc(object):
+    """ ADC cycling through all the raw codes. """
+
+    def __init__(self):
+        self.code = 0
+
+    @property
+    def raw_value(self):
+        self.code = (self.code + 7) % 1024
+        return self.code
+
+    def close(self):
+        pass
+
+
+def bench_vane(samples):
+    """ Throughput of decoding raw wind vane codes and of averaging them. """
+    backend = byows_rpi.SimulatedBackend({})
+    gauge = byows_rpi.WindGauge(backend=backend)
+    gauge.adc = FakeAdc()
+    start = time.perf_counter()
+    for _ in range(samples):
+        gauge.read_direction()
+    decode = time.perf_counter() - start
+    vane = byows_rpi.VaneSampler(gauge.read_direction, samples)
+    for _ in range(samples):
+        vane.sample()
+    start = time.perf_counter()
+    vane.take_average()
+    average = time.perf_counter() - start
+    gauge.close()
+    backend.close()
+    return dict(
+        samples=samples,
+        decodes_per_sec=samples / decode,
+        decode_us=1e6 * decode / samples,
+        average_us=1e6 * average,
+        numpy=byows_rpi.numpy is not None,
+    )
+
+
+def bench_memory(hours, loop_interval=2.5):
+    """ Memory growth of the station fed with a simulated day of samples, as
+    fast as possible: wind and vane samples at their configured rates and a
+    packet every loop_interval, the wind rose included. """
+    driver = byows_rpi.ByowsRpi(**simulated_params(wind_rose="true"))
+    station = driver.station
+    gauge = station.wind_gauge
+    wind_per_packet = int(loop_interval / gauge.stats.sample_interval)
+    vane_per_packet = int(loop_interval * gauge.vane_sample_rate)
+    packets = int(hours * 3600 / loop_interval)
+    gc.collect()
+    tracemalloc.start()
+    baseline = None
+    start = time.perf_counter()
+    try:
+        for n in range(packets):
+            for _ in range(vane_per_packet):
+                gauge.sample_vane()
+            for _ in range(wind_per_packet):
+                gauge.pulses.extend((time.monotonic(),) * 4)
+                gauge.sample()
+            station.get_data()
+            if n == packets // 10:
+                # Measure growth once all the rolling windows are full
+                gc.collect()
+                baseline = tracemalloc.get_traced_memory()[0]
+        gc.collect()
+        current, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+        driver.closePort()
+    return dict(
+        simulated_hours=hours,
+        packets=packets,
+        elapsed_s=time.perf_counter() - start,
+        growth_bytes=current - (baseline or current),
+        peak_bytes=peak,
+    )
+
+
+def compare(old_path, new_path, tolerance):
+    """ Prints the change of every result between two runs and returns the
+    number of regressions bigger than tolerance. """
+    with open(old_path) as f:
+        old = json.load(f)["results"]
+    with open(new_path) as f:
+        new = json.load(f)["results"]
+    regressions = 0
+    for bench in sorted(set(old) & set(new)):
+        for key in sorted(set(old[bench]) & set(new[bench])):
+            before, after = old[bench][key], new[bench][key]
+            if isinstance(before, bool) or not isinstance(before, (int, float)):
+                continue
+            if not before:
+                continue
+            change = (after - before) / float(abs(before))
+            if key.endswith(HIGHER_IS_BETTER):
+                change = -change
+            flag = ""
+            if key.endswith("_us") or key.endswith(HIGHER_IS_BETTER):
+                if change > tolerance:
+                    flag = "  REGRESSION"
+                    regressions += 1
+            print("%-14s %-22s %14.2f %14.2f %+8.1f%%%s"
+                  % (bench, key, before, after, 100 * change, flag))  # fmt: skip
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="byows_rpi driver benchmarks")
+    parser.add_argument("-o", "--output", help="write the results to this JSON file")
+    parser.add_argument(
+        "--quick", action="store_true", help="smaller runs, for a smoke test"
+    )
+    parser.add_argument(
+        "--hours", type=float, help="simulated hours of the memory benchmark"
+    )
+    parser.add_argument(
+        "--compare", nargs=2, metavar=("OLD", "NEW"), help="compare two result files"
+    )
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.2,
+        help="relative slowdown reported as a regression by --compare",
+    )
+    args = parser.parse_args()
+
+    if args.compare:
+        sys.exit(1 if compare(args.compare[0], args.compare[1], args.tolerance) else 0)
+
+    global byows_rpi
+    from user import byows_rpi
+
+    logging.basicConfig(level=logging.WARNING)
+    scale = 0.1 if args.quick else 1.0
+    hours = args.hours if args.hours is not None else (1 if args.quick else 24)
+    results = dict()
+    results["cold_start"] = bench_cold_start(int(20 * scale))
+    results["packet_build"] = bench_packet_build(int(10000 * scale))
+    results["loop"] = bench_loop(int(60 * scale), 1.0)
+    results["pulses"] = bench_pulses(int(1000000 * scale))
+    results["vane"] = bench_vane(int(200000 * scale))
+    results["memory"] = bench_memory(hours)
+    report = dict(
+        driver_version=byows_rpi.DRIVER_VERSION,
+        python=platform.python_version(),
+        platform=platform.platform(),
+        machine=platform.machine(),
+        timestamp=int(time.time()),
+        results=results,
+    )
+    text = json.dumps(report, indent=4, sort_keys=True)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,258 @@
+"""
+Pieces shared by the modules of the byows_rpi driver: the
+instrumentation, the rings of edge timestamps and the option helpers.
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+import array
+import bisect
+import logging
+import os
+import threading
+import time
+
+log = logging.getLogger(__name__)
+
+
+class Histogram(object):
+    """ Cumulative histogram of durations in seconds, with the buckets of a
+    Prometheus histogram. """
+
+    BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+
+    def __init__(self):
+        self.counts = [0] * (len(self.BUCKETS) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.BUCKETS, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Metrics(object):
+    """ Performance counters of the driver: histograms, counters and gauges,
+    each with an optional sensor label. Gauges are functions evaluated when
+    the metrics are rendered, so they cost nothing in the hot paths. """
+
+    enabled = True
+
+    def __init__(self):
+        self.histograms = dict()  # (name, sensor) -> Histogram
+        self.counters = dict()  # (name, sensor) -> count
+        self.gauges = dict()  # (name, sensor) -> function
+        self.last = dict()  # (name, sensor) -> last observed value
+        self.lock = threading.Lock()
+
+    def observe(self, name, sensor, value):
+        with self.lock:
+            key = (name, sensor)
+            if key not in self.histograms:
+                self.histograms[key] = Histogram()
+            self.histograms[key].observe(value)
+            self.last[key] = value
+
+    def inc(self, name, sensor=None, amount=1):
+        with self.lock:
+            key = (name, sensor)
+            self.counters[key] = self.counters.get(key, 0) + amount
+
+    def gauge(self, name, sensor, func):
+        # Sampler threads add gauges while the writer renders them
+        with self.lock:
+            self.gauges[(name, sensor)] = func
+
+    def value(self, name, sensor=None):
+        """ Returns the current value of a counter or gauge, or the last
+        value observed by a histogram. """
+        key = (name, sensor)
+        if key in self.gauges:
+            return self.gauges[key]()
+        return self.counters.get(key, self.last.get(key))
+
+    def total(self, name):
+        """ Returns the sum of a counter over all sensors. """
+        with self.lock:
+            return sum(v for (n, _), v in self.counters.items() if n == name)
+
+    @staticmethod
+    def labels(sensor, extra=""):
+        labels = ['sensor="%s"' % sensor] if sensor is not None else []
+        if extra:
+            labels.append(extra)
+        return "{%s}" % ",".join(labels) if labels else ""
+
+    def render(self):
+        """ Returns the metrics in the Prometheus text format. """
+        lines = []
+        with self.lock:
+            counters = sorted(self.counters.items(), key=str)
+            gauges = sorted(self.gauges.items(), key=str)
+            histograms = [(key, h) for key, h in self.histograms.items()]
+            histograms = sorted(
+                ((key, list(h.counts), h.sum, h.count) for key, h in histograms),
+                key=lambda item: str(item[0]),
+            )
+        typed = set()
+        for (name, sensor), value in counters:
+            if name not in typed:
+                typed.add(name)
+                lines.append("# TYPE %s counter" % name)
+            lines.append("%s%s %s" % (name, self.labels(sensor), value))
+        # The gauge functions run outside the lock, they may take other locks
+        for (name, sensor), func in gauges:
+            if name not in typed:
+                typed.add(name)
+                # Gauges reading a total count kept by the sensor are counters
+                kind = "counter" if name.endswith("_total") else "gauge"
+                lines.append("# TYPE %s %s" % (name, kind))
+            lines.append("%s%s %s" % (name, self.labels(sensor), func()))
+        for (name, sensor), counts, total, count in histograms:
+            if name not in typed:
+                typed.add(name)
+                lines.append("# TYPE %s histogram" % name)
+            cumulative = 0
+            for bound, bucket in zip(Histogram.BUCKETS + ("+Inf",), counts):
+                cumulative += bucket
+                lines.append(
+                    "%s_bucket%s %d"
+                    % (name, self.labels(sensor, 'le="%s"' % bound), cumulative)
+                )
+            lines.append("%s_sum%s %f" % (name, self.labels(sensor), total))
+            lines.append("%s_count%s %d" % (name, self.labels(sensor), count))
+        return "\n".join(lines) + "\n"
+
+    def write(self, path):
+        """ Writes the metrics to path, for the node_exporter textfile
+        collector. The file is replaced atomically. """
+        with open(path + ".tmp", "w") as f:
+            f.write(self.render())
+        os.rename(path + ".tmp", path)
+
+
+class NullMetrics(object):
+    """ Metrics used when instrumentation is disabled, every call is a no-op. """
+
+    enabled = False
+
+    def observe(self, name, sensor, value):
+        pass
+
+    def inc(self, name, sensor=None, amount=1):
+        pass
+
+    def gauge(self, name, sensor, func):
+        pass
+
+    def value(self, name, sensor=None):
+        return None
+
+    def total(self, name):
+        return 0
+
+
+# Instrumentation of the driver, replaced by a Metrics when it is enabled.
+# Rebound by the driver, so it is always read as byows_common.metrics
+metrics = NullMetrics()
+
+
+class PulseRing(object):
+    """ Fixed size ring buffer of edge timestamps, in seconds of clock.
+
+    There is a single producer, the edge callback, which only stores the
+    timestamp and then bumps the total count, so no lock is needed. Every
+    consumer reads through its own PulseCursor. """
+
+    def __init__(self, size=4096, clock=time.monotonic):
+        self.size = size
+        self.clock = clock
+        self.stamps = array.array("d", [0.0]) * size
+        self.count = 0  # Total number of edges ever stored
+
+    def append(self, stamp=None):
+        if stamp is None:
+            stamp = self.clock()
+        self.stamps[self.count % self.size] = stamp
+        self.count += 1
+
+    def extend(self, stamps):
+        for stamp in stamps:
+            self.stamps[self.count % self.size] = stamp
+            self.count += 1
+
+    def cursor(self):
+        return PulseCursor(self)
+
+
+class PulseCursor(object):
+    """ Read position of one consumer of a PulseRing. """
+
+    def __init__(self, ring):
+        self.ring = ring
+        self.position = ring.count
+        self.last_time = self.ring.clock()
+        self.overruns = 0  # Edges overwritten before they were consumed
+
+    def pending(self):
+        return self.ring.count - self.position
+
+    def _advance(self):
+        """ Moves the cursor to the current end of the ring and returns the
+        range of edges passed over. """
+        self.last_time = self.ring.clock()
+        head = self.ring.count
+        start = self.position
+        if head - start > self.ring.size:
+            self.overruns += head - start - self.ring.size
+            log.debug("Pulse buffer overrun, %d edges lost" % self.overruns)
+            start = head - self.ring.size
+        self.position = head
+        return start, head
+
+    def take_count(self):
+        """ Returns the number of edges since the last take. """
+        start, head = self._advance()
+        return head - start
+
+    def take(self):
+        """ Returns the timestamps of the edges since the last take. """
+        start, head = self._advance()
+        size = self.ring.size
+        stamps = self.ring.stamps
+        return [stamps[i % size] for i in range(start, head)]
+
+
+def to_bool(value):
+    """ Returns a boolean config option, configobj leaves them as strings. """
+    if isinstance(value, bool):
+        return value
+    return str(value).strip().lower() in ("true", "yes", "on", "1")
+
+
+def to_list(value):
+    """ Returns a config option that may hold comma separated values as a
+    list, configobj already splits them unless there is a single value. """
+    if isinstance(value, (list, tuple)):
+        return list(value)
+    return [item.strip() for item in value.split(",") if item.strip()]
+
+
+def parse_address(value, default_port):
+    """ Returns the (host, port) of a host:port option, the port is
+    optional. An empty host is every interface. """
+    host, _, port = value.strip().rpartition(":")
+    if not _:
+        host, port = port, ""
+    return host, int(port) if port else default_port
@@ -0,0 +1,203 @@
+"""
+Filters of the byows_rpi driver, the stage between the station and
+weeWX that drops or replaces the values of faulty readings.
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+import array
+import bisect
+import time
+
+from user import byows_common
+from user.byows_common import to_list
+
+
+class RangeCheck(object):
+    """ Drops values outside [low, high] and the values in reject, like the
+    85 C a DS18B20 returns when it was reset before converting. """
+
+    def __init__(self, low=None, high=None, reject=()):
+        self.low = low
+        self.high = high
+        self.reject = frozenset(reject)
+
+    def apply(self, value, now):
+        if value in self.reject:
+            return None
+        if self.low is not None and value < self.low:
+            return None
+        if self.high is not None and value > self.high:
+            return None
+        return value
+
+
+class RateLimit(object):
+    """ Drops values that moved away from the last accepted value faster than
+    max_rate units per second. The last accepted value is forgotten after
+    RESET_SECONDS, so a sensor back from an outage is not locked out.
+
+    A real step change, a front or a swapped probe, is accepted once confirm
+    rejected values in a row agree with each other within max_rate, the
+    last of them becoming the new reference. """
+
+    RESET_SECONDS = 600
+
+    def __init__(self, max_rate, confirm=3):
+        self.max_rate = max_rate
+        self.confirm = confirm
+        self.last_value = None
+        self.last_time = None
+        # Rejected values that agree with each other, the last one and their count
+        self.candidate = None
+        self.candidate_time = None
+        self.candidates = 0
+
+    def too_fast(self, value, now, reference, reference_time):
+        elapsed = max(now - reference_time, 1e-3)
+        return abs(value - reference) / elapsed > self.max_rate
+
+    def apply(self, value, now):
+        if self.last_value is not None and now - self.last_time < self.RESET_SECONDS:
+            if self.too_fast(value, now, self.last_value, self.last_time):
+                if self.candidate is not None and not self.too_fast(
+                    value, now, self.candidate, self.candidate_time
+                ):
+                    self.candidates += 1
+                else:
+                    self.candidates = 1
+                self.candidate, self.candidate_time = value, now
+                if self.candidates < self.confirm:
+                    return None
+        self.candidate = None
+        self.candidates = 0
+        self.last_value = value
+        self.last_time = now
+        return value
+
+
+class HampelFilter(object):
+    """ Rolling Hampel filter: a value further than threshold robust standard
+    deviations from the median of the last window values is replaced by that
+    median. The deviation is estimated from the interquartile range, which
+    like the median is read by index from a sorted copy of the window.
+
+    The copy is never sorted again: an update finds the oldest value and
+    the new one by bisection, O(log w) comparisons for a window of w
+    values, then deletes and inserts them, two memmoves of at most w
+    pointers. min_deviation keeps a flat window from flagging every small
+    change. """
+
+    IQR_TO_SIGMA = 1.349
+
+    def __init__(self, window=7, threshold=3.0, min_deviation=0.0):
+        self.window = array.array("d", [0.0]) * window
+        self.size = window
+        self.count = 0
+        self.sorted = []
+        self.threshold = threshold
+        self.min_deviation = min_deviation
+
+    def apply(self, value, now):
+        if self.count >= self.size:
+            oldest = self.window[self.count % self.size]
+            del self.sorted[bisect.bisect_left(self.sorted, oldest)]
+        self.window[self.count % self.size] = value
+        self.count += 1
+        bisect.insort(self.sorted, value)
+        n = len(self.sorted)
+        if n < 3:
+            return value
+        median = self.sorted[n // 2]
+        sigma = (self.sorted[3 * n // 4] - self.sorted[n // 4]) / self.IQR_TO_SIGMA
+        if abs(value - median) > self.threshold * max(sigma, self.min_deviation):
+            return median
+        return value
+
+
+class PacketFilter(object):
+    """ Filter stage between the station and weeWX: every field with a filter
+    goes through a RangeCheck, then a RateLimit and a HampelFilter when they
+    are configured. Values dropped become None, metrics count the values
+    dropped and replaced by field.
+
+    DEFAULT_FILTERS, and PROBE_LIMITS for probe_fields, the fields of the
+    DS18B20 probes, only hold range checks, options from the [[filters]]
+    subsection are added to them field by field. """
+
+    PROBE_LIMITS = dict(min=-55, max=125, reject=[85.0, -127.0])
+    DEFAULT_FILTERS = dict(
+        outTemp=dict(min=-60, max=70),
+        outHumidity=dict(min=0, max=100),
+        pressure=dict(min=300, max=1100),
+        windSpeed=dict(min=0, max=250),
+        windGust=dict(min=0, max=250),
+    )
+
+    def __init__(self, options=None, clock=time.monotonic, probe_fields=()):
+        self.clock = clock
+        self.filters = dict()  # field: list of stages
+        settings = dict((field, dict(o)) for field, o in self.DEFAULT_FILTERS.items())
+        for field in probe_fields:
+            settings[field] = dict(self.PROBE_LIMITS)
+        for field, field_options in (options or {}).items():
+            settings.setdefault(field, {}).update(field_options)
+        for field, field_options in settings.items():
+            stages = self.build_stages(field_options)
+            if stages:
+                self.filters[field] = stages
+
+    @staticmethod
+    def build_stages(options):
+        def number(name, default=None):
+            value = options.get(name, default)
+            if value is None or str(value).lower() == "none":
+                return None
+            return float(value)
+
+        stages = []
+        low, high = number("min"), number("max")
+        reject = [float(v) for v in to_list(options.get("reject", []))]
+        if low is not None or high is not None or reject:
+            stages.append(RangeCheck(low, high, reject))
+        max_rate = number("max_rate")
+        if max_rate is not None:
+            stages.append(RateLimit(max_rate, int(number("max_rate_confirm", 3))))
+        window = int(number("hampel_window", 0) or 0)
+        if window:
+            stages.append(
+                HampelFilter(
+                    window,
+                    number("hampel_threshold", 3.0),
+                    number("hampel_min_deviation", 0.0),
+                )
+            )
+        return stages
+
+    def apply(self, packet, now=None):
+        """ Filters the fields of a packet in place. """
+        if now is None:
+            now = self.clock()
+        for field, stages in self.filters.items():
+            value = packet.get(field)
+            if value is None:
+                continue
+            filtered = value
+            for stage in stages:
+                filtered = stage.apply(filtered, now)
+                if filtered is None:
+                    byows_common.metrics.inc("byows_filter_dropped_total", field)
+                    break
+            if filtered is not None and filtered != value:
+                byows_common.metrics.inc("byows_filter_replaced_total", field)
+            packet[field] = filtered
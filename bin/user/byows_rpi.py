@@ -21,19 +21,49 @@ along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
 """
 import logging  #This supports the new WeeWX 4.x logging methodology
+import argparse
+import array
+import collections
+import concurrent.futures
+import ctypes
+import fcntl
+import functools
+import json
 import math
+import random
+import select
+import shutil
+import signal
+import sqlite3
+import struct
+import sys
 import syslog
+import tempfile
+import threading
 import time
 import datetime
-
-# Imports specific for ByowsRpiStation class
-from gpiozero import Button, MCP3008
 import os, glob
-import bme280
-import smbus2
 
+# Hardware libraries (gpiozero, smbus2) are imported by the backend
+# that uses them, so the driver can run on a machine without them.
+import weewx
 import weewx.drivers
 
+from user import byows_common
+from user.byows_common import Metrics, NullMetrics, PulseRing
+from user.byows_common import parse_address, to_bool, to_list
+from user.byows_filters import PacketFilter
+from user.byows_trace import CaptureBackend, ReplayBackend, TraceWriter
+from user.byows_transport import SHARED_MEMORY_PATH, UDP_PORT
+from user.byows_transport import SharedMemoryPublisher, SharedMemoryReader
+from user.byows_transport import UdpIngest, UdpSender
+
+try:
+    import numpy
+except ImportError:
+    # Without NumPy the wind vane averages fall back to pure Python
+    numpy = None
+
 DRIVER_NAME = "BYOWS"
 DRIVER_VERSION = "1.0.0"
 
@@ -41,7 +71,17 @@ DRIVER_VERSION = "1.0.0"
 log = logging.getLogger(__name__)
 
 def loader(config_dict, _):
-    return ByowsRpi(**config_dict[DRIVER_NAME])
+    return ByowsRpi(**driver_options(config_dict))
+
+
+def driver_options(config_dict):
+    """ Returns the [BYOWS] options of a weewx.conf, with the archive_interval
+    of [StdArchive], so the archive records of the driver match weeWX's. """
+    stn_dict = dict(config_dict[DRIVER_NAME])
+    stn_dict["archive_interval"] = config_dict.get("StdArchive", {}).get(
+        "archive_interval", 300
+    )
+    return stn_dict
 
 
 """
@@ -56,9 +96,117 @@ class ByowsRpi(weewx.drivers.AbstractDevice):
     """
 
     def __init__(self, **stn_dict):
+        self.load_time = time.monotonic()
+        self.cold_start = None  # Seconds from loading to the first packet
         self.hardware = stn_dict.get("hardware", "BYOWS - Raspberry Pi")
         self.loop_interval = float(stn_dict.get("loop_interval", 5))
-        params = dict()
+        self.scheduler = LoopScheduler(
+            self.loop_interval, stn_dict.get("loop_overrun_policy", "skip")
+        )
+        self.loop_interval = self.scheduler.interval
+        # hardware reads the sensors in this process, shared_memory reads the
+        # packets published by the acquisition daemon, udp receives the
+        # packets streamed by the senders of other nodes
+        self.source = stn_dict.get("source", "hardware")
+        if self.source not in ("hardware", "shared_memory", "udp"):
+            raise weewx.ViolatedPrecondition("Unknown BYOWS source '%s'" % self.source)
+        if self.source != "shared_memory" and to_bool(stn_dict.get("metrics", False)):
+            byows_common.metrics = Metrics()
+        else:
+            byows_common.metrics = NullMetrics()
+        self.metrics_in_packet = byows_common.metrics.enabled and to_bool(
+            stn_dict.get("metrics_in_packet", False)
+        )
+        self.metrics_writer = None
+        if byows_common.metrics.enabled and stn_dict.get("metrics_file"):
+            self.metrics_writer = SensorSampler(
+                "metrics",
+                functools.partial(byows_common.metrics.write, stn_dict["metrics_file"]),
+                float(stn_dict.get("metrics_interval", 60)),
+            )
+        for name in ("packets", "overruns", "missed", "jitter_max"):
+            byows_common.metrics.gauge(
+                "byows_loop_%s" % name, None, functools.partial(self.loop_stat, name)
+            )
+        log.info("using driver %s" % DRIVER_NAME)
+        log.info("driver version is %s" % DRIVER_VERSION)
+        self.events = None
+        self.poll_interval = self.loop_interval
+        event_kinds = to_list(stn_dict.get("loop_events", ""))
+        if event_kinds:
+            self.events = LoopEvents(
+                event_kinds,
+                float(stn_dict.get("event_min_interval", 1.0)),
+                float(stn_dict.get("event_gust_threshold", 50.0)),
+                float(stn_dict.get("event_pressure_drop", 1.0)),
+                float(stn_dict.get("event_pressure_window", 600)),
+            )
+            # Event packets of the daemon must not wait for the next interval
+            self.poll_interval = min(self.loop_interval, self.events.min_interval)
+        self.station = None
+        self.shared_memory = None
+        self.udp_ingest = None
+        if self.source == "shared_memory":
+            path = stn_dict.get("shared_memory_path", SHARED_MEMORY_PATH)
+            log.info("reading the packets of the acquisition daemon from %s" % path)
+            self.shared_memory = SharedMemoryReader(
+                path, float(stn_dict.get("shared_memory_timeout", 60))
+            )
+        elif self.source == "udp":
+            address = parse_address(stn_dict.get("udp_address", ""), UDP_PORT)
+            self.udp_ingest = UdpIngest(
+                address,
+                stn_dict.get("udp_nodes", {}),
+                float(stn_dict.get("udp_timeout", 60)),
+            )
+            log.info(
+                "receiving the packets of the nodes on %s:%d" % self.udp_ingest.address
+            )
+        else:
+            self.station = self.open_station(stn_dict, self.events)
+        # The clock of the station, the replayed one for a replay
+        clock = time.monotonic if self.station is None else self.station.clock
+        self.filters = PacketFilter(
+            stn_dict.get("filters", {}), clock, DS18B20Bus.AUTO_FIELDS
+        )
+        self.adaptive = None
+        if self.station is not None and to_bool(
+            stn_dict.get("adaptive_sampling", False)
+        ):
+            self.adaptive = AdaptiveRates(
+                self.loop_interval,
+                self.station.wind_gauge.vane_sample_rate,
+                float(stn_dict.get("adaptive_loop_interval", 10.0)),
+                float(stn_dict.get("adaptive_vane_rate", 1.0)),
+                float(stn_dict.get("adaptive_wind_speed", 15.0)),
+                float(stn_dict.get("adaptive_gust_spread", 10.0)),
+                float(stn_dict.get("adaptive_direction_spread", 0.3)),
+                float(stn_dict.get("adaptive_hold", 600)),
+                clock,
+            )
+        # The wind rose of each archive interval goes in its last loop packet
+        self.archive_interval_seconds = int(stn_dict.get("archive_interval", 300))
+        self.rose_end = None  # End of the last interval given its wind rose
+        self.archive_store = None
+        if stn_dict.get("archive_store"):
+            # With the daemon, the daemon saves the records and weeWX reads them
+            self.archive_store = ArchiveStore(
+                stn_dict["archive_store"],
+                self.archive_interval_seconds,
+                float(stn_dict.get("archive_store_days", 30)),
+                readonly=self.shared_memory is not None,
+                open_timeout=float(stn_dict.get("shared_memory_timeout", 60)),
+            )
+            if self.station is not None:
+                # Keep the raw counters growing across restarts
+                self.station.rain_tips = self.archive_store.counters.get(
+                    "rain_tips", 0
+                )
+
+    @staticmethod
+    def open_station(stn_dict, events=None):
+        """ Returns the ByowsRpiStation configured by the driver options. """
+        params = dict(events=events)
         params["anem_pin"] = int(stn_dict.get("anemometer_pin", 5))
         params["rain_bucket_pin"] = int(stn_dict.get("rain_bucket_pin", 6))
         params["bme280_port"] = int(stn_dict.get("bme280_port", 1))
@@ -66,24 +214,1063 @@ class ByowsRpi(weewx.drivers.AbstractDevice):
         params["mcp3008_channel"] = int(stn_dict.get("mcp3008_channel", 0))
         params["anem_adjustment"] = float(stn_dict.get("anemometer_adjustment", 1.18))
         params["bucket_size"] = float(stn_dict.get("bucket_size", 0.2794))
+        params["rain_debounce"] = float(stn_dict.get("rain_debounce", 0.1))
+        params["rain_rate_timeout"] = float(stn_dict.get("rain_rate_timeout", 900))
         params["anem_radius_cm"] = float(stn_dict.get("anemometer_radius_cm", 9.0))
-        log.info("using driver %s" % DRIVER_NAME)
-        log.info("driver version is %s" % DRIVER_VERSION)
-        self.station = ByowsRpiStation(**params)
+        params["bme280_interval"] = float(stn_dict.get("bme280_interval", 2.5))
+        params["bme280_settings"] = dict(
+            mode=stn_dict.get("bme280_mode", "normal"),
+            temperature_oversampling=int(
+                stn_dict.get("bme280_temperature_oversampling", 1)
+            ),
+            pressure_oversampling=int(stn_dict.get("bme280_pressure_oversampling", 1)),
+            humidity_oversampling=int(stn_dict.get("bme280_humidity_oversampling", 1)),
+            iir_filter=int(stn_dict.get("bme280_iir_filter", 0)),
+            standby_ms=float(stn_dict.get("bme280_standby_ms", 500)),
+        )
+        params["i2c_devices"] = dict(stn_dict.get("i2c_devices", {}))
+        params["ds18b20_interval"] = float(stn_dict.get("ds18b20_interval", 5.0))
+        params["ds18b20_rescan_interval"] = float(
+            stn_dict.get("ds18b20_rescan_interval", 300)
+        )
+        params["ds18b20_probes"] = dict(stn_dict.get("ds18b20_probes", {}))
+        params["mcp3008_channels"] = dict(stn_dict.get("mcp3008_channels", {}))
+        params["mcp3008_device"] = stn_dict.get("mcp3008_device", "/dev/spidev0.0")
+        params["mcp3008_speed_hz"] = int(stn_dict.get("mcp3008_speed_hz", 1000000))
+        params["mcp3008_oversampling"] = int(stn_dict.get("mcp3008_oversampling", 4))
+        params["mcp3008_interval"] = float(stn_dict.get("mcp3008_interval", 5.0))
+        params["mcp3008_vref"] = float(stn_dict.get("mcp3008_vref", 3.3))
+        params["sensor_probe_timeout"] = float(
+            stn_dict.get("sensor_probe_timeout", 2.0)
+        )
+        params["sensor_retry_interval"] = float(
+            stn_dict.get("sensor_retry_interval", 60)
+        )
+        params["breaker_settings"] = dict(
+            failures=int(stn_dict.get("sensor_failures", 3)),
+            backoff=float(stn_dict.get("sensor_backoff", 10)),
+            max_backoff=float(stn_dict.get("sensor_max_backoff", 600)),
+        )
+        params["anem_edges"] = stn_dict.get("anemometer_edges", "callback")
+        params["gpiochip"] = stn_dict.get("gpiochip", "/dev/gpiochip0")
+        params["pulse_buffer_size"] = int(stn_dict.get("pulse_buffer_size", 4096))
+        params["wind_sample_interval"] = float(
+            stn_dict.get("wind_sample_interval", 0.25)
+        )
+        params["wind_gust_seconds"] = float(stn_dict.get("wind_gust_seconds", 3.0))
+        params["vane_sample_rate"] = float(stn_dict.get("vane_sample_rate", 10.0))
+        params["vane_tolerance"] = float(stn_dict.get("vane_tolerance", 0.1))
+        params["vane_calibration_file"] = stn_dict.get("vane_calibration_file")
+        params["wind_rose"] = to_bool(stn_dict.get("wind_rose", False))
+        params["wind_average_minutes"] = [
+            int(minutes)
+            for minutes in to_list(stn_dict.get("wind_average_minutes", "2, 10"))
+        ]
+        backend_name = stn_dict.get("backend", "gpiozero")
+        log.info("using %s hardware backend" % backend_name)
+        params["backend"] = get_backend(
+            backend_name, params, stn_dict.get(backend_name, {})
+        )
+        if stn_dict.get("trace_file"):
+            log.info("recording the raw sensor inputs to %s" % stn_dict["trace_file"])
+            params["backend"] = CaptureBackend(
+                params["backend"],
+                TraceWriter(stn_dict["trace_file"]),
+                params["rain_bucket_pin"],
+            )
+        return ByowsRpiStation(**params)
 
     @property
     def hardware_name(self):
         return self.hardware
 
+    @property
+    def archive_interval(self):
+        if self.archive_store is None:
+            raise NotImplementedError("archive_interval")
+        return self.archive_store.interval
+
+    def genArchiveRecords(self, since_ts):
+        """ Yields the records of the driver's archive store newer than
+        since_ts, so weeWX can catch up after a restart. """
+        if self.archive_store is None:
+            raise NotImplementedError("genArchiveRecords")
+        for record in self.archive_store.records_since(since_ts):
+            yield record
+
     def genLoopPackets(self):
         """ Function that generates packets for weeWX by looping through station
         data generator function. """
+        if self.shared_memory is not None:
+            for packet in self.shared_memory.packets(self.poll_interval):
+                yield packet
+            return
+        if self.udp_ingest is not None:
+            for packet in self.udp_packets():
+                yield packet
+            return
+        if isinstance(self.station.backend, ReplayBackend):
+            for packet in self.station.backend.packets(self):
+                yield packet
+            return
+        self.station.start()
+        if self.metrics_writer is not None:
+            self.metrics_writer.start()
+        while True:
+            deadline = self.scheduler.wait(self.events)  # defaults to every 5 seconds
+            if deadline is None:
+                kinds = self.events.take()
+                if kinds:
+                    timestamp = self.scheduler.timestamp(self.scheduler.clock())
+                    # Else the next packet carries the data of the events
+                    if timestamp is not None:
+                        yield self.event_packet(kinds, timestamp)
+                continue
+            timestamp = self.scheduler.timestamp(deadline)
+            if timestamp is None:
+                # The data and the events go to the next packet
+                continue
+            if self.events is not None:
+                # The packet carries the pending events as well
+                self.events.take()
+            build_start = time.monotonic()
+            packet = self.loop_packet(timestamp)
+            if self.cold_start is None:
+                self.cold_start = time.monotonic() - self.load_time
+                log.info(
+                    "First packet %.2f s after the driver was loaded" % self.cold_start
+                )
+                byows_common.metrics.gauge(
+                    "byows_cold_start_seconds", None, lambda: self.cold_start
+                )
+            if self.adaptive is not None and self.adaptive.update(
+                packet, self.station.wind_gauge.last_resultant
+            ):
+                self.set_rates()
+            if byows_common.metrics.enabled:
+                build_end = time.monotonic()
+                jitter = build_start - deadline
+                byows_common.metrics.observe("byows_loop_jitter_seconds", None, jitter)
+                build_time = build_end - build_start
+                byows_common.metrics.observe(
+                    "byows_packet_build_seconds", None, build_time
+                )
+                if self.metrics_in_packet:
+                    packet.update(self.diagnostic_fields())
+            yield packet
+            if byows_common.metrics.enabled:
+                # Time weeWX spent processing the packet before asking for more
+                weewx_time = time.monotonic() - build_end
+                byows_common.metrics.observe("byows_weewx_seconds", None, weewx_time)
+
+    def loop_packet(self, timestamp):
+        """ Returns the filtered packet of the station at timestamp, added to
+        the archive store. """
+        packet = {"dateTime": timestamp, "usUnits": weewx.METRIC}
+        packet.update(self.station.get_data())
+        rose = self.station.wind_gauge.rose
+        if rose is not None and self.ends_archive_interval(timestamp):
+            packet.update(rose.take())
+        self.filters.apply(packet)
+        if self.archive_store is not None:
+            self.archive_store.add_packet(packet, self.raw_counters())
+        return packet
+
+    def ends_archive_interval(self, timestamp):
+        """ Whether the packet at timestamp is the last one of its archive
+        interval, the next one being due after the end of the interval. Only
+        the first packet that looks like it counts, as dateTime is rounded. """
+        interval = self.archive_interval_seconds
+        end = -(-timestamp // interval) * interval
+        if end == self.rose_end or timestamp + self.scheduler.interval <= end:
+            return False
+        self.rose_end = end
+        return True
+
+    def udp_packets(self):
+        """ Yields a packet of the readings merged from the nodes every
+        loop_interval, intervals without any reading are skipped. """
         while True:
-            packet = {"dateTime": int(time.time() + 0.5), "usUnits": weewx.METRIC}
-            data = self.station.get_data()
+            deadline = self.scheduler.wait(self.udp_ingest)
+            timestamp = self.scheduler.timestamp(deadline)
+            if timestamp is None:
+                continue
+            data = self.udp_ingest.take()
+            if not data:
+                continue
+            packet = {"dateTime": timestamp, "usUnits": weewx.METRIC}
             packet.update(data)
+            self.filters.apply(packet)
+            if self.archive_store is not None:
+                self.archive_store.add_packet(packet, {})
             yield packet
-            time.sleep(self.loop_interval)  # defaults to 5 seconds
+
+    def event_packet(self, kinds, timestamp):
+        """ Returns the partial packet at timestamp of the sensor events, taken
+        from the LoopEvents, that woke the loop up before its next deadline. """
+        for kind in kinds:
+            byows_common.metrics.inc("byows_loop_events_total", kind)
+        packet = {"dateTime": timestamp, "usUnits": weewx.METRIC}
+        packet.update(self.station.get_event_data(kinds))
+        self.filters.apply(packet)
+        if self.adaptive is not None and self.adaptive.update(packet):
+            self.set_rates()
+        if self.archive_store is not None:
+            self.archive_store.add_packet(packet, self.raw_counters())
+        return packet
+
+    def set_rates(self):
+        """ Applies the cadence of the adaptive sampling. """
+        self.scheduler.set_interval(self.adaptive.loop_interval)
+        self.station.samplers["vane"].interval = 1.0 / self.adaptive.vane_rate
+
+    def raw_counters(self):
+        return {
+            "rain_tips": self.station.rain_tips,
+            "anemometer_pulses": self.station.wind_gauge.pulses.count,
+        }
+
+    def loop_stat(self, name):
+        return self.scheduler.stats()[name]
+
+    def diagnostic_fields(self):
+        """ Returns the diagnostic fields added to packets by metrics_in_packet. """
+        metrics = byows_common.metrics
+        fields = {
+            "byowsLoopJitter": metrics.value("byows_loop_jitter_seconds"),
+            "byowsPacketBuildTime": metrics.value("byows_packet_build_seconds"),
+            "byowsWeewxTime": metrics.value("byows_weewx_seconds"),
+            "byowsLoopOverruns": self.scheduler.overruns,
+            "byowsVaneMisses": self.station.wind_gauge.decode_misses,
+            "byowsSensorErrors": metrics.total("byows_sensor_errors_total"),
+            "byowsSensorsDown": sum(
+                1
+                for state, _ in self.station.health().values()
+                if state != CircuitBreaker.CLOSED
+            ),
+        }
+        for name, age in self.station.ages.items():
+            fields["byows%s%sAge" % (name[:1].upper(), name[1:])] = age
+        return fields
+
+    def closePort(self):
+        if self.metrics_writer is not None:
+            self.metrics_writer.stop()
+        if self.station is not None:
+            self.station.stop()
+            self.station.wind_gauge.close()
+            self.station.backend.close()
+        if self.shared_memory is not None:
+            self.shared_memory.close()
+        if self.udp_ingest is not None:
+            self.udp_ingest.close()
+        if self.archive_store is not None:
+            self.archive_store.close()
+
+
+class ArchiveAccumulator(object):
+    """ Aggregates loop packets into archive records of interval seconds.
+    Records are stamped with the end of their interval, like weeWX does, and
+    hold the sum of SUM_FIELDS, the highest windGust with its direction, the
+    vector mean of the wind directions and the mean of every other field.
+    A packet older than the interval in progress, after the wall clock
+    stepped back, is dropped so the interval is not lost. """
+
+    SUM_FIELDS = ("rain",)
+
+    def __init__(self, interval):
+        self.interval = interval
+        self.end = None
+        self.sums = dict()
+        self.counts = dict()
+        self.gust = None
+
+    def add(self, packet):
+        """ Adds a packet and returns the record it completed, if any. """
+        end = -(-packet["dateTime"] // self.interval) * self.interval
+        if self.end is not None and end < self.end:
+            log.debug(
+                "Packet of %d dropped from the archive, the interval in "
+                "progress ends at %d" % (packet["dateTime"], self.end)
+            )
+            byows_common.metrics.inc("byows_archive_late_packets_total")
+            return None
+        record = None
+        if self.end is not None and end > self.end and self.counts:
+            record = self.record()
+        if self.end != end:
+            self.end = end
+            self.sums, self.counts, self.gust = dict(), dict(), None
+        for field, value in packet.items():
+            if field in ("dateTime", "usUnits") or not isinstance(value, (int, float)):
+                continue
+            if field == "windGust":
+                if self.gust is None or value > self.gust[0]:
+                    self.gust = (value, packet.get("windGustDir"))
+            elif field == "windGustDir":
+                continue
+            elif field.startswith("windDir"):
+                sin_sum, cos_sum = self.sums.get(field, (0.0, 0.0))
+                r = math.radians(value)
+                self.sums[field] = (sin_sum + math.sin(r), cos_sum + math.cos(r))
+            else:
+                self.sums[field] = self.sums.get(field, 0.0) + value
+            self.counts[field] = self.counts.get(field, 0) + 1
+        return record
+
+    def record(self):
+        """ Returns the record of the current interval. """
+        record = {
+            "dateTime": self.end,
+            "usUnits": weewx.METRIC,
+            "interval": self.interval // 60,
+        }
+        for field, total in self.sums.items():
+            if isinstance(total, tuple):
+                record[field] = vector_direction(*total)
+            elif field in self.SUM_FIELDS:
+                record[field] = total
+            else:
+                record[field] = total / self.counts[field]
+        if self.gust is not None:
+            record["windGust"], record["windGustDir"] = self.gust
+        return record
+
+    def get_state(self):
+        return dict(end=self.end, sums=self.sums, counts=self.counts, gust=self.gust)
+
+    def set_state(self, state):
+        self.end = state["end"]
+        self.counts = state["counts"]
+        self.gust = tuple(state["gust"]) if state["gust"] else None
+        # JSON turns the direction sums into lists
+        self.sums = dict(
+            (field, tuple(total) if isinstance(total, list) else total)
+            for field, total in state["sums"].items()
+        )
+
+
+class ArchiveStore(object):
+    """ Append-only store of archive records in an SQLite database in WAL
+    mode, with the raw counters of the station at the end of each record.
+    Records older than days are deleted, so the disk use stays bounded.
+
+    On close the interval in progress is saved as pending, and resumed on
+    the next start, or stored as a record if its interval is over. A readonly
+    store serves the records saved by another process, the acquisition
+    daemon, and never writes. The daemon may not have created the database
+    yet, the records wait up to open_timeout seconds for it. """
+
+    # Old records are deleted every this many records
+    PRUNE_EVERY = 12
+    # How often a readonly store looks for the database of the writer
+    OPEN_POLL_INTERVAL = 1.0
+
+    def __init__(self, path, interval=300, days=30, readonly=False, open_timeout=60.0):
+        self.path = path
+        self.interval = interval
+        self.days = days
+        self.readonly = readonly
+        self.open_timeout = open_timeout
+        self.accumulator = ArchiveAccumulator(interval)
+        self.lock = threading.Lock()
+        self.records = 0
+        self.counters = dict()
+        if readonly:
+            # The writer creates the database and its schema, nothing is written
+            self.connection = None
+            self.open_readonly(0)
+            return
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        # auto_vacuum only applies to a new database, it must come first
+        self.connection.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        self.connection.execute("PRAGMA journal_mode = WAL")
+        self.connection.execute("PRAGMA synchronous = NORMAL")
+        self.connection.execute("PRAGMA journal_size_limit = 1048576")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS archive ("
+            "dateTime INTEGER PRIMARY KEY, record TEXT NOT NULL, counters TEXT)"
+        )
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS pending (state TEXT NOT NULL, counters TEXT)"
+        )
+        self.connection.commit()
+        self.counters = self.last_counters()
+        self.resume()
+
+    def resume(self):
+        """ Resumes the interval that was in progress at the last close. """
+        row = self.connection.execute("SELECT state, counters FROM pending").fetchone()
+        self.connection.execute("DELETE FROM pending")
+        self.connection.commit()
+        if row is None:
+            return
+        self.accumulator.set_state(json.loads(row[0]))
+        self.counters = json.loads(row[1])
+        if self.accumulator.end < time.time():
+            self.save(self.accumulator.record(), self.counters)
+            self.accumulator.set_state(ArchiveAccumulator(self.interval).get_state())
+
+    def open_readonly(self, timeout):
+        """ Opens the database of the writer, waiting up to timeout seconds
+        for it to be created. Returns whether it is open. """
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                self.connection = sqlite3.connect(
+                    "file:%s?mode=ro" % self.path, uri=True, check_same_thread=False
+                )
+                self.counters = self.last_counters()
+                return True
+            except sqlite3.Error as e:
+                if self.connection is not None:
+                    self.connection.close()
+                    self.connection = None
+                if time.monotonic() >= deadline:
+                    log.debug("Cannot read archive store %s: %s" % (self.path, e))
+                    return False
+            time.sleep(self.OPEN_POLL_INTERVAL)
+
+    def last_counters(self):
+        row = self.connection.execute(
+            "SELECT counters FROM archive ORDER BY dateTime DESC LIMIT 1"
+        ).fetchone()
+        return json.loads(row[0]) if row and row[0] else dict()
+
+    def add_packet(self, packet, counters):
+        """ Adds a loop packet, storing the archive record it completes
+        with the counters as they were at the end of that record. """
+        record = self.accumulator.add(packet)
+        if record is not None:
+            self.save(record, self.counters)
+        self.counters = counters
+
+    def save(self, record, counters):
+        with self.lock:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO archive VALUES (?, ?, ?)",
+                (record["dateTime"], json.dumps(record), json.dumps(counters)),
+            )
+            self.connection.commit()
+            self.records += 1
+            if self.records % self.PRUNE_EVERY == 0:
+                self.prune(record["dateTime"])
+
+    def prune(self, now):
+        self.connection.execute(
+            "DELETE FROM archive WHERE dateTime < ?", (now - self.days * 86400,)
+        )
+        self.connection.execute("PRAGMA incremental_vacuum")
+        self.connection.commit()
+
+    def records_since(self, since_ts):
+        """ Returns the records newer than since_ts, oldest first. """
+        if self.connection is None and not self.open_readonly(self.open_timeout):
+            log.info(
+                "No archive store %s after %d seconds, no records to catch up"
+                % (self.path, self.open_timeout)
+            )
+            return []
+        with self.lock:
+            rows = self.connection.execute(
+                "SELECT record FROM archive WHERE dateTime > ? ORDER BY dateTime",
+                (since_ts or 0,),
+            ).fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+    def close(self):
+        """ Saves the interval in progress, so the packets received before a
+        shutdown are not lost, and closes the database. """
+        with self.lock:
+            if self.connection is None:
+                return
+            if self.accumulator.counts and not self.readonly:
+                self.connection.execute(
+                    "INSERT INTO pending VALUES (?, ?)",
+                    (
+                        json.dumps(self.accumulator.get_state()),
+                        json.dumps(self.counters),
+                    ),
+                )
+                self.connection.commit()
+            self.connection.close()
+            self.connection = None
+
+
+class LoopScheduler(object):
+    """ Paces the loop on fixed deadlines of the monotonic clock, so the
+    period does not stretch by the time spent acquiring and processing.
+
+    When a whole interval is missed (an overrun) the policy decides what
+    happens to the missed deadlines: skip drops them and waits for the next
+    one, catchup emits them back to back (at most MAX_CATCHUP), coalesce
+    emits a single packet right away for all of them.
+
+    Timestamps are the deadlines mapped to the wall clock, the mapping is
+    only moved when the wall clock steps by more than MAX_CLOCK_STEP. The
+    dateTime of weeWX has whole seconds, so the interval is at least
+    MIN_INTERVAL and timestamps are strictly increasing. """
+
+    POLICIES = ("skip", "catchup", "coalesce")
+    MAX_CATCHUP = 10
+    MAX_CLOCK_STEP = 1.0
+    MIN_INTERVAL = 1.0
+    # How often the cadence statistics are logged, in seconds
+    LOG_INTERVAL = 3600
+
+    def __init__(
+        self,
+        interval,
+        policy="skip",
+        clock=time.monotonic,
+        sleep=time.sleep,
+        wall_clock=time.time,
+    ):
+        if policy not in self.POLICIES:
+            raise weewx.ViolatedPrecondition(
+                "Unknown loop_overrun_policy '%s', use one of %s"
+                % (policy, ", ".join(self.POLICIES))
+            )
+        self.clock = clock
+        self.sleep = sleep
+        self.wall_clock = wall_clock
+        self.interval = self.check_interval(interval)
+        self.policy = policy
+        self.next_deadline = None
+        self.wall_offset = wall_clock() - clock()
+        self.last_stamp = None  # dateTime of the last timestamp
+        self.packets = 0
+        self.overruns = 0
+        self.missed = 0  # Deadlines skipped or coalesced
+        self.jitter_sum = 0.0
+        self.jitter_max = 0.0
+        self.last_jitter = 0.0
+        self.next_log = clock() + self.LOG_INTERVAL
+
+    def check_interval(self, interval):
+        if interval < self.MIN_INTERVAL:
+            log.warning(
+                "loop_interval %g s is below %g s, packets would share their "
+                "dateTime, using %g s"
+                % (interval, self.MIN_INTERVAL, self.MIN_INTERVAL)
+            )
+            return self.MIN_INTERVAL
+        return interval
+
+    def wait(self, events=None):
+        """ Sleeps until the next deadline and returns it. Returns None when
+        woken up earlier by one of the LoopEvents, the deadline still
+        stands. """
+        now = self.clock()
+        deadline = now if self.next_deadline is None else self.next_deadline
+        late = now - deadline
+        if self.interval > 0 and late >= self.interval:
+            self.overruns += 1
+            missed = int(late // self.interval)
+            if self.policy == "skip":
+                deadline += (missed + 1) * self.interval
+                self.missed += missed + 1
+            elif self.policy == "coalesce":
+                deadline += missed * self.interval
+                self.missed += missed
+            elif missed > self.MAX_CATCHUP:
+                deadline += (missed - self.MAX_CATCHUP) * self.interval
+                self.missed += missed - self.MAX_CATCHUP
+        while True:
+            delay = deadline - self.clock()
+            if delay <= 0:
+                break
+            if events is not None and events.wait(delay):
+                self.next_deadline = deadline
+                return None
+            self.sleep(max(deadline - self.clock(), 0))
+        self.next_deadline = deadline + self.interval
+        self.record(self.clock() - deadline)
+        return deadline
+
+    def record(self, jitter):
+        self.packets += 1
+        self.last_jitter = jitter
+        self.jitter_sum += jitter
+        self.jitter_max = max(self.jitter_max, jitter)
+        if self.clock() >= self.next_log:
+            self.next_log += self.LOG_INTERVAL
+            log.info(
+                "Loop cadence: %(packets)d packets, jitter mean %(jitter_mean).4f s "
+                "max %(jitter_max).4f s, %(overruns)d overruns, "
+                "%(missed)d missed deadlines" % self.stats()
+            )
+
+    def set_interval(self, interval):
+        """ Changes the interval, the next deadline included. """
+        interval = self.check_interval(interval)
+        if self.next_deadline is not None:
+            self.next_deadline += interval - self.interval
+        self.interval = interval
+
+    def stats(self):
+        return dict(
+            packets=self.packets,
+            overruns=self.overruns,
+            missed=self.missed,
+            jitter_last=self.last_jitter,
+            jitter_max=self.jitter_max,
+            jitter_mean=self.jitter_sum / self.packets if self.packets else 0.0,
+        )
+
+    def timestamp(self, deadline):
+        """ Returns the weeWX dateTime of a deadline, or None when it would not
+        come after the previous one: an event packet in the same second as a
+        regular one, or any packet after the wall clock stepped back. """
+        offset = self.wall_clock() - self.clock()
+        if abs(offset - self.wall_offset) > self.MAX_CLOCK_STEP:
+            log.info("Wall clock stepped by %.1f s" % (offset - self.wall_offset))
+            self.wall_offset = offset
+        stamp = int(deadline + self.wall_offset + 0.5)
+        if self.last_stamp is not None and stamp <= self.last_stamp:
+            log.debug(
+                "Skipping a packet of dateTime %d, not after %d"
+                % (stamp, self.last_stamp)
+            )
+            return None
+        self.last_stamp = stamp
+        return stamp
+
+
+class LoopEvents(object):
+    """ Sensor events that wake the loop up before its next deadline, so it
+    emits a partial packet right away: a rain tip, the gust crossing
+    gust_threshold (km/h) or the pressure dropping by pressure_drop (hPa)
+    within pressure_window seconds. Partial packets are at least
+    min_interval seconds apart, events in between are merged.
+
+    The gust and pressure events are re-armed once the gust falls below
+    GUST_REARM of the threshold and the drop below PRESSURE_REARM of
+    pressure_drop, so a value hovering around its threshold does not fire
+    over and over. """
+
+    KINDS = ("rain", "gust", "pressure")
+    GUST_REARM = 0.8
+    PRESSURE_REARM = 0.5
+
+    def __init__(
+        self,
+        kinds,
+        min_interval=1.0,
+        gust_threshold=50.0,
+        pressure_drop=1.0,
+        pressure_window=600.0,
+        clock=time.monotonic,
+        sleep=time.sleep,
+    ):
+        unknown = set(kinds) - set(self.KINDS)
+        if unknown:
+            raise weewx.ViolatedPrecondition(
+                "Unknown loop_events %s, use some of %s"
+                % (", ".join(sorted(unknown)), ", ".join(self.KINDS))
+            )
+        self.kinds = set(kinds)
+        self.min_interval = min_interval
+        self.gust_threshold = gust_threshold
+        self.pressure_drop = pressure_drop
+        self.pressure_window = pressure_window
+        self.clock = clock
+        self.sleep = sleep
+        self.wakeup = threading.Event()
+        self.lock = threading.Lock()
+        self.pending = set()
+        self.last_emit = self.clock()
+        self.gusting = False
+        self.dropping = False
+        # Decreasing pressures of the window, whose first is the highest
+        self.pressures = collections.deque()
+
+    def trigger(self, kind):
+        if kind in self.kinds:
+            # Set under the lock, so a take() in between cannot leave it set
+            # without any pending event
+            with self.lock:
+                self.pending.add(kind)
+                self.wakeup.set()
+
+    def check_gust(self, gust):
+        if gust is None:
+            return
+        if not self.gusting and gust >= self.gust_threshold:
+            self.gusting = True
+            self.trigger("gust")
+        elif self.gusting and gust < self.gust_threshold * self.GUST_REARM:
+            self.gusting = False
+
+    def check_pressure(self, pressure):
+        if pressure is None:
+            return
+        now = self.clock()
+        while self.pressures and self.pressures[-1][1] <= pressure:
+            self.pressures.pop()
+        self.pressures.append((now, pressure))
+        while self.pressures[0][0] < now - self.pressure_window:
+            self.pressures.popleft()
+        drop = self.pressures[0][1] - pressure
+        if not self.dropping and drop >= self.pressure_drop:
+            self.dropping = True
+            self.trigger("pressure")
+        elif self.dropping and drop < self.pressure_drop * self.PRESSURE_REARM:
+            self.dropping = False
+
+    def wait(self, timeout):
+        """ Waits up to timeout seconds for an event and returns whether a
+        partial packet is due before timeout. """
+        end = self.clock() + timeout
+        if not self.wakeup.wait(timeout):
+            return False
+        ready = self.last_emit + self.min_interval
+        if ready >= end:
+            return False
+        delay = ready - self.clock()
+        if delay > 0:
+            self.sleep(delay)
+        return True
+
+    def take(self):
+        """ Returns the pending events and, when there were some, starts the
+        min_interval of the next partial packet. """
+        with self.lock:
+            kinds, self.pending = self.pending, set()
+            self.wakeup.clear()
+        if kinds:
+            self.last_emit = self.clock()
+        return kinds
+
+
+class AdaptiveRates(object):
+    """ Switches the station between its active cadence, the loop interval
+    and vane sample rate of the driver, and a low-power one, calm_interval
+    and calm_vane_rate, following the weather of the packets: the wind
+    speed (the anemometer pulse rate), the spread of the gust above it, the
+    spread of the wind vane directions and rain tips.
+
+    Any of them reaching its threshold switches to the active cadence right
+    away. The low-power cadence comes back once all of them stayed below
+    REARM of their threshold, without rain, for hold seconds, so weather
+    hovering around a threshold does not toggle the cadence. The wind
+    statistics are fed at a fixed rate whatever the cadence, so no gust is
+    missed. The low-power cadence is never faster than the active one, it is
+    clamped to it. """
+
+    REARM = 0.8
+    # Below this wind speed, in km/h, the vane direction is noise
+    DIRECTION_MIN_SPEED = 3.0
+
+    def __init__(
+        self,
+        loop_interval,
+        vane_rate,
+        calm_interval=10.0,
+        calm_vane_rate=1.0,
+        wind_speed=15.0,
+        gust_spread=10.0,
+        direction_spread=0.3,
+        hold=600.0,
+        clock=time.monotonic,
+    ):
+        if calm_interval < loop_interval:
+            log.warning(
+                "adaptive_loop_interval %g s is below loop_interval, using %g s"
+                % (calm_interval, loop_interval)
+            )
+            calm_interval = loop_interval
+        if calm_vane_rate > vane_rate:
+            log.warning(
+                "adaptive_vane_rate %g/s is above vane_sample_rate, using %g/s"
+                % (calm_vane_rate, vane_rate)
+            )
+            calm_vane_rate = vane_rate
+        self.loop_intervals = (calm_interval, loop_interval)
+        self.vane_rates = (calm_vane_rate, vane_rate)
+        self.thresholds = dict(
+            wind_speed=wind_speed,
+            gust_spread=gust_spread,
+            direction_spread=direction_spread,
+        )
+        self.hold = hold
+        self.clock = clock
+        # Start active, the weather is not known yet
+        self.active = True
+        self.last_activity = clock()
+        byows_common.metrics.gauge(
+            "byows_adaptive_active", None, lambda: int(self.active)
+        )
+
+    @property
+    def loop_interval(self):
+        return self.loop_intervals[self.active]
+
+    @property
+    def vane_rate(self):
+        return self.vane_rates[self.active]
+
+    def signals(self, packet, resultant):
+        """ Returns the activity signals of a packet, None when unknown. """
+        wind_speed = packet.get("windSpeed")
+        gust = packet.get("windGust")
+        signals = dict(wind_speed=wind_speed, gust_spread=None, direction_spread=None)
+        if wind_speed is not None and gust is not None:
+            signals["gust_spread"] = gust - wind_speed
+        if resultant is not None and (wind_speed or 0.0) >= self.DIRECTION_MIN_SPEED:
+            signals["direction_spread"] = 1.0 - resultant
+        return signals
+
+    def update(self, packet, resultant=None, now=None):
+        """ Updates the cadence with a packet and the mean resultant length
+        of its vane samples. Returns whether the cadence changed. """
+        if now is None:
+            now = self.clock()
+        reasons = ["rain"] if packet.get("rain") else []
+        quiet = not reasons
+        for name, value in sorted(self.signals(packet, resultant).items()):
+            if value is None:
+                continue
+            threshold = self.thresholds[name]
+            if value >= threshold:
+                reasons.append(name)
+            if value >= threshold * self.REARM:
+                quiet = False
+        if not quiet:
+            self.last_activity = now
+        if reasons and not self.active:
+            self.active = True
+            log.info("Weather is active (%s), sampling faster" % ", ".join(reasons))
+            return True
+        if self.active and now - self.last_activity >= self.hold:
+            self.active = False
+            log.info("Weather calm for %d s, sampling slower" % self.hold)
+            return True
+        return False
+
+
+class SensorProbes(object):
+    """ Opens the devices of the station in parallel, waiting at most timeout
+    seconds for them. A device that fails to open, or does not answer in
+    time, is left out of the packets while the station runs degraded, and
+    is probed again every retry_interval seconds in the background until it
+    opens. A probe stuck in the driver of its bus is not probed again until
+    it returns. """
+
+    def __init__(self, timeout=2.0, retry_interval=60.0):
+        self.timeout = timeout
+        self.retry_interval = retry_interval
+        self.probes = dict()  # name: (open_func, on_open)
+        self.futures = dict()  # name: future of the probe in progress
+        self.opened = set()
+        self.executor = None
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def add(self, name, open_func, on_open):
+        """ Adds a device, on_open is called with the device once it opens. """
+        self.probes[name] = (open_func, on_open)
+        byows_common.metrics.gauge(
+            "byows_sensor_up", name, lambda: int(name in self.opened)
+        )
+
+    def missing(self):
+        return sorted(set(self.probes) - self.opened)
+
+    def probe(self):
+        """ Probes all the devices at once, and starts retrying in the
+        background the ones that did not open. Returns their names. """
+        start = time.monotonic()
+        self.executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=len(self.probes), thread_name_prefix="byows-probe"
+        )
+        self.probe_missing()
+        log.info("Probed the sensors in %.2f s" % (time.monotonic() - start))
+        missing = self.missing()
+        if missing:
+            log.error(
+                "Starting without %s, probing again every %g s"
+                % (", ".join(missing), self.retry_interval)
+            )
+            self._thread = threading.Thread(target=self._retry, name="byows-probe")
+            self._thread.daemon = True
+            self._thread.start()
+        return missing
+
+    def probe_missing(self):
+        for name in self.missing():
+            if name not in self.futures:
+                self.futures[name] = self.executor.submit(self.probes[name][0])
+        concurrent.futures.wait(list(self.futures.values()), timeout=self.timeout)
+        for name, future in list(self.futures.items()):
+            if not future.done():
+                log.debug("No answer from %s in %.1f s" % (name, self.timeout))
+                continue
+            del self.futures[name]
+            try:
+                device = future.result()
+            except Exception as e:
+                log.debug("Probe of %s failed: %s" % (name, e))
+                if self._thread is None:
+                    log.error("Sensor %s is not available: %s" % (name, e))
+                continue
+            self.probes[name][1](device)
+            self.opened.add(name)
+            if self._thread is not None:
+                log.info("Sensor %s is available again" % name)
+
+    def _retry(self):
+        while self.missing() and not self._stop_event.wait(self.retry_interval):
+            self.probe_missing()
+
+    def close(self):
+        self._stop_event.set()
+        if self.executor is not None:
+            self.executor.shutdown(wait=False)
+
+
+class CircuitBreaker(object):
+    """ Health of a sensor, so a dead sensor costs nearly nothing: after
+    failures consecutive failed reads the breaker opens and the sensor is not
+    read at all for backoff seconds. It is then read once (half-open): a
+    success closes the breaker, a failure opens it again for twice as long,
+    up to max_backoff. Every change of state is logged once. """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half-open"
+    STATES = (CLOSED, HALF_OPEN, OPEN)
+
+    def __init__(
+        self, name, failures=3, backoff=10.0, max_backoff=600.0, clock=time.monotonic
+    ):
+        self.name = name
+        self.clock = clock
+        self.max_failures = failures
+        self.base_backoff = backoff
+        self.max_backoff = max_backoff
+        self.state = self.CLOSED
+        self.failures = 0
+        self.backoff = backoff
+        self.retry_time = None
+        self.reason = None  # Error of the last failed read
+        byows_common.metrics.gauge(
+            "byows_sensor_breaker_state",
+            name,
+            lambda: self.STATES.index(self.state),
+        )
+
+    def allow(self):
+        """ Returns whether the sensor should be read now. """
+        if self.state == self.OPEN:
+            if self.clock() < self.retry_time:
+                return False
+            self.state = self.HALF_OPEN
+        return True
+
+    def success(self):
+        if self.state != self.CLOSED:
+            log.info("Sensor %s is back" % self.name)
+        self.state = self.CLOSED
+        self.failures = 0
+        self.backoff = self.base_backoff
+        self.reason = None
+
+    def failure(self, reason):
+        self.failures += 1
+        self.reason = str(reason)
+        if self.state == self.HALF_OPEN:
+            self.backoff = min(self.backoff * 2, self.max_backoff)
+            log.debug(
+                "Sensor %s still failing (%s), next try in %g s"
+                % (self.name, self.reason, self.backoff)
+            )
+        elif self.failures >= self.max_failures:
+            log.error(
+                "Sensor %s failed %d times (%s), next try in %g s"
+                % (self.name, self.failures, self.reason, self.backoff)
+            )
+        else:
+            return
+        self.state = self.OPEN
+        self.retry_time = self.clock() + self.backoff
+
+
+class SensorSampler(threading.Thread):
+    """ Background worker that reads one sensor at its own rate and caches
+    the latest reading, so packets can be built without waiting on I/O. """
+
+    # A reading older than this many sampling intervals is considered stale
+    STALE_INTERVALS = 3
+
+    def __init__(self, name, read_func, interval, breaker=None):
+        super(SensorSampler, self).__init__(name="byows-%s" % name)
+        self.daemon = True
+        self.sensor_name = name
+        self.read_func = read_func
+        self.interval = interval
+        self.breaker = breaker or CircuitBreaker(name)
+        # (value, monotonic timestamp), replaced as a whole so readers never
+        # see a value paired with the wrong timestamp.
+        self.reading = (None, None)
+        # Delay of the first read, so samplers sharing a bus take turns
+        self.phase = 0.0
+        self._ready = threading.Event()
+        self._stop_event = threading.Event()
+
+    def run(self):
+        if self._stop_event.wait(self.phase):
+            return
+        next_run = time.monotonic()
+        while not self._stop_event.is_set():
+            value = self.sample()
+            self.reading = (value, time.monotonic())
+            self._ready.set()
+            next_run += self.interval
+            delay = next_run - time.monotonic()
+            if delay < 0:
+                # The read took longer than the interval, don't try to catch up
+                next_run = time.monotonic()
+                delay = 0
+            self._stop_event.wait(delay)
+
+    def sample(self):
+        """ Reads the sensor once, returns None when the read failed or the
+        breaker of the sensor is open. """
+        if not self.breaker.allow():
+            return None
+        start = time.monotonic()
+        try:
+            value = self.read_func()
+        except Exception as e:
+            log.debug("Error sampling sensor %s: %s" % (self.sensor_name, e))
+            byows_common.metrics.inc("byows_sensor_errors_total", self.sensor_name)
+            self.breaker.failure(e)
+            value = None
+        else:
+            self.breaker.success()
+        byows_common.metrics.observe(
+            "byows_sensor_read_seconds", self.sensor_name, time.monotonic() - start
+        )
+        return value
+
+    def wait_ready(self, timeout=None):
+        """ Blocks until the first reading is cached or timeout expires. """
+        return self._ready.wait(timeout)
+
+    def latest(self):
+        """ Returns the cached value and its age in seconds. Stale readings
+        are returned as None so old data never reaches a packet. """
+        value, stamp = self.reading
+        if stamp is None:
+            return None, None
+        age = time.monotonic() - stamp
+        if age > self.interval * self.STALE_INTERVALS:
+            return None, age
+        return value, age
+
+    def stop(self):
+        self._stop_event.set()
 
 
 class ByowsRpiStation(object):
@@ -91,69 +1278,353 @@ class ByowsRpiStation(object):
 
     CM_IN_A_KM = 100000.0
     SECS_IN_AN_HOUR = 3600
+    RAIN_LOG_SIZE = 1024  # Tips kept in the rain tip log
 
     def __init__(self, **params):
         """ Initialize Object. """
-        self.bme280_address = params.get("bme280_address")
-        self.bme280_bus = smbus2.SMBus(params.get("bme280_port"))
-        self.bme280_sensor = bme280
-        self.bme280_sensor.load_calibration_params(self.bme280_bus, self.bme280_address)
+        self.backend = params.get("backend") or GpiozeroBackend()
+        # Clock of the edges, the rain rate and the breakers
+        self.clock = self.backend.clock
+        # Devices are opened by probe(), they are None until they open
+        self.bme280_sensor = None
+        self.rain_sensor = None
         self.bucket_size = params.get("bucket_size")  # in mm
-        self.rain_count = 0
+        self.rain_debounce = params.get("rain_debounce", 0.1)
+        self.rain_rate_timeout = params.get("rain_rate_timeout", 900.0)
+        # Timestamped log of the tips, the packets read it through their own
+        # cursor, so a tip arriving while a packet is built goes to the next
+        self.tips = PulseRing(self.RAIN_LOG_SIZE, self.clock)
+        self.rain_cursor = self.tips.cursor()
+        self.last_tip = None  # Including bounces, only used by the callback
+        self.rain_tips = 0  # Total number of tips, kept across restarts
+        self.events = params.get("events")
+        byows_common.metrics.gauge(
+            "byows_rain_tips_total", None, lambda: self.rain_tips
+        )
         self.wind_gauge = WindGauge(
             params.get("mcp3008_channel"),
             params.get("anem_pin"),
             params.get("anem_radius_cm"),
             params.get("anem_adjustment"),
+            backend=self.backend,
+            edges=params.get("anem_edges", "callback"),
+            gpiochip=params.get("gpiochip", "/dev/gpiochip0"),
+            buffer_size=params.get("pulse_buffer_size", 4096),
+            stats=WindStatistics(
+                params.get("wind_sample_interval", 0.25),
+                params.get("wind_gust_seconds", 3.0),
+                params.get("wind_average_minutes", [2, 10]),
+            ),
+            vane_sample_rate=params.get("vane_sample_rate", 10.0),
+            vane_tolerance=params.get("vane_tolerance", 0.1),
+            vane_calibration_file=params.get("vane_calibration_file"),
+            open_devices=False,
+            wind_rose=params.get("wind_rose", False),
+        )
+        if self.backend.trace is not None:
+            # Taken from the ring, so the edges are recorded however they are read
+            self.backend.trace.watch(TraceWriter.ANEMOMETER, self.wind_gauge.pulses)
+        self.rain_bucket_pin = params.get("rain_bucket_pin")
+        self.probes = SensorProbes(
+            params.get("sensor_probe_timeout", 2.0),
+            params.get("sensor_retry_interval", 60.0),
+        )
+        # Every I2C device of a port shares its handle
+        self.i2c = I2cBusManager(self.backend.i2c_bus)
+        self.probes.add(
+            "bme280",
+            functools.partial(
+                self.open_i2c_device,
+                params.get("bme280_port"),
+                functools.partial(
+                    Bme280,
+                    address=params.get("bme280_address"),
+                    **params.get("bme280_settings", {})
+                ),
+            ),
+            functools.partial(setattr, self, "bme280_sensor"),
+        )
+        self.i2c_devices = [
+            I2cDevice(name, options)
+            for name, options in sorted(params.get("i2c_devices", {}).items())
+        ]
+        for device in self.i2c_devices:
+            self.probes.add(
+                device.sensor_name,
+                functools.partial(self.open_i2c_device, device.port, device.open),
+                functools.partial(setattr, device, "sensor"),
+            )
+        self.adc_map = None
+        if params.get("mcp3008_channels"):
+            # The vane and the channel map share one SPI bulk reader
+            self.adc_map = AdcChannelMap(
+                params["mcp3008_channels"],
+                params.get("mcp3008_vref", 3.3),
+                params.get("mcp3008_oversampling", 4),
+            )
+            self.probes.add(
+                "mcp3008",
+                functools.partial(
+                    self.backend.mcp3008_bus,
+                    params.get("mcp3008_device", "/dev/spidev0.0"),
+                    params.get("mcp3008_speed_hz", 1000000),
+                ),
+                self.set_mcp3008_bus,
+            )
+        else:
+            self.probes.add(
+                "vane",
+                self.wind_gauge.open_vane,
+                functools.partial(setattr, self.wind_gauge, "adc"),
+            )
+        self.probes.add(
+            "anemometer",
+            self.wind_gauge.open_anemometer,
+            functools.partial(setattr, self.wind_gauge, "wind_speed_sensor"),
+        )
+        self.probes.add(
+            "rain",
+            self.open_rain_sensor,
+            functools.partial(setattr, self, "rain_sensor"),
         )
-        self.rain_sensor = Button(params.get("rain_bucket_pin"))
-        self.rain_sensor.when_pressed = self.bucket_tipped
-        self.temp_probe = DS18B20()
+        self.probes.probe()
+        breaker_settings = dict(params.get("breaker_settings", {}), clock=self.clock)
+        self.temp_probes = DS18B20Bus(
+            self.backend.w1_devices_dir,
+            params.get("ds18b20_probes"),
+            params.get("ds18b20_rescan_interval", 300),
+            breaker_settings,
+            self.backend.trace,
+            self.clock,
+        )
+        self.samplers = dict()
+        for name, read_func, interval in (
+            ("bme280", self.get_bme280_data, params.get("bme280_interval", 2.5)),
+            ("ds18b20", self.get_probe_temps, params.get("ds18b20_interval", 5.0)),
+            ("wind", self.sample_wind, params.get("wind_sample_interval", 0.25)),
+            (
+                "vane",
+                self.wind_gauge.sample_vane,
+                1.0 / params.get("vane_sample_rate", 10.0),
+            ),
+            ("mcp3008", self.get_adc_data, params.get("mcp3008_interval", 5.0)),
+        ):
+            if name == "mcp3008" and self.adc_map is None:
+                continue
+            self.samplers[name] = SensorSampler(
+                name, read_func, interval, CircuitBreaker(name, **breaker_settings)
+            )
+        for device in self.i2c_devices:
+            self.samplers[device.sensor_name] = SensorSampler(
+                device.sensor_name,
+                device.read,
+                device.interval,
+                CircuitBreaker(device.sensor_name, **breaker_settings),
+            )
+        self.stagger_i2c_samplers(params.get("bme280_port"))
+        # Age of the reading of each sensor put in the last packet, the wind
+        # and vane samplers feed the wind gauge instead
+        self.ages = dict()
+        for name in set(self.samplers) - {"wind", "vane"}:
+            byows_common.metrics.gauge(
+                "byows_sensor_age_seconds",
+                name,
+                functools.partial(self.reading_age, name),
+            )
+        self.started = False
 
-    def bucket_tipped(self):
-        self.rain_count = self.rain_count + 1
+    def start(self):
+        """ Starts the background samplers and waits for their first reading,
+        all at once, for at most the longest sampling interval. """
+        if self.started:
+            return
+        for sampler in self.samplers.values():
+            sampler.start()
+        deadline = time.monotonic() + max(
+            sampler.interval for sampler in self.samplers.values()
+        )
+        for sampler in self.samplers.values():
+            if not sampler.wait_ready(max(deadline - time.monotonic(), 0)):
+                log.info("No first reading from %s yet" % sampler.sensor_name)
+        self.started = True
+
+    def stop(self):
+        self.probes.close()
+        for sampler in self.samplers.values():
+            sampler.stop()
+        self.temp_probes.close()
+        if self.adc_map is not None and self.adc_map.bus is not None:
+            self.adc_map.bus.close()
+        self.i2c.close()
+        self.started = False
+
+    def latest(self, name):
+        """ Returns the latest cached reading of a sensor and its age. When
+        the samplers are not running, the sensor is read synchronously. """
+        sampler = self.samplers[name]
+        if not self.started:
+            value, age = sampler.sample(), 0.0
+        else:
+            value, age = sampler.latest()
+        self.ages[name] = age
+        return value, age
+
+    def reading_age(self, name):
+        """ Returns the age of the reading of a sensor in the last packet, NaN
+        when it had none. """
+        age = self.ages.get(name)
+        return float("nan") if age is None else age
+
+    def health(self):
+        """ Returns the breaker state and the last error of every sensor. """
+        breakers = [sampler.breaker for sampler in self.samplers.values()]
+        breakers.extend(self.temp_probes.breakers())
+        return dict(
+            (breaker.name, (breaker.state, breaker.reason)) for breaker in breakers
+        )
+
+    def open_i2c_device(self, port, open_func):
+        """ Opens a device with open_func on the shared bus of its port. """
+        return open_func(self.i2c.bus(port))
+
+    def stagger_i2c_samplers(self, bme280_port):
+        """ Spreads the first reads of the devices of each I2C port over the
+        shortest interval among them, so their reads seldom wait for each
+        other, whatever their number. """
+        ports = collections.defaultdict(list)
+        ports[bme280_port].append(self.samplers["bme280"])
+        for device in self.i2c_devices:
+            ports[device.port].append(self.samplers[device.sensor_name])
+        for samplers in ports.values():
+            spacing = min(sampler.interval for sampler in samplers) / len(samplers)
+            for n, sampler in enumerate(samplers):
+                sampler.phase = n * spacing
+
+    def set_mcp3008_bus(self, bus):
+        self.adc_map.bus = bus
+        self.wind_gauge.adc = Mcp3008Channel(bus, self.wind_gauge.channel)
+
+    def get_adc_data(self):
+        """ Returns the fields of the MCP3008 channel map. """
+        if self.adc_map.bus is None:
+            return None
+        return self.adc_map.read()
+
+    def open_rain_sensor(self):
+        rain_sensor = self.backend.button(self.rain_bucket_pin)
+        rain_sensor.when_pressed = self.bucket_tipped
+        return rain_sensor
+
+    def bucket_tipped(self, stamp=None):
+        """ Logs a tip of the bucket, unless it follows the previous edge by
+        less than rain_debounce seconds: the bounce of the reed switch. """
+        if stamp is None:
+            stamp = self.clock()
+        last_tip, self.last_tip = self.last_tip, stamp
+        if last_tip is not None and stamp - last_tip < self.rain_debounce:
+            byows_common.metrics.inc("byows_rain_bounces_total")
+            return
+        self.tips.append(stamp)
+        self.rain_tips += 1
+        if self.events is not None:
+            self.events.trigger("rain")
+
+    def sample_wind(self):
+        self.wind_gauge.sample()
+        if self.events is not None:
+            self.events.check_gust(self.wind_gauge.stats.current_gust())
 
     def get_bme280_data(self):
-        try:
-            data = self.bme280_sensor.sample(self.bme280_bus, self.bme280_address)
-            humidity = data.humidity
-            pressure = data.pressure
-            temperature = data.temperature
-        except:
-            log.debug("Error sampling sensor bme280, passing None as data.")
-            humidity, pressure, temperature = None, None, None
-            pass
+        if self.bme280_sensor is None:
+            return None
+        # Errors are counted by the sampler and trip the bme280 breaker
+        humidity, pressure, temperature = self.bme280_sensor.sample()
+        if self.events is not None:
+            self.events.check_pressure(pressure)
         return humidity, pressure, temperature
 
-    def get_soil_temp(self):
-        return self.temp_probe.read_temp()
+    def get_probe_temps(self):
+        """ Returns the temperature of every DS18B20 probe by weeWX field. """
+        return self.temp_probes.read_temps()
 
     def get_rainfall(self):
-        """ Returns rainfall in cm. """
-        rainfall = (self.rain_count * self.bucket_size) / 10.0
-        self.reset_rainfall()
-        return rainfall
+        """ Returns rainfall in cm since the last call. """
+        return (self.rain_cursor.take_count() * self.bucket_size) / 10.0
+
+    def get_rain_rate(self, now=None):
+        """ Returns the rain rate in cm/h from the interval between the last
+        two tips. Without a new tip, the rate decays as if one was about to
+        arrive, and is 0 once no tip arrived in rain_rate_timeout seconds. """
+        if now is None:
+            now = self.clock()
+        count = self.tips.count
+        if count < 2:
+            return 0.0
+        last_tip = self.tips.stamps[(count - 1) % self.tips.size]
+        previous_tip = self.tips.stamps[(count - 2) % self.tips.size]
+        interval = max(last_tip - previous_tip, now - last_tip)
+        if interval > self.rain_rate_timeout or interval <= 0:
+            return 0.0
+        return self.bucket_size / 10.0 * self.SECS_IN_AN_HOUR / interval
 
     def get_data(self):
         """ Generates data packets every time interval. """
         data = dict()
-        anem_rotations = self.wind_gauge.wind_count / 2.0
-        time_interval = self.wind_gauge.last_wind_time - time.time()
         wind_speed, wind_dir = self.wind_gauge.get_wind()
-        humidity, pressure, ambient_temp = self.get_bme280_data()
-        data["outHumidity"] = humidity
-        data["pressure"] = pressure
-        data["outTemp"] = ambient_temp
-        data["soilTemp1"] = self.get_soil_temp()
-        data["windSpeed"] = float(wind_speed)
-        data["windDir"] = wind_dir
-        data["rain"] = float(self.get_rainfall())
-        data["anemRotations"] = anem_rotations
-        data["timeAnemInterval"] = time_interval
+        anem_rotations = self.wind_gauge.last_pulses / 2.0
+        time_interval = self.wind_gauge.last_interval
+        bme280_data, _ = self.latest("bme280")
+        humidity, pressure, ambient_temp = bme280_data or (None, None, None)
+        probe_temps, _ = self.latest("ds18b20")
+        # The fields of the sensors that did not open are left out
+        if self.bme280_sensor is not None:
+            data["outHumidity"] = humidity
+            data["pressure"] = pressure
+            data["outTemp"] = ambient_temp
+        for field in self.temp_probes.fields():
+            data[field] = (probe_temps or {}).get(field)
+        anemometer = self.wind_gauge.wind_speed_sensor is not None
+        if anemometer:
+            data["windSpeed"] = float(wind_speed)
+        if self.wind_gauge.adc is not None:
+            data["windDir"] = wind_dir
+        if anemometer:
+            data.update(self.wind_gauge.stats.get_data())
+        for device in self.i2c_devices:
+            if device.sensor is not None:
+                readings, _ = self.latest(device.sensor_name)
+                for field in device.fields.values():
+                    data[field] = (readings or {}).get(field)
+        if self.adc_map is not None and self.adc_map.bus is not None:
+            adc_data, _ = self.latest("mcp3008")
+            for field in self.adc_map.fields:
+                data[field] = (adc_data or {}).get(field)
+        if self.rain_sensor is not None:
+            data["rain"] = float(self.get_rainfall())
+            data["rainRate"] = self.get_rain_rate()
+        if anemometer:
+            data["anemRotations"] = anem_rotations
+            data["timeAnemInterval"] = time_interval
+        return data
+
+    def get_event_data(self, kinds):
+        """ Returns the fields of a partial packet for the given events. """
+        data = dict()
+        if "rain" in kinds:
+            data["rain"] = float(self.get_rainfall())
+            data["rainRate"] = self.get_rain_rate()
+        if "gust" in kinds:
+            data.update(self.wind_gauge.stats.get_data())
+        if "pressure" in kinds:
+            bme280_data, _ = self.latest("bme280")
+            humidity, pressure, ambient_temp = bme280_data or (None, None, None)
+            data["outHumidity"] = humidity
+            data["pressure"] = pressure
+            data["outTemp"] = ambient_temp
         return data
 
     def reset_rainfall(self):
-        self.rain_count = 0
+        self.rain_cursor.take_count()
 
 
 class DS18B20(object):
@@ -163,15 +1634,40 @@ class DS18B20(object):
     w1-therm
     """
 
-    def __init__(self):
-        w1_devices = glob.glob("/sys/bus/w1/devices/28*")
+    def __init__(self, w1_devices_dir="/sys/bus/w1/devices", serial=None, trace=None):
+        if serial is not None:
+            w1_devices = [os.path.join(w1_devices_dir, serial)]
+        else:
+            w1_devices = glob.glob(os.path.join(w1_devices_dir, "28*"))
+        self.serial = os.path.basename(w1_devices[0]) if len(w1_devices) > 0 else None
+        self.trace = trace  # TraceWriter recording what is read, if any
         self.device_file = w1_devices[0] + "/w1_slave" if len(w1_devices) > 0 else None
+        # Newer w1-therm modules also have a temperature file, which returns
+        # the result of a bulk conversion without starting a new one.
+        self.temperature_file = (
+            w1_devices[0] + "/temperature" if len(w1_devices) > 0 else None
+        )
+
+    def has_temperature_file(self):
+        return self.temperature_file is not None and os.path.exists(
+            self.temperature_file
+        )
+
+    def read_converted_temp(self):
+        """ Returns the temperature converted by a bulk read, in C. """
+        with open(self.temperature_file, "r") as f:
+            content = f.read()
+        if self.trace is not None:
+            self.trace.w1(self.serial, "temperature", content)
+        return float(content.strip()) / 1000.0
 
     def read_temp_raw(self):
         if self.device_file != None:
             f = open(self.device_file, "r")
             lines = f.readlines()
             f.close()
+            if self.trace is not None:
+                self.trace.w1(self.serial, "w1_slave", "".join(lines))
             return lines
         else:
             return None
@@ -183,30 +1679,205 @@ class DS18B20(object):
             return False
 
     def read_temp(self):
-        temp_c = -255
+        """ Returns the temperature in C. Raises IOError when the probe is
+        missing or its reading fails the CRC check, instead of returning a
+        temperature that could pass for a real one. """
         attempts = 0
 
         lines = self.read_temp_raw()
 
-        if lines != None:
+        if lines is None:
+            raise IOError("No DS18B20 on the 1-Wire bus")
+        success = self.crc_check(lines)
+
+        while not success and attempts < 3:
+            byows_common.metrics.inc("byows_sensor_retries_total", "ds18b20")
+            time.sleep(0.2)
+            lines = self.read_temp_raw()
             success = self.crc_check(lines)
+            attempts += 1
 
-            while not success and attempts < 3:
-                time.sleep(0.2)
-                lines = self.read_temp_raw()
-                success = self.crc_check(lines)
-                attempts += 1
+        if not success:
+            raise IOError("DS18B20 CRC check failed %d times" % (attempts + 1))
+        temp_line = lines[1]
+        equal_pos = temp_line.find("t=")
+        if equal_pos == -1:
+            raise IOError("No temperature in the DS18B20 reading")
+        return float(temp_line[equal_pos + 2 :]) / 1000.0
 
-            if success:
-                temp_line = lines[1]
-                equal_pos = temp_line.find("t=")
-                if equal_pos != -1:
-                    temp_string = temp_line[equal_pos + 2 :]
-                    temp_c = float(temp_string) / 1000.0
 
-            return temp_c
-        else:
-            return None
+class DS18B20Bus(object):
+    """ All the DS18B20 probes on the 1-Wire bus. The probes are read
+    concurrently, so a read costs one conversion whatever the number of
+    probes, and the bus is rescanned for new or removed probes every
+    rescan_interval seconds.
+
+    fields maps probe serials (28-xxxxxxxxxxxx) to weeWX fields, probes not
+    in it get the first free field of AUTO_FIELDS in order of discovery.
+    Every probe has its own CircuitBreaker, a dead probe reports None and is
+    not read until its breaker lets it be tried again. """
+
+    AUTO_FIELDS = (
+        "soilTemp1",
+        "soilTemp2",
+        "soilTemp3",
+        "soilTemp4",
+        "extraTemp1",
+        "extraTemp2",
+        "extraTemp3",
+    )
+    MAX_WORKERS = 8
+    # 12 bit conversions take up to 750 ms
+    BULK_CONVERSION_TIMEOUT = 1.5
+    BULK_POLL_INTERVAL = 0.05
+
+    def __init__(
+        self,
+        w1_devices_dir="/sys/bus/w1/devices",
+        fields=None,
+        rescan_interval=300,
+        breaker_settings=None,
+        trace=None,
+        clock=time.monotonic,
+    ):
+        self.w1_devices_dir = w1_devices_dir
+        self.trace = trace
+        self.clock = clock
+        self.breaker_settings = breaker_settings or {}
+        self.probe_breakers = {}  # serial -> CircuitBreaker
+        self.assigned = dict(fields or {})  # serial -> weeWX field
+        self.rescan_interval = rescan_interval
+        self.probes = {}  # serial -> DS18B20 of the probes present
+        self.next_scan = 0
+        self.bulk_files = []  # therm_bulk_read of every bus master
+        self.lock = threading.Lock()
+        self.executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=self.MAX_WORKERS, thread_name_prefix="byows-ds18b20"
+        )
+        self.rescan()
+
+    def rescan(self):
+        """ Adds the probes that appeared on the bus and drops the ones
+        that are gone. """
+        self.next_scan = self.clock() + self.rescan_interval
+        found = sorted(
+            os.path.basename(path)
+            for path in glob.glob(os.path.join(self.w1_devices_dir, "28*"))
+        )
+        with self.lock:
+            for serial in found:
+                if serial in self.probes:
+                    continue
+                if serial not in self.assigned:
+                    free = [
+                        field
+                        for field in self.AUTO_FIELDS
+                        if field not in self.assigned.values()
+                    ]
+                    if not free:
+                        log.info("No free field for DS18B20 probe %s" % serial)
+                        continue
+                    self.assigned[serial] = free[0]
+                self.probes[serial] = DS18B20(self.w1_devices_dir, serial, self.trace)
+                if serial not in self.probe_breakers:
+                    self.probe_breakers[serial] = CircuitBreaker(
+                        "ds18b20_%s" % serial, **self.breaker_settings
+                    )
+                log.info(
+                    "Found DS18B20 probe %s, reported as %s"
+                    % (serial, self.assigned[serial])
+                )
+            for serial in set(self.probes) - set(found):
+                log.info("DS18B20 probe %s is gone" % serial)
+                del self.probes[serial]
+            bulk_files = glob.glob(
+                os.path.join(self.w1_devices_dir, "w1_bus_master*", "therm_bulk_read")
+            )
+            if bool(bulk_files) != bool(self.bulk_files):
+                log.info(
+                    "%s DS18B20 bulk conversions"
+                    % ("Using" if bulk_files else "Not using")
+                )
+            self.bulk_files = bulk_files
+
+    def bulk_convert(self):
+        """ Starts a simultaneous conversion on every probe of every bus master
+        and waits for it to finish. Returns False if it could not be done. """
+        try:
+            for path in self.bulk_files:
+                with open(path, "w") as f:
+                    f.write("trigger\n")
+            deadline = time.monotonic() + self.BULK_CONVERSION_TIMEOUT
+            pending = list(self.bulk_files)
+            while pending:
+                # -1 means at least one probe is still converting
+                pending = [path for path in pending if read_sysfs(path) == "-1"]
+                if pending and time.monotonic() > deadline:
+                    byows_common.metrics.inc(
+                        "byows_sensor_errors_total", "ds18b20_bulk"
+                    )
+                    return False
+                if pending:
+                    time.sleep(self.BULK_POLL_INTERVAL)
+        except (IOError, OSError) as e:
+            log.debug("Error in DS18B20 bulk conversion: %s" % e)
+            byows_common.metrics.inc("byows_sensor_errors_total", "ds18b20_bulk")
+            return False
+        return True
+
+    def fields(self):
+        """ Returns the weeWX fields of the probes configured or found so far.
+        Fields of missing probes are kept, so they report None. """
+        with self.lock:
+            return sorted(set(self.assigned.values()))
+
+    def read_temps(self):
+        """ Returns the temperature of every probe by weeWX field. """
+        if self.clock() >= self.next_scan:
+            self.rescan()
+        with self.lock:
+            probes = list(self.probes.items())
+        temps = dict()
+        allowed = []
+        for serial, probe in probes:
+            if self.probe_breakers[serial].allow():
+                allowed.append((serial, probe))
+            else:
+                temps[self.assigned[serial]] = None
+        probes = allowed
+        if probes and self.bulk_files and self.bulk_convert():
+            slow_probes = []
+            for serial, probe in probes:
+                try:
+                    temps[self.assigned[serial]] = probe.read_converted_temp()
+                except (IOError, OSError, ValueError, TypeError):
+                    slow_probes.append((serial, probe))
+                else:
+                    self.probe_breakers[serial].success()
+            probes = slow_probes
+        # Probes without bulk conversions start their own when w1_slave is read
+        futures = [
+            (serial, self.executor.submit(probe.read_temp)) for serial, probe in probes
+        ]
+        for serial, future in futures:
+            field = self.assigned[serial]
+            try:
+                temps[field] = future.result()
+            except Exception as e:
+                log.debug("Error reading DS18B20 for %s: %s" % (field, e))
+                byows_common.metrics.inc("byows_sensor_errors_total", "ds18b20")
+                self.probe_breakers[serial].failure(e)
+                temps[field] = None
+            else:
+                self.probe_breakers[serial].success()
+        return temps
+
+    def breakers(self):
+        with self.lock:
+            return list(self.probe_breakers.values())
+
+    def close(self):
+        self.executor.shutdown(wait=False)
 
 
 class WindGauge(object):
@@ -232,39 +1903,149 @@ class WindGauge(object):
     }
     CM_IN_A_KM = 100000.0
     SECS_IN_AN_HOUR = 3600
+    VREF = 3.3  # MCP3008 reference voltage
+    ADC_MAX = 1023  # Highest 10 bit MCP3008 code
 
-    def __init__(self, channel=0, anem_pin=5, anem_radius=9.0, anem_adjustment=1.18):
+    def __init__(
+        self,
+        channel=0,
+        anem_pin=5,
+        anem_radius=9.0,
+        anem_adjustment=1.18,
+        backend=None,
+        edges="callback",
+        gpiochip="/dev/gpiochip0",
+        buffer_size=4096,
+        stats=None,
+        vane_sample_rate=10.0,
+        vane_tolerance=0.1,
+        vane_calibration_file=None,
+        open_devices=True,
+        wind_rose=False,
+    ):
+        self.backend = backend or GpiozeroBackend()
         # pass channel of MCP3008 where wind vane is connected to
-        self.adc = MCP3008(channel)
+        self.channel = channel
+        self.anem_pin = anem_pin
+        self.edges = edges
+        self.gpiochip = gpiochip
+        # Opened here, or by the station's probes when open_devices is False
+        self.adc = None
+        self.wind_speed_sensor = None
+        # Wind direction of every raw ADC code, None for undecodable codes
+        if vane_calibration_file:
+            vane_codes = load_vane_calibration(vane_calibration_file)
+            log.info("Loaded wind vane calibration %s" % vane_calibration_file)
+        else:
+            vane_codes = self.nominal_vane_codes()
+        self.vane_table = build_vane_table(
+            vane_codes, vane_tolerance / self.VREF * self.ADC_MAX
+        )
+        self.decode_misses = 0
+        byows_common.metrics.gauge(
+            "byows_vane_decode_misses_total", None, lambda: self.decode_misses
+        )
+        byows_common.metrics.gauge(
+            "byows_vane_samples_total", None, lambda: self.vane.count
+        )
+        byows_common.metrics.gauge(
+            "byows_anemometer_pulses_total", None, lambda: self.pulses.count
+        )
+        byows_common.metrics.gauge(
+            "byows_anemometer_pulse_overruns_total",
+            None,
+            lambda: self.cursor.overruns + self.stats_cursor.overruns,
+        )
 
-        self.wind_count = 0  # Counts how many half-rotations
-        self.last_wind_time = time.time()
-        self.wind_speed_sensor = Button(anem_pin)
-        self.wind_speed_sensor.when_pressed = self.spin
+        # Every half-rotation is stored with its timestamp
+        self.pulses = PulseRing(buffer_size, self.backend.clock)
+        self.cursor = self.pulses.cursor()
+        # Gusts and rolling averages are fed from their own cursor by sample()
+        self.stats = stats or WindStatistics(0.25)
+        self.stats_cursor = self.pulses.cursor()
+        # Keep a minute of wind vane samples, plenty for any loop interval
+        self.vane_sample_rate = vane_sample_rate
+        self.vane = VaneSampler(self.read_direction, int(vane_sample_rate * 60))
+        # Fed with every vane sample and the latest wind speed sample
+        self.rose = WindRose() if wind_rose else None
+        self.latest_speed = 0.0
+        self.last_resultant = None
+        self.last_pulses = 0
+        self.last_interval = 0.0
         self.anemometer_radius_cm = anem_radius  # Radius of your anemometer
         self.anemometer_adjustment = anem_adjustment
+        if open_devices:
+            self.adc = self.open_vane()
+            self.wind_speed_sensor = self.open_anemometer()
+
+    def open_vane(self):
+        return self.backend.adc(self.channel)
+
+    def open_anemometer(self):
+        if self.edges == "cdev":
+            return GpioCdevEdgeReader(self.gpiochip, self.anem_pin, self.pulses.extend)
+        wind_speed_sensor = self.backend.button(self.anem_pin)
+        wind_speed_sensor.when_pressed = self.pulses.append
+        return wind_speed_sensor
+
+    @property
+    def wind_count(self):
+        """ Half-rotations not consumed by get_wind_speed yet. """
+        return self.cursor.pending()
 
     # Every half-rotations, add 1 to count
     def spin(self):
-        self.wind_count = self.wind_count + 1
+        self.pulses.append()
 
     def reset_wind(self):
-        self.wind_count = 0
-        self.last_wind_time = time.time()
+        self.cursor.take_count()
 
     def get_wind_speed(self):
-        """ Function that returns wind speed in km/hr. """
-        wind_speed = self.calculate_speed(time.time() - self.last_wind_time)
-        self.reset_wind()  # reset wind_count and last time reading
-        return wind_speed
+        """ Function that returns wind speed in km/hr. Every pulse is counted
+        in exactly one call, pulses arriving during the call are left for the
+        next one. """
+        start = self.cursor.last_time
+        self.last_pulses = self.cursor.take_count()
+        self.last_interval = self.cursor.last_time - start
+        if self.last_interval <= 0:
+            return 0.0
+        return self.calculate_speed(self.last_interval, self.last_pulses)
+
+    def sample(self):
+        """ Feeds the wind statistics with the wind since the last sample,
+        called every stats.sample_interval seconds. """
+        start = self.stats_cursor.last_time
+        pulses = self.stats_cursor.take_count()
+        interval = self.stats_cursor.last_time - start
+        if interval > 0:
+            self.latest_speed = self.calculate_speed(interval, pulses)
+            self.stats.add(self.latest_speed, self.vane.latest)
+
+    def sample_vane(self):
+        """ Samples the wind vane, called vane_sample_rate times a second. """
+        direction = self.vane.sample()
+        if direction is not None and self.rose is not None:
+            self.rose.add(direction, self.latest_speed, self.pulses.clock())
+        return direction
+
+    def close(self):
+        if self.wind_speed_sensor is not None:
+            self.wind_speed_sensor.close()
 
     def get_wind(self, length=5):
-        """ Function that returns wind as a vector: speed, direction."""
-        return self.get_wind_speed(), self.read_direction()
+        """ Function that returns wind as a vector: speed, direction. The
+        direction is the circular mean of the vane samples since the last call,
+        or a single reading when the vane is not being sampled. """
+        direction, self.last_resultant = self.vane.take_average()
+        if direction is None and self.vane.count == 0:
+            direction = self.read_direction()
+        return self.get_wind_speed(), direction
 
-    def calculate_speed(self, time_sec):
+    def calculate_speed(self, time_sec, pulses=None):
+        if pulses is None:
+            pulses = self.wind_count
         circumference_cm = (2 * math.pi) * self.anemometer_radius_cm
-        rotations = self.wind_count / 2.0
+        rotations = pulses / 2.0
         # Calculate distance travelled by a cup in km
         dist_km = (circumference_cm * rotations) / self.CM_IN_A_KM
         # Speed = distance / time
@@ -274,61 +2055,1442 @@ class WindGauge(object):
         final_speed = km_per_hour * self.anemometer_adjustment
         return final_speed
 
-    def read_direction(self):
-        wind = round(self.adc.value * 3.3, 1)
+    @classmethod
+    def nominal_vane_codes(cls):
+        """ Returns the ADC code of each WIND_VANE_VOLTS voltage and its
+        direction. """
+        return dict(
+            (volts / cls.VREF * cls.ADC_MAX, direction)
+            for volts, direction in cls.WIND_VANE_VOLTS.items()
+        )
 
-        if not wind in self.WIND_VANE_VOLTS:  # keep only good measurements
-            log.debug("Unknown Wind Vane value: %s" % str(wind))
+    def read_direction(self):
+        if self.adc is None:
             return None
-        else:
-            return self.WIND_VANE_VOLTS[wind]
+        direction = self.vane_table[self.adc.raw_value]
+        if direction is None:  # keep only good measurements
+            self.decode_misses += 1
+        return direction
 
     def get_average_direction(self, length=5):
-        # Get the average wind direction in a length of time in seconds
+        # Get the average wind direction in a length of time in seconds,
+        # sampling at vane_sample_rate instead of spinning on the ADC.
         data = []
-        # print("Measuring wind direction for %d seconds..." % length)
-        start_time = time.time()
-        while time.time() - start_time <= length:
+        period = 1.0 / self.vane_sample_rate
+        start_time = time.monotonic()
+        next_read = start_time
+        while next_read - start_time <= length:
             direction = self.read_direction()
             if direction is not None:
                 data.append(direction)
+            next_read += period
+            time.sleep(max(next_read - time.monotonic(), 0.0))
         return get_average(data)
 
 
+class VaneSampler(object):
+    """ Stores paced wind vane readings in a preallocated buffer, NaN where
+    the reading could not be decoded. The samples since the last take are
+    averaged in one vectorized pass. """
+
+    def __init__(self, read_direction, size):
+        self.read_direction = read_direction
+        self.size = max(size, 1)
+        if numpy is not None:
+            self.angles = numpy.full(self.size, numpy.nan)
+        else:
+            self.angles = array.array("d", [float("nan")]) * self.size
+        self.count = 0  # Total number of samples ever stored
+        self.position = 0  # First sample not averaged yet
+        self.latest = None
+
+    def sample(self):
+        direction = self.read_direction()
+        self.angles[self.count % self.size] = (
+            float("nan") if direction is None else direction
+        )
+        self.count += 1
+        self.latest = direction
+        return direction
+
+    def take(self):
+        """ Returns the samples stored since the last take. """
+        head = self.count
+        start = max(self.position, head - self.size)
+        self.position = head
+        first, last = start % self.size, head % self.size
+        if head - start == self.size or (head > start and last <= first):
+            if numpy is not None:
+                return numpy.concatenate((self.angles[first:], self.angles[:last]))
+            return self.angles[first:] + self.angles[:last]
+        return self.angles[first:last]
+
+    def take_average(self):
+        """ Returns the circular mean of the samples since the last take and
+        the mean resultant length, 1.0 for a steady wind down to 0.0 when the
+        direction is meaningless. """
+        return circular_mean(self.take())
+
+
+class WindRose(object):
+    """ Wind rose of the vane samples since the last take, accumulated in a
+    single pass with constant memory: the wind run (speed times time) summed
+    in each of the 16 compass sectors, and the time weighted sums of the
+    sines and cosines of the directions for their standard deviation by the
+    Yamartino method. Each sample stands for the time since the previous
+    one, at most MAX_GAP seconds, so the result does not depend on the vane
+    sample rate, which the adaptive sampling changes.
+
+    Samples are added by the vane sampler thread and taken by the loop, the
+    lock keeps a take from splitting a sample. """
+
+    SECTORS = (
+        "N", "NNE", "NE", "ENE", "E", "ESE", "SE", "SSE",
+        "S", "SSW", "SW", "WSW", "W", "WNW", "NW", "NNW",
+    )  # fmt: skip
+    SECTOR_WIDTH = 360.0 / len(SECTORS)
+    FIELDS = tuple("windRose" + name for name in SECTORS)
+    # 2 / sqrt(3) - 1, the coefficient of the Yamartino approximation
+    YAMARTINO = 0.1547005383792515
+    # Longest time a sample stands for, after a gap in the vane samples
+    MAX_GAP = 5.0
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.last_time = None  # Of the previous sample, kept across takes
+        self.reset()
+
+    def reset(self):
+        self.runs = array.array("d", [0.0]) * len(self.SECTORS)
+        self.duration = 0.0
+        self.sin_sum = 0.0
+        self.cos_sum = 0.0
+
+    def add(self, direction, speed, now):
+        sector = int((direction + self.SECTOR_WIDTH / 2) // self.SECTOR_WIDTH)
+        r = math.radians(direction)
+        with self.lock:
+            if self.last_time is None:
+                self.last_time = now
+                return
+            dt = min(now - self.last_time, self.MAX_GAP)
+            self.last_time = now
+            self.runs[sector % len(self.SECTORS)] += (speed or 0.0) * dt
+            self.duration += dt
+            self.sin_sum += math.sin(r) * dt
+            self.cos_sum += math.cos(r) * dt
+
+    def take(self):
+        """ Returns the wind rose fields of the samples since the last take:
+        the share of the wind run of each sector in percent, the direction of
+        the dominant sector and the standard deviation of the directions, None
+        without samples or without wind. """
+        with self.lock:
+            runs, duration = self.runs, self.duration
+            sin_sum, cos_sum = self.sin_sum, self.cos_sum
+            self.reset()
+        fields = dict.fromkeys(self.FIELDS)
+        fields["windRoseDir"] = None
+        fields["windRoseStdDev"] = None
+        if duration <= 0:
+            return fields
+        # 1 - R^2 is the squared epsilon of Yamartino, R the mean resultant
+        resultant = (sin_sum * sin_sum + cos_sum * cos_sum) / (duration * duration)
+        epsilon = math.sqrt(max(1.0 - resultant, 0.0))
+        fields["windRoseStdDev"] = math.degrees(
+            math.asin(epsilon) * (1.0 + self.YAMARTINO * epsilon ** 3)
+        )
+        total = math.fsum(runs)
+        if total > 0:
+            for field, run in zip(self.FIELDS, runs):
+                fields[field] = 100.0 * run / total
+            dominant = max(range(len(runs)), key=runs.__getitem__)
+            fields["windRoseDir"] = dominant * self.SECTOR_WIDTH
+        return fields
+
+
+class Mcp3008Spi(object):
+    """ MCP3008 on a hardware SPI bus, read through the spidev ioctl
+    interface. A scan of several channels, each sampled oversampling times,
+    is one SPI_IOC_MESSAGE with a 3 byte transfer per conversion and the
+    chip select released between them: a single system call, where a
+    gpiozero MCP3008 costs one per reading. The messages are built once per
+    set of channels. The bus is shared by every user under a lock. """
+
+    SPI_IOC_WR_MODE = 0x40016B01
+    SPI_IOC_WR_MAX_SPEED_HZ = 0x40046B04
+    TRANSFER = struct.Struct("=QQIIHBBBBBB")  # struct spi_ioc_transfer
+    # The size of an ioctl argument is a 14 bit field
+    MAX_TRANSFERS = ((1 << 14) - 1) // TRANSFER.size
+
+    def __init__(self, device="/dev/spidev0.0", speed_hz=1000000):
+        self.device = device
+        self.speed_hz = speed_hz
+        self.fd = os.open(device, os.O_RDWR)
+        try:
+            fcntl.ioctl(self.fd, self.SPI_IOC_WR_MODE, struct.pack("=B", 0))
+            fcntl.ioctl(
+                self.fd, self.SPI_IOC_WR_MAX_SPEED_HZ, struct.pack("=I", speed_hz)
+            )
+        except (IOError, OSError):
+            os.close(self.fd)
+            raise
+        self.lock = threading.Lock()
+        self.messages = dict()  # (channels, oversampling) -> prepared message
+
+    def message(self, channels, oversampling):
+        """ Returns the ioctl request, the transfers and the buffers of a
+        scan, building them the first time. """
+        key = (channels, oversampling)
+        if key not in self.messages:
+            count = len(channels) * oversampling
+            tx = ctypes.create_string_buffer(3 * count)
+            rx = ctypes.create_string_buffer(3 * count)
+            transfers = bytearray(self.TRANSFER.size * count)
+            for i in range(count):
+                channel = channels[i % len(channels)]
+                # Start bit, single ended mode and the channel number
+                tx[3 * i : 3 * i + 3] = bytes((0x01, 0x80 | channel << 4, 0x00))
+                self.TRANSFER.pack_into(
+                    transfers,
+                    i * self.TRANSFER.size,
+                    ctypes.addressof(tx) + 3 * i,
+                    ctypes.addressof(rx) + 3 * i,
+                    3,
+                    self.speed_hz,
+                    0,
+                    8,
+                    # Release the chip select between conversions, a conversion
+                    # starts on its falling edge, but not after the last one
+                    1 if i < count - 1 else 0,
+                    0,
+                    0,
+                    0,
+                    0,
+                )
+            request = 0x40000000 | len(transfers) << 16 | ord("k") << 8
+            self.messages[key] = (request, transfers, tx, rx)
+        return self.messages[key]
+
+    def read(self, channels, oversampling=1):
+        """ Returns the mean raw code, 0 to 1023, of every channel. """
+        channels = tuple(channels)
+        oversampling = max(min(oversampling, self.MAX_TRANSFERS // len(channels)), 1)
+        request, transfers, _, rx = self.message(channels, oversampling)
+        with self.lock:
+            fcntl.ioctl(self.fd, request, transfers)
+            data = rx.raw
+        sums = [0] * len(channels)
+        for i in range(len(channels) * oversampling):
+            sums[i % len(channels)] += (data[3 * i + 1] & 0x03) << 8 | data[3 * i + 2]
+        return [total / float(oversampling) for total in sums]
+
+    def close(self):
+        os.close(self.fd)
+
+
+class Mcp3008Channel(object):
+    """ One channel of a shared MCP3008 bus, with the raw_value and value of
+    a gpiozero MCP3008, so the wind vane can read through the bus. """
+
+    def __init__(self, bus, channel):
+        self.bus = bus
+        self.channel = channel
+
+    @property
+    def raw_value(self):
+        return int(round(self.bus.read((self.channel,))[0]))
+
+    @property
+    def value(self):
+        return self.bus.read((self.channel,))[0] / 1023.0
+
+    def close(self):
+        pass
+
+
+class AdcChannelMap(object):
+    """ MCP3008 channels mapped to weeWX fields, from the
+    [[mcp3008_channels]] subsection. Every field has a channel and a
+    conversion from volts: a polynomial, c0 + c1 * V + c2 * V^2 + ..., or a
+    linear scale and offset. All the channels are read in one scan. """
+
+    def __init__(self, channels, vref=3.3, oversampling=4):
+        self.vref = vref
+        self.oversampling = oversampling
+        self.bus = None  # Set once the bus is open
+        self.fields = []
+        self.channels = []
+        self.polynomials = []
+        for field, options in sorted(channels.items()):
+            channel = int(options["channel"])
+            if not 0 <= channel <= 7:
+                raise weewx.ViolatedPrecondition(
+                    "MCP3008 channel %d of %s is not 0 to 7" % (channel, field)
+                )
+            if "polynomial" in options:
+                polynomial = [float(c) for c in to_list(options["polynomial"])]
+            else:
+                polynomial = [
+                    float(options.get("offset", 0.0)),
+                    float(options.get("scale", 1.0)),
+                ]
+            self.fields.append(field)
+            self.channels.append(channel)
+            self.polynomials.append(polynomial)
+
+    def read(self):
+        """ Returns the converted value of every field. """
+        codes = self.bus.read(self.channels, self.oversampling)
+        data = dict()
+        for field, code, polynomial in zip(self.fields, codes, self.polynomials):
+            volts = code * self.vref / 1023.0
+            value = 0.0
+            for coefficient in reversed(polynomial):
+                value = value * volts + coefficient
+            data[field] = value
+        return data
+
+
+class I2cBusManager(object):
+    """ Owns one handle per I2C port, opened with open_bus the first time a
+    device of the port asks for it and shared by all the devices on it. """
+
+    def __init__(self, open_bus):
+        self.open_bus = open_bus
+        self.buses = dict()  # port: SharedI2cBus
+        self.lock = threading.Lock()
+
+    def bus(self, port):
+        with self.lock:
+            if port not in self.buses:
+                self.buses[port] = SharedI2cBus(self.open_bus(port), port)
+            return self.buses[port]
+
+    def close(self):
+        with self.lock:
+            for bus in self.buses.values():
+                bus.close()
+            self.buses = dict()
+
+
+class SharedI2cBus(object):
+    """ smbus2.SMBus like bus shared by several devices, each transaction
+    holds the lock of the bus. The time spent waiting for the lock is in the
+    metrics, to tell when the reads of the devices collide. """
+
+    def __init__(self, bus, port):
+        self.bus = bus
+        self.port = port
+        self.lock = threading.Lock()
+        self.label = "i2c-%d" % port
+
+    def locked(self, func, *args):
+        start = time.monotonic()
+        with self.lock:
+            if byows_common.metrics.enabled:
+                byows_common.metrics.observe(
+                    "byows_i2c_wait_seconds", self.label, time.monotonic() - start
+                )
+            return func(*args)
+
+    def read_byte_data(self, address, register):
+        return self.locked(self.bus.read_byte_data, address, register)
+
+    def write_byte_data(self, address, register, value):
+        return self.locked(self.bus.write_byte_data, address, register, value)
+
+    def read_i2c_block_data(self, address, register, length):
+        return self.locked(self.bus.read_i2c_block_data, address, register, length)
+
+    def close(self):
+        with self.lock:
+            self.bus.close()
+
+
+class I2cDevice(object):
+    """ An extra I2C sensor from the [[i2c_devices]] subsection, with its
+    readings mapped to weeWX fields. Only the BME280 is known so far, with
+    the temperature, humidity and pressure readings and the settings of
+    the main BME280. Readings not mapped, or mapped to none, are dropped. """
+
+    TYPES = {"bme280": ("temperature", "humidity", "pressure")}
+    BME280_SETTINGS = dict(
+        mode=str,
+        temperature_oversampling=int,
+        pressure_oversampling=int,
+        humidity_oversampling=int,
+        iir_filter=int,
+        standby_ms=float,
+    )
+
+    def __init__(self, name, options):
+        self.name = name
+        self.sensor_name = "i2c_%s" % name
+        self.type = options.get("type", "bme280")
+        if self.type not in self.TYPES:
+            raise weewx.ViolatedPrecondition(
+                "Unknown type '%s' of I2C device %s, use one of %s"
+                % (self.type, name, ", ".join(sorted(self.TYPES)))
+            )
+        self.port = int(options.get("port", 1))
+        self.address = int(str(options.get("address", "0x76")), 16)
+        self.interval = float(options.get("interval", 10.0))
+        self.fields = dict(
+            (reading, options[reading])
+            for reading in self.TYPES[self.type]
+            if options.get(reading, "none").lower() != "none"
+        )
+        self.settings = dict(
+            (setting, convert(options[setting]))
+            for setting, convert in self.BME280_SETTINGS.items()
+            if setting in options
+        )
+        self.sensor = None  # Set once it is open
+
+    def open(self, bus):
+        return Bme280(bus, self.address, **self.settings)
+
+    def read(self):
+        """ Returns the readings of the device by weeWX field. """
+        if self.sensor is None:
+            return None
+        humidity, pressure, temperature = self.sensor.sample()
+        readings = dict(temperature=temperature, humidity=humidity, pressure=pressure)
+        return dict(
+            (field, readings[reading]) for reading, field in self.fields.items()
+        )
+
+
+class GpioCdevEdgeReader(object):
+    """ Reads falling edges of a GPIO line through the Linux GPIO character
+    device (uAPI v1). Edges are timestamped by the kernel and read in batches,
+    instead of running one Python callback per edge. The line is requested
+    with the pull-up enabled, the same as a gpiozero Button.
+
+    The kernel queues FIFO_DEPTH events per line and drops the edges coming
+    while it is full. Edges gather for BATCH_WINDOW, or not at all when the
+    last batch filled half the FIFO, then all the queued ones are read.
+    Batches that find the FIFO full, which may have lost edges, are counted
+    by byows_gpio_fifo_full_total. """
+
+    GPIO_GET_LINEEVENT_IOCTL = 0xC030B404
+    GPIOHANDLE_REQUEST_INPUT = 1 << 0
+    GPIOHANDLE_REQUEST_BIAS_PULL_UP = 1 << 5
+    GPIOEVENT_REQUEST_FALLING_EDGE = 1 << 1
+    EVENT_FORMAT = "=QI4x"  # struct gpioevent_data
+    EVENT_SIZE = struct.calcsize(EVENT_FORMAT)
+    FIFO_DEPTH = 16
+    BATCH_WINDOW = 0.05
+
+    def __init__(self, gpiochip, pin, on_edges):
+        self.on_edges = on_edges
+        request = bytearray(
+            struct.pack(
+                "=III32si",
+                pin,
+                self.GPIOHANDLE_REQUEST_INPUT | self.GPIOHANDLE_REQUEST_BIAS_PULL_UP,
+                self.GPIOEVENT_REQUEST_FALLING_EDGE,
+                b"byows_rpi",
+                0,
+            )
+        )
+        chip_fd = os.open(gpiochip, os.O_RDONLY)
+        try:
+            fcntl.ioctl(chip_fd, self.GPIO_GET_LINEEVENT_IOCTL, request, True)
+        finally:
+            os.close(chip_fd)
+        self.fd = struct.unpack_from("=i", request, 44)[0]
+        os.set_blocking(self.fd, False)
+        self.line = "gpio%d" % pin
+        self._stop_event = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="cdev-pin%d" % pin)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def read_events(self):
+        """ Returns the timestamps of the queued events, read until the FIFO
+        is empty. """
+        size = self.EVENT_SIZE * self.FIFO_DEPTH
+        stamps = []
+        while True:
+            try:
+                buf = os.read(self.fd, size)
+            except BlockingIOError:
+                break
+            if not stamps and len(buf) == size:
+                byows_common.metrics.inc("byows_gpio_fifo_full_total", self.line)
+            stamps.extend(
+                ns / 1e9 for ns, _ in struct.iter_unpack(self.EVENT_FORMAT, buf)
+            )
+            if len(buf) < size:
+                break
+        return stamps
+
+    def _run(self):
+        clock_offset = None
+        window = self.BATCH_WINDOW
+        while not self._stop_event.is_set():
+            ready, _, _ = select.select([self.fd], [], [], 0.5)
+            if not ready:
+                continue
+            if window:
+                self._stop_event.wait(window)
+            stamps = self.read_events()
+            if not stamps:
+                continue
+            window = self.BATCH_WINDOW if len(stamps) < self.FIFO_DEPTH // 2 else 0
+            if clock_offset is None:
+                # Kernels before 5.7 timestamp events with CLOCK_REALTIME
+                realtime = abs(stamps[0] - time.time()) < abs(
+                    stamps[0] - time.monotonic()
+                )
+                clock_offset = time.monotonic() - time.time() if realtime else 0.0
+            if clock_offset:
+                stamps = [stamp + clock_offset for stamp in stamps]
+            self.on_edges(stamps)
+
+    def close(self):
+        self._stop_event.set()
+        self._thread.join(1.0)
+        os.close(self.fd)
+
+
+class RollingWindow(object):
+    """ Sum of the last size values pushed, updated in O(1). """
+
+    def __init__(self, size):
+        self.size = size
+        self.values = array.array("d", [0.0]) * size
+        self.index = 0
+        self.count = 0
+        self.total = 0.0
+
+    def push(self, value):
+        self.total += value - self.values[self.index]
+        self.values[self.index] = value
+        self.index += 1
+        if self.count < self.size:
+            self.count += 1
+        if self.index == self.size:
+            self.index = 0
+            # Once per lap, drop the rounding error accumulated in total
+            self.total = math.fsum(self.values)
+
+    def mean(self):
+        return self.total / self.count if self.count else None
+
+
+class RollingWind(object):
+    """ Rolling mean wind speed and vector mean direction over a window of
+    samples. """
+
+    def __init__(self, size):
+        self.speed = RollingWindow(size)
+        self.sin = RollingWindow(size)
+        self.cos = RollingWindow(size)
+        self.directions = RollingWindow(size)  # Samples with a valid direction
+
+    def push(self, speed, direction):
+        self.speed.push(speed)
+        if direction is None:
+            self.sin.push(0.0)
+            self.cos.push(0.0)
+            self.directions.push(0.0)
+        else:
+            r = math.radians(direction)
+            self.sin.push(math.sin(r))
+            self.cos.push(math.cos(r))
+            self.directions.push(1.0)
+
+    def direction(self):
+        if self.directions.total < 0.5:
+            return None
+        return vector_direction(self.sin.total, self.cos.total)
+
+
+class WindStatistics(object):
+    """ Streaming wind statistics fed with one speed and direction sample every
+    sample_interval seconds. Each sample costs O(1) and memory is bounded by
+    the longest window.
+
+    windGust is the highest gust_seconds running mean since the last
+    get_data (the WMO 3 second gust) and windGustDir the mean direction over
+    those seconds. windSpeedN and windDirN are the rolling means over the last
+    N minutes, for every N in average_minutes. """
+
+    def __init__(self, sample_interval, gust_seconds=3.0, average_minutes=(2, 10)):
+        self.sample_interval = sample_interval
+        self.gust = RollingWind(self.samples_in(gust_seconds))
+        self.averages = [
+            (minutes, RollingWind(self.samples_in(minutes * 60)))
+            for minutes in average_minutes
+        ]
+        self.max_gust = None
+        self.max_gust_dir = None
+        self.lock = threading.Lock()
+
+    def samples_in(self, seconds):
+        return max(int(round(seconds / self.sample_interval)), 1)
+
+    def add(self, speed, direction):
+        with self.lock:
+            self.gust.push(speed, direction)
+            gust = self.gust.speed.mean()
+            if self.max_gust is None or gust > self.max_gust:
+                self.max_gust = gust
+                self.max_gust_dir = self.gust.direction()
+            for _, window in self.averages:
+                window.push(speed, direction)
+
+    def current_gust(self):
+        """ Returns the running mean of the last gust_seconds. """
+        with self.lock:
+            return self.gust.speed.mean()
+
+    def get_data(self):
+        """ Returns the gust since the last call and the rolling averages. """
+        with self.lock:
+            data = {"windGust": self.max_gust, "windGustDir": self.max_gust_dir}
+            self.max_gust = None
+            self.max_gust_dir = None
+            for minutes, window in self.averages:
+                data["windSpeed%d" % minutes] = window.speed.mean()
+                data["windDir%d" % minutes] = window.direction()
+        return data
+
+
+class Bme280(object):
+    """ BME280 read directly on an smbus2.SMBus like bus.
+
+    The compensation parameters are read once, and every sample fetches all
+    the measurement registers in a single block read. In normal mode the
+    sensor measures continuously every standby_ms, so a reading is always
+    ready; in forced mode each sample starts a measurement and waits for it.
+    Oversampling is 0 (skipped), 1, 2, 4, 8 or 16, the IIR filter
+    coefficient 0 (off), 2, 4, 8 or 16. """
+
+    CHIP_ID = 0x60
+    REG_CHIP_ID = 0xD0
+    REG_CALIB_00 = 0x88
+    REG_CALIB_26 = 0xE1
+    REG_CTRL_HUM = 0xF2
+    REG_STATUS = 0xF3
+    REG_CTRL_MEAS = 0xF4
+    REG_CONFIG = 0xF5
+    REG_DATA = 0xF7
+    DATA_LENGTH = 8  # press_msb .. hum_lsb
+    MODES = {"sleep": 0, "forced": 1, "normal": 3}
+    OVERSAMPLING = {0: 0, 1: 1, 2: 2, 4: 3, 8: 4, 16: 5}
+    IIR_FILTER = {0: 0, 2: 1, 4: 2, 8: 3, 16: 4}
+    STANDBY_MS = {0.5: 0, 62.5: 1, 125: 2, 250: 3, 500: 4, 1000: 5, 10: 6, 20: 7}
+
+    def __init__(
+        self,
+        bus,
+        address=0x77,
+        mode="normal",
+        temperature_oversampling=1,
+        pressure_oversampling=1,
+        humidity_oversampling=1,
+        iir_filter=0,
+        standby_ms=500,
+    ):
+        self.bus = bus
+        self.address = address
+        for name, value, choices in (
+            ("mode", mode, self.MODES),
+            ("temperature oversampling", temperature_oversampling, self.OVERSAMPLING),
+            ("pressure oversampling", pressure_oversampling, self.OVERSAMPLING),
+            ("humidity oversampling", humidity_oversampling, self.OVERSAMPLING),
+            ("IIR filter", iir_filter, self.IIR_FILTER),
+            ("standby", standby_ms, self.STANDBY_MS),
+        ):
+            if value not in choices:
+                raise weewx.ViolatedPrecondition(
+                    "Invalid BME280 %s %s, use one of %s"
+                    % (name, value, ", ".join(str(c) for c in sorted(choices)))
+                )
+        chip_id = self.bus.read_byte_data(self.address, self.REG_CHIP_ID)
+        if chip_id != self.CHIP_ID:
+            raise IOError("No BME280 at 0x%02x, chip id 0x%02x" % (address, chip_id))
+        self.load_calibration()
+        self.mode = self.MODES[mode]
+        self.ctrl_meas = (
+            self.OVERSAMPLING[temperature_oversampling] << 5
+            | self.OVERSAMPLING[pressure_oversampling] << 2
+        )
+        # Maximum measurement time from the datasheet, in seconds
+        self.measure_time = (
+            1.25
+            + 2.3 * temperature_oversampling
+            + (2.3 * pressure_oversampling + 0.575 if pressure_oversampling else 0)
+            + (2.3 * humidity_oversampling + 0.575 if humidity_oversampling else 0)
+        ) / 1000.0
+        self.bus.write_byte_data(
+            self.address, self.REG_CTRL_MEAS, self.ctrl_meas
+        )  # sleep mode, config is only written in sleep mode
+        self.bus.write_byte_data(
+            self.address,
+            self.REG_CONFIG,
+            self.STANDBY_MS[standby_ms] << 5 | self.IIR_FILTER[iir_filter] << 2,
+        )
+        # ctrl_hum only takes effect after a write to ctrl_meas
+        self.bus.write_byte_data(
+            self.address, self.REG_CTRL_HUM, self.OVERSAMPLING[humidity_oversampling]
+        )
+        if self.mode == self.MODES["normal"]:
+            self.bus.write_byte_data(
+                self.address, self.REG_CTRL_MEAS, self.ctrl_meas | self.mode
+            )
+            time.sleep(self.measure_time)
+
+    def load_calibration(self):
+        calib = bytes(
+            bytearray(self.bus.read_i2c_block_data(self.address, self.REG_CALIB_00, 26))
+        )
+        (
+            self.dig_t1,
+            self.dig_t2,
+            self.dig_t3,
+            self.dig_p1,
+            self.dig_p2,
+            self.dig_p3,
+            self.dig_p4,
+            self.dig_p5,
+            self.dig_p6,
+            self.dig_p7,
+            self.dig_p8,
+            self.dig_p9,
+            _,
+            self.dig_h1,
+        ) = struct.unpack("<HhhHhhhhhhhhBB", calib)
+        e1 = bytearray(self.bus.read_i2c_block_data(self.address, self.REG_CALIB_26, 7))
+        self.dig_h2 = struct.unpack("<h", bytes(e1[0:2]))[0]
+        self.dig_h3 = e1[2]
+        self.dig_h4 = struct.unpack("b", bytes(e1[3:4]))[0] << 4 | (e1[4] & 0x0F)
+        self.dig_h5 = struct.unpack("b", bytes(e1[5:6]))[0] << 4 | (e1[4] >> 4)
+        self.dig_h6 = struct.unpack("b", bytes(e1[6:7]))[0]
+
+    def read_raw(self):
+        """ Returns the raw pressure, temperature and humidity ADC values. """
+        if self.mode == self.MODES["forced"]:
+            self.bus.write_byte_data(
+                self.address, self.REG_CTRL_MEAS, self.ctrl_meas | self.mode
+            )
+            time.sleep(self.measure_time)
+        d = self.bus.read_i2c_block_data(self.address, self.REG_DATA, self.DATA_LENGTH)
+        adc_p = (d[0] << 12) | (d[1] << 4) | (d[2] >> 4)
+        adc_t = (d[3] << 12) | (d[4] << 4) | (d[5] >> 4)
+        adc_h = (d[6] << 8) | d[7]
+        return adc_p, adc_t, adc_h
+
+    def compensate_temperature(self, adc_t):
+        """ Returns t_fine and the temperature in C. """
+        var1 = (adc_t / 16384.0 - self.dig_t1 / 1024.0) * self.dig_t2
+        var2 = (adc_t / 131072.0 - self.dig_t1 / 8192.0) ** 2 * self.dig_t3
+        t_fine = var1 + var2
+        return t_fine, t_fine / 5120.0
+
+    def compensate_pressure(self, adc_p, t_fine):
+        """ Returns the pressure in hPa. """
+        var1 = t_fine / 2.0 - 64000.0
+        var2 = var1 * var1 * self.dig_p6 / 32768.0
+        var2 = var2 + var1 * self.dig_p5 * 2.0
+        var2 = var2 / 4.0 + self.dig_p4 * 65536.0
+        var1 = (self.dig_p3 * var1 * var1 / 524288.0 + self.dig_p2 * var1) / 524288.0
+        var1 = (1.0 + var1 / 32768.0) * self.dig_p1
+        if var1 == 0:
+            return None
+        p = 1048576.0 - adc_p
+        p = (p - var2 / 4096.0) * 6250.0 / var1
+        var1 = self.dig_p9 * p * p / 2147483648.0
+        var2 = p * self.dig_p8 / 32768.0
+        return (p + (var1 + var2 + self.dig_p7) / 16.0) / 100.0
+
+    def compensate_humidity(self, adc_h, t_fine):
+        """ Returns the relative humidity in %. """
+        h = t_fine - 76800.0
+        var1 = 1.0 + self.dig_h3 / 67108864.0 * h
+        var2 = self.dig_h2 / 65536.0 * (1.0 + self.dig_h6 / 67108864.0 * h * var1)
+        h = (adc_h - (self.dig_h4 * 64.0 + self.dig_h5 / 16384.0 * h)) * var2
+        h = h * (1.0 - self.dig_h1 * h / 524288.0)
+        return min(max(h, 0.0), 100.0)
+
+    def sample(self):
+        """ Returns humidity in %, pressure in hPa and temperature in C,
+        None for the skipped measurements. """
+        adc_p, adc_t, adc_h = self.read_raw()
+        if adc_t == 0x80000:
+            return None, None, None
+        t_fine, temperature = self.compensate_temperature(adc_t)
+        pressure = self.compensate_pressure(adc_p, t_fine) if adc_p != 0x80000 else None
+        humidity = self.compensate_humidity(adc_h, t_fine) if adc_h != 0x8000 else None
+        return humidity, pressure, temperature
+
+
+class GpiozeroBackend(object):
+    """ Hardware backend for a wired-up Raspberry Pi: gpiozero for the
+    buttons and the MCP3008, smbus2 for the I2C buses and the kernel w1
+    sysfs tree for the DS18B20. """
+
+    name = "gpiozero"
+    trace = None
+    clock = staticmethod(time.monotonic)
+
+    def __init__(self, w1_devices_dir="/sys/bus/w1/devices"):
+        self.w1_devices_dir = w1_devices_dir
+
+    def button(self, pin):
+        from gpiozero import Button
+
+        return Button(pin)
+
+    def adc(self, channel):
+        from gpiozero import MCP3008
+
+        return MCP3008(channel)
+
+    def mcp3008_bus(self, device, speed_hz):
+        return Mcp3008Spi(device, speed_hz)
+
+    def i2c_bus(self, port):
+        import smbus2
+
+        return smbus2.SMBus(port)
+
+    def close(self):
+        pass
+
+
+class SimulatedButton(object):
+    """ Stand-in for a gpiozero Button that is pressed at the rate, in
+    presses per second, returned by rate_func. """
+
+    def __init__(self, pin, rate_func):
+        self.pin = pin
+        self.rate_func = rate_func
+        self.when_pressed = None
+        self._stop_event = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="sim-pin%d" % pin)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _run(self):
+        while not self._stop_event.is_set():
+            rate = self.rate_func(time.monotonic())
+            if rate <= 0:
+                self._stop_event.wait(0.5)
+                continue
+            self._stop_event.wait(1.0 / rate)
+            callback = self.when_pressed
+            if callback is not None:
+                callback()
+
+    def close(self):
+        self._stop_event.set()
+
+
+class SimulatedMCP3008(object):
+    """ Stand-in for a gpiozero MCP3008 wired to a wind vane. value returns
+    the vane voltage, relative to 3.3 V, for the direction from dir_func. """
+
+    def __init__(self, channel, dir_func, noise=0.0):
+        self.channel = channel
+        self.dir_func = dir_func
+        self.noise = noise
+        # The vane only has 16 positions, map each to its nominal voltage
+        self.volts = dict((v, k) for k, v in WindGauge.WIND_VANE_VOLTS.items())
+
+    @property
+    def value(self):
+        sector = int(round((self.dir_func(time.monotonic()) % 360.0) / 22.5)) % 16
+        volts = self.volts[sector * 22.5] + random.gauss(0.0, self.noise)
+        return min(max(volts / 3.3, 0.0), 1.0)
+
+    @property
+    def raw_value(self):
+        return int(round(self.value * 1023))
+
+    def close(self):
+        pass
+
+
+class SimulatedMcp3008Bus(object):
+    """ Stand-in for an Mcp3008Spi: the vane channel reads the simulated
+    vane, the other channels their volts from adc_volts. """
+
+    def __init__(self, vane, vane_channel, adc_volts):
+        self.vane = vane
+        self.vane_channel = vane_channel
+        self.adc_volts = adc_volts or [0.0]
+
+    def read(self, channels, oversampling=1):
+        codes = []
+        for channel in channels:
+            if channel == self.vane_channel:
+                codes.append(float(self.vane.raw_value))
+            else:
+                volts = self.adc_volts[min(channel, len(self.adc_volts) - 1)]
+                codes.append(min(max(volts / 3.3, 0.0), 1.0) * 1023)
+        return codes
+
+    def close(self):
+        pass
+
+
+class FakeBme280Bus(object):
+    """ Stand-in for an smbus2.SMBus with a BME280 on it. The registers hold
+    the datasheet example compensation parameters and raw values that
+    compensate to the model's temperature, pressure and humidity. """
+
+    CALIBRATION = dict(
+        t1=27504, t2=26435, t3=-1000,
+        p1=36477, p2=-10685, p3=3024, p4=2855, p5=140,
+        p6=-7, p7=15500, p8=-14600, p9=6000,
+        h1=75, h2=362, h3=0, h4=313, h5=50, h6=30,
+    )  # fmt: skip
+
+    def __init__(self, model):
+        self.model = model
+        c = self.CALIBRATION
+        self.registers = bytearray(256)
+        self.registers[Bme280.REG_CHIP_ID] = Bme280.CHIP_ID
+        self.registers[Bme280.REG_CALIB_00 : Bme280.REG_CALIB_00 + 26] = struct.pack(
+            "<HhhHhhhhhhhhBB",
+            c["t1"], c["t2"], c["t3"], c["p1"], c["p2"], c["p3"], c["p4"],
+            c["p5"], c["p6"], c["p7"], c["p8"], c["p9"], 0, c["h1"],
+        )  # fmt: skip
+        self.registers[Bme280.REG_CALIB_26 : Bme280.REG_CALIB_26 + 7] = struct.pack(
+            "<hBBBBb",
+            c["h2"],
+            c["h3"],
+            (c["h4"] >> 4) & 0xFF,
+            (c["h4"] & 0x0F) | (c["h5"] & 0x0F) << 4,
+            (c["h5"] >> 4) & 0xFF,
+            c["h6"],
+        )
+        # A sensor with the same parameters, used to find the raw values
+        self.sensor = Bme280.__new__(Bme280)
+        for name, value in c.items():
+            setattr(self.sensor, "dig_" + name, value)
+
+    def read_byte_data(self, address, register):
+        return self.registers[register]
+
+    def write_byte_data(self, address, register, value):
+        self.registers[register] = value
+
+    def read_i2c_block_data(self, address, register, length):
+        if register == Bme280.REG_DATA:
+            self.update_data()
+        return list(self.registers[register : register + length])
+
+    def update_data(self):
+        now = time.monotonic()
+        temperature = self.model.temperature + self.model.daily_swing(now)
+        adc_t = invert(
+            lambda adc: self.sensor.compensate_temperature(adc)[1], temperature, 20
+        )
+        t_fine = self.sensor.compensate_temperature(adc_t)[0]
+        # Pressure goes down when the raw value goes up
+        adc_p = invert(
+            lambda adc: -self.sensor.compensate_pressure(adc, t_fine),
+            -self.model.pressure,
+            20,
+        )
+        adc_h = invert(
+            lambda adc: self.sensor.compensate_humidity(adc, t_fine),
+            self.model.humidity,
+            16,
+        )
+        self.registers[Bme280.REG_DATA : Bme280.REG_DATA + 8] = bytearray(
+            [
+                adc_p >> 12, (adc_p >> 4) & 0xFF, (adc_p & 0x0F) << 4,
+                adc_t >> 12, (adc_t >> 4) & 0xFF, (adc_t & 0x0F) << 4,
+                adc_h >> 8, adc_h & 0xFF,
+            ]
+        )  # fmt: skip
+
+    def close(self):
+        pass
+
+
+class FakeI2cBus(object):
+    """ Stand-in for an smbus2.SMBus with a fake device at each address of
+    devices. Transactions to other addresses fail like on a real bus, and
+    all of them while check_missing raises. """
+
+    def __init__(self, devices, check_missing):
+        self.devices = devices
+        self.check_missing = check_missing
+
+    def device(self, address):
+        self.check_missing()
+        if address not in self.devices:
+            raise IOError("No I2C device at 0x%02x" % address)
+        return self.devices[address]
+
+    def read_byte_data(self, address, register):
+        return self.device(address).read_byte_data(address, register)
+
+    def write_byte_data(self, address, register, value):
+        self.device(address).write_byte_data(address, register, value)
+
+    def read_i2c_block_data(self, address, register, length):
+        return self.device(address).read_i2c_block_data(address, register, length)
+
+    def close(self):
+        pass
+
+
+class SimulatedBackend(object):
+    """ Hardware backend that simulates the whole station so the driver can
+    run, and be profiled, on any Linux box. Options come from the
+    [[simulator]] subsection of [BYOWS]:
+
+    wind_speed, wind_speed_variation, wind_period: wind speed model in km/h,
+        a sine of the given amplitude and period (s) around the mean.
+    wind_dir, wind_dir_variation, wind_dir_period: same for the direction.
+    rain_rate: rain rate in mm/h, converted to bucket tips.
+    temperature, humidity, pressure, temperature_swing: BME280 values.
+    soil_temp, w1_probes: DS18B20 probes created in a fake w1 sysfs tree.
+    w1_bulk_read: whether the fake bus master supports therm_bulk_read.
+    vane_noise: gaussian noise in volts added to the wind vane voltage.
+    adc_volts: volts on the MCP3008 channels other than the vane's, by
+        channel, the last one repeats for the higher channels.
+    bme280_addresses: I2C addresses answered by a simulated BME280.
+    missing_sensors, missing_seconds: sensors (bme280, vane, anemometer,
+        rain, mcp3008) that fail to open, for missing_seconds after the start or for
+        ever when it is not set.
+    seed: seed of the random generator.
+    """
+
+    name = "simulator"
+    trace = None
+    clock = staticmethod(time.monotonic)
+
+    # How often the fake w1_slave files are rewritten, in seconds
+    W1_UPDATE_INTERVAL = 1.0
+
+    def __init__(self, params, **options):
+        self.anem_pin = params.get("anem_pin", 5)
+        self.rain_bucket_pin = params.get("rain_bucket_pin", 6)
+        self.anem_radius_cm = params.get("anem_radius_cm", 9.0)
+        self.anem_adjustment = params.get("anem_adjustment", 1.18)
+        self.bucket_size = params.get("bucket_size", 0.2794)
+        self.wind_speed = float(options.get("wind_speed", 10.0))
+        self.wind_speed_variation = float(options.get("wind_speed_variation", 5.0))
+        self.wind_period = float(options.get("wind_period", 60.0))
+        self.wind_dir = float(options.get("wind_dir", 270.0))
+        self.wind_dir_variation = float(options.get("wind_dir_variation", 30.0))
+        self.wind_dir_period = float(options.get("wind_dir_period", 300.0))
+        self.rain_rate = float(options.get("rain_rate", 0.0))
+        self.temperature = float(options.get("temperature", 15.0))
+        self.temperature_swing = float(options.get("temperature_swing", 5.0))
+        self.humidity = float(options.get("humidity", 60.0))
+        self.pressure = float(options.get("pressure", 1013.25))
+        self.soil_temp = float(options.get("soil_temp", 12.0))
+        self.vane_noise = float(options.get("vane_noise", 0.0))
+        self.vane_channel = params.get("mcp3008_channel", 0)
+        self.adc_volts = [
+            float(volts) for volts in to_list(options.get("adc_volts", "1.0"))
+        ]
+        self.bme280_addresses = [
+            int(address, 16)
+            for address in to_list(options.get("bme280_addresses", "0x77, 0x76"))
+        ]
+        self.w1_probes = int(options.get("w1_probes", 1))
+        self.w1_bulk_read = to_bool(options.get("w1_bulk_read", True))
+        self.missing_sensors = to_list(options.get("missing_sensors", ""))
+        self.missing_seconds = options.get("missing_seconds")
+        random.seed(options.get("seed"))
+        self.start_time = time.monotonic()
+        self.devices = []
+        self.w1_devices_dir = tempfile.mkdtemp(prefix="byows-w1-")
+        self.w1_serials = ["28-00000000%04x" % (i + 1) for i in range(self.w1_probes)]
+        for serial in self.w1_serials:
+            os.mkdir(os.path.join(self.w1_devices_dir, serial))
+        if self.w1_bulk_read:
+            os.mkdir(os.path.join(self.w1_devices_dir, "w1_bus_master1"))
+        self.write_w1_devices()
+        self._stop_event = threading.Event()
+        self._w1_thread = threading.Thread(target=self._update_w1, name="sim-w1")
+        self._w1_thread.daemon = True
+        self._w1_thread.start()
+
+    def wind_speed_at(self, now):
+        """ Wind speed in km/h. """
+        phase = 2 * math.pi * (now - self.start_time) / self.wind_period
+        return max(self.wind_speed + self.wind_speed_variation * math.sin(phase), 0.0)
+
+    def wind_dir_at(self, now):
+        phase = 2 * math.pi * (now - self.start_time) / self.wind_dir_period
+        return (self.wind_dir + self.wind_dir_variation * math.sin(phase)) % 360.0
+
+    def anemometer_rate(self, now):
+        """ Anemometer switch closures per second, two per rotation. """
+        circumference_cm = (2 * math.pi) * self.anem_radius_cm
+        cm_per_sec = self.wind_speed_at(now) / self.anem_adjustment * 100000.0 / 3600
+        return 2 * cm_per_sec / circumference_cm
+
+    def rain_bucket_rate(self, now):
+        """ Bucket tips per second. """
+        return self.rain_rate / self.bucket_size / 3600
+
+    def daily_swing(self, now):
+        phase = 2 * math.pi * (now - self.start_time) / 86400
+        return self.temperature_swing * math.sin(phase)
+
+    def check_missing(self, sensor):
+        """ Raises the error of a sensor that is not wired up. """
+        if sensor not in self.missing_sensors:
+            return
+        if self.missing_seconds is None or (
+            time.monotonic() - self.start_time < float(self.missing_seconds)
+        ):
+            raise IOError("Simulated %s is missing" % sensor)
+
+    def button(self, pin):
+        if pin == self.anem_pin:
+            self.check_missing("anemometer")
+            device = SimulatedButton(pin, self.anemometer_rate)
+        elif pin == self.rain_bucket_pin:
+            self.check_missing("rain")
+            device = SimulatedButton(pin, self.rain_bucket_rate)
+        else:
+            device = SimulatedButton(pin, lambda now: 0.0)
+        self.devices.append(device)
+        return device
+
+    def adc(self, channel):
+        self.check_missing("vane")
+        device = SimulatedMCP3008(channel, self.wind_dir_at, self.vane_noise)
+        self.devices.append(device)
+        return device
+
+    def mcp3008_bus(self, device, speed_hz):
+        self.check_missing("mcp3008")
+        return SimulatedMcp3008Bus(
+            self.adc(self.vane_channel), self.vane_channel, self.adc_volts
+        )
+
+    def i2c_bus(self, port):
+        return FakeI2cBus(
+            dict((address, FakeBme280Bus(self)) for address in self.bme280_addresses),
+            functools.partial(self.check_missing, "bme280"),
+        )
+
+    def write_w1_devices(self):
+        """ Writes a w1_slave file per probe, the same format the w1-therm
+        kernel module produces. """
+        for i, serial in enumerate(self.w1_serials):
+            milli_c = int(round((self.soil_temp + 0.5 * i) * 1000))
+            raw = milli_c * 16 // 1000 & 0xFFFF
+            data = "%02x %02x 4b 46 7f ff 0c 10 1c" % (raw & 0xFF, raw >> 8)
+            content = "%s : crc=1c YES\n%s t=%d\n" % (data, data, milli_c)
+            self.write_w1_file(serial, "w1_slave", content)
+            if self.w1_bulk_read:
+                self.write_w1_file(serial, "temperature", "%d\n" % milli_c)
+        if self.w1_bulk_read:
+            # Conversions of the fake bus are done as soon as they are triggered
+            self.write_w1_file("w1_bus_master1", "therm_bulk_read", "0\n")
+
+    def write_w1_file(self, device, name, content):
+        path = os.path.join(self.w1_devices_dir, device, name)
+        with open(path + ".tmp", "w") as f:
+            f.write(content)
+        os.rename(path + ".tmp", path)
+
+    def _update_w1(self):
+        while not self._stop_event.wait(self.W1_UPDATE_INTERVAL):
+            self.write_w1_devices()
+
+    def close(self):
+        self._stop_event.set()
+        # The thread may be writing the w1 tree that is removed below
+        self._w1_thread.join()
+        for device in self.devices:
+            device.close()
+        shutil.rmtree(self.w1_devices_dir, ignore_errors=True)
+
+
+def acquire(stn_dict):
+    """ Runs the acquisition daemon: the driver loop with the hardware, which
+    publishes its packets to the shared memory instead of handing them to
+    weeWX. """
+    driver = daemon_driver(stn_dict)
+    publisher = SharedMemoryPublisher(
+        stn_dict.get("shared_memory_path", SHARED_MEMORY_PATH), driver.loop_interval
+    )
+    log.info("publishing packets to %s" % publisher.path)
+    # The shared memory file is removed on close
+    run_daemon(driver, publisher.publish, publisher.close)
+
+
+def send(stn_dict):
+    """ Runs the sender of a node: the driver loop with the hardware, which
+    streams its packets to the ingest at udp_destination instead of handing
+    them to weeWX. """
+    if not stn_dict.get("udp_destination"):
+        raise weewx.ViolatedPrecondition("udp_destination is required to send")
+    driver = daemon_driver(stn_dict)
+    sender = UdpSender(
+        parse_address(stn_dict["udp_destination"], UDP_PORT),
+        int(stn_dict.get("udp_node", 1)),
+    )
+    log.info("sending packets of node %d to %s:%d" % ((sender.node,) + sender.address))
+    run_daemon(driver, sender.send, sender.close)
+
+
+def daemon_driver(stn_dict):
+    """ Returns the driver of a process running out of weeWX, which reads
+    the hardware whatever the source option says. """
+    stn_dict = dict(stn_dict)
+    stn_dict.pop("source", None)
+    return ByowsRpi(**stn_dict)
+
+
+def run_daemon(driver, output, close):
+    """ Hands every packet of the driver loop to output until the process is
+    stopped, then closes the driver and calls close. SIGTERM exits the loop
+    the same way, so systemctl stop cleans up too. """
+
+    def on_signal(signum, frame):
+        sys.exit(0)
+
+    signal.signal(signal.SIGTERM, on_signal)
+    try:
+        for packet in driver.genLoopPackets():
+            output(packet)
+    finally:
+        driver.closePort()
+        close()
+
+
+def get_backend(name, params, options):
+    """ Returns the hardware backend selected by the backend option. """
+    if name == GpiozeroBackend.name:
+        return GpiozeroBackend(**options)
+    if name == SimulatedBackend.name:
+        return SimulatedBackend(params, **options)
+    if name == ReplayBackend.name:
+        return ReplayBackend(params, **options)
+    raise weewx.ViolatedPrecondition("Unknown BYOWS backend '%s'" % name)
+
+
+def invert(func, target, bits):
+    """ Returns the raw value of the given bits whose increasing func is the
+    closest to target, by bisection. """
+    low, high = 0, (1 << bits) - 2
+    while low < high:
+        middle = (low + high) // 2
+        if func(middle) < target:
+            low = middle + 1
+        else:
+            high = middle
+    return low
+
+
+def read_sysfs(path):
+    """ Returns the stripped content of a sysfs attribute. """
+    with open(path, "r") as f:
+        return f.read().strip()
+
+
+def build_vane_table(vane_codes, tolerance):
+    """ Returns a list with the wind direction of every 10 bit ADC code: the
+    direction of the nearest code in vane_codes, or None when that is farther
+    than tolerance codes away. """
+    centers = sorted(vane_codes.items())
+    table = []
+    for code in range(WindGauge.ADC_MAX + 1):
+        center, direction = min(centers, key=lambda item: abs(item[0] - code))
+        table.append(direction if abs(center - code) <= tolerance else None)
+    return table
+
+
+def load_vane_calibration(path):
+    """ Loads the ADC codes and directions saved by calibrate_vane. """
+    with open(path) as f:
+        calibration = json.load(f)
+    return dict(
+        (float(code), float(direction))
+        for code, direction in calibration["vane_codes"].items()
+    )
+
+
+def learn_vane_clusters(codes, clusters=16, max_gap=2):
+    """ Groups raw ADC codes into clusters of codes no more than max_gap
+    apart and returns the weighted centers of the clusters biggest clusters,
+    in ascending order. """
+    counts = [0] * (WindGauge.ADC_MAX + 1)
+    for code in codes:
+        counts[code] += 1
+    groups = []  # [total samples, sum of code * samples, last code]
+    for code, count in enumerate(counts):
+        if not count:
+            continue
+        if groups and code - groups[-1][2] <= max_gap:
+            groups[-1][0] += count
+            groups[-1][1] += code * count
+            groups[-1][2] = code
+        else:
+            groups.append([count, code * count, code])
+    if len(groups) < clusters:
+        raise ValueError(
+            "Found %d wind vane positions, expected %d" % (len(groups), clusters)
+        )
+    groups = sorted(groups, key=lambda group: group[0], reverse=True)[:clusters]
+    return sorted(float(total_codes) / total for total, total_codes, _ in groups)
+
+
+def calibrate_vane(wind_gauge, duration, path):
+    """ Samples the raw wind vane codes for duration seconds while the vane is
+    turned slowly through all its positions, learns the code of each position
+    and saves them to path for the vane_calibration_file option.
+
+    The order of the positions by voltage does not depend on the resistors, so
+    the learned clusters are matched to the directions of WIND_VANE_VOLTS
+    sorted by voltage. """
+    codes = []
+    period = 1.0 / wind_gauge.vane_sample_rate
+    end_time = time.monotonic() + duration
+    while time.monotonic() < end_time:
+        codes.append(wind_gauge.adc.raw_value)
+        time.sleep(period)
+    directions = [
+        direction for _, direction in sorted(WindGauge.WIND_VANE_VOLTS.items())
+    ]
+    centers = learn_vane_clusters(codes, len(directions))
+    vane_codes = dict(
+        ("%.1f" % center, direction) for center, direction in zip(centers, directions)
+    )
+    with open(path, "w") as f:
+        json.dump({"vane_codes": vane_codes}, f, indent=4, sort_keys=True)
+    return vane_codes
+
+
+def circular_mean(angles):
+    """ Returns the mean direction, in degrees, of a sequence of angles and
+    the mean resultant length. NaN angles are ignored, (None, None) is
+    returned when there are no valid angles. """
+    if numpy is not None:
+        radians = numpy.radians(numpy.asarray(angles, dtype=float))
+        radians = radians[~numpy.isnan(radians)]
+        n = radians.size
+        if n == 0:
+            return None, None
+        sin_sum = numpy.sin(radians).sum()
+        cos_sum = numpy.cos(radians).sum()
+    else:
+        radians = [math.radians(a) for a in angles if not math.isnan(a)]
+        n = len(radians)
+        if n == 0:
+            return None, None
+        sin_sum = math.fsum(math.sin(r) for r in radians)
+        cos_sum = math.fsum(math.cos(r) for r in radians)
+    return vector_direction(sin_sum, cos_sum), math.hypot(sin_sum, cos_sum) / n
+
+
+def vector_direction(sin_sum, cos_sum):
+    """ Returns the direction in degrees, in [0, 360), of a vector sum of
+    unit vectors. """
+    direction = math.degrees(math.atan2(sin_sum, cos_sum)) % 360.0
+    # A tiny negative angle rounds up to 360.0
+    return 0.0 if direction == 360.0 else direction
+
+
 def get_average(angles):
-    # Function that returns the average angle from a list of angles
-    sin_sum = 0.0
-    cos_sum = 0.0
-
-    for angle in angles:
-        r = math.radians(angle)
-        sin_sum += math.sin(r)
-        cos_sum += math.cos(r)
-    flen = float(len(angles))
-    s = sin_sum / flen
-    c = cos_sum / flen
-    arc = math.degrees(math.atan(s / c))
-    average = 0.0
-
-    if s > 0 and c > 0:
-        average = arc
-    elif c < 0:
-        average = arc + 180
-    elif s < 0 and c > 0:
-        average = arc + 360
-
-    return 0.0 if average == 360 else average
+    # Function that returns the average angle from a list of angles,
+    # None if the list is empty.
+    return circular_mean(angles)[0]
 
 
 """ Section for testing purposes, so file can be run outside of weeWX.
     invoke this as follows from the weewx root dir:
-    PYTHONPATH=bin python bin/weewx/drivers/byows_rpi.py"""
+    PYTHONPATH=bin python bin/user/byows_rpi.py --help"""
 if __name__ == "__main__":
-    station = ByowsRpiStation()
-    packet = {"dateTime": int(time.time() + 0.5), "usUnits": weewx.METRIC}
+    parser = argparse.ArgumentParser(description="BYOWS Raspberry Pi driver")
+    parser.add_argument(
+        "--acquire",
+        metavar="CONFIG",
+        help="run the acquisition daemon with the [BYOWS] section of this weewx.conf",
+    )
+    parser.add_argument(
+        "--send",
+        metavar="CONFIG",
+        help="stream the packets of this node to udp_destination, with the "
+        "[BYOWS] section of this weewx.conf",
+    )
+    parser.add_argument(
+        "--calibrate-vane",
+        metavar="FILE",
+        help="learn the wind vane voltages while the vane is turned slowly "
+        "through all its positions and save them to FILE",
+    )
+    parser.add_argument(
+        "--duration", type=float, default=120, help="calibration length in seconds"
+    )
+    parser.add_argument("--channel", type=int, default=0, help="MCP3008 channel")
+    parser.add_argument(
+        "--backend",
+        default="gpiozero",
+        choices=[GpiozeroBackend.name, SimulatedBackend.name, ReplayBackend.name],
+        help="hardware backend, the default is gpiozero",
+    )
+    parser.add_argument(
+        "--trace",
+        metavar="FILE",
+        help="trace replayed by the replay backend, or recorded with the others",
+    )
+    parser.add_argument(
+        "--speed",
+        type=float,
+        default=0,
+        help="replay speed, times real time, 0 for as fast as possible",
+    )
+    parser.add_argument(
+        "--loop-interval", type=float, default=5, help="seconds between packets"
+    )
+    parser.add_argument(
+        "--count", type=int, default=1, help="number of packets to print, 0 for ever"
+    )
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
 
-    interval = 5
+    if args.acquire:
+        import configobj
 
-    data = station.get_data(interval)  # defaults to 5 seconds
-    packet.update(data)
-    print(packet)
+        acquire(driver_options(configobj.ConfigObj(args.acquire, file_error=True)))
+    elif args.send:
+        import configobj
+
+        send(driver_options(configobj.ConfigObj(args.send, file_error=True)))
+    elif args.calibrate_vane:
+        gauge = WindGauge(args.channel)
+        print("Turn the wind vane slowly for %d seconds..." % args.duration)
+        for code, direction in sorted(
+            calibrate_vane(gauge, args.duration, args.calibrate_vane).items(),
+            key=lambda item: float(item[0]),
+        ):
+            print("code %6s: %5.1f" % (code, direction))
+        gauge.close()
+    else:
+        params = dict(
+            backend=args.backend,
+            loop_interval=args.loop_interval,
+            mcp3008_channel=args.channel,
+        )
+        if args.backend == ReplayBackend.name:
+            params[ReplayBackend.name] = dict(trace_file=args.trace, speed=args.speed)
+        elif args.trace:
+            params["trace_file"] = args.trace
+        driver = ByowsRpi(**params)
+        try:
+            for n, packet in enumerate(driver.genLoopPackets(), 1):
+                print(packet)
+                if n == args.count:
+                    break
+        finally:
+            driver.closePort()
@@ -0,0 +1,547 @@
+"""
+Traces of the byows_rpi driver: recording the raw sensor inputs of a
+station, and the backend replaying them through the station.
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+import array
+import heapq
+import itertools
+import logging
+import os
+import shutil
+import struct
+import tempfile
+import threading
+import time
+
+import weewx
+
+from user.byows_common import PulseRing
+
+log = logging.getLogger(__name__)
+
+
+class TraceWriter(object):
+    """ Append-only binary trace of the raw sensor inputs, for replaying
+    field problems with the replay backend. The file starts with MAGIC and
+    holds records of a kind, a time.monotonic() timestamp and a payload:
+
+    - START: the time.time() of the timestamp, written every time the
+      driver starts, so the replay can tell the sessions apart,
+    - ANEMOMETER and RAIN: a batch of edge timestamps, doubles. The rain
+      edges are the raw ones, before the debounce,
+    - ADC: the MCP3008 codes read, a channel byte and a float per channel,
+    - I2C: the address, the register and the bytes of a block read,
+    - W1: the serial, the file name and the content of a DS18B20 file read,
+      separated by NUL bytes.
+
+    Edges are taken from their rings and written in batches every
+    FLUSH_INTERVAL seconds, so they are up to that late in the file. """
+
+    MAGIC = b"BYOWSTR1"
+    RECORD = struct.Struct("<BdH")  # kind, timestamp, payload size
+    START, ANEMOMETER, RAIN, ADC, I2C, W1 = range(6)
+    ADC_CODE = struct.Struct("<Bf")
+    FLUSH_INTERVAL = 1.0
+    MAX_EDGES = 0xFFFF // 8  # Edges in a record
+
+    def __init__(self, path):
+        self.path = path
+        if os.path.exists(path) and os.path.getsize(path) > 0:
+            with open(path, "rb") as f:
+                if f.read(len(self.MAGIC)) != self.MAGIC:
+                    raise weewx.ViolatedPrecondition(
+                        "%s is not a byows_rpi trace" % path
+                    )
+            self.file = open(path, "ab")
+        else:
+            self.file = open(path, "ab")
+            self.file.write(self.MAGIC)
+        self.lock = threading.Lock()
+        self.rain = PulseRing(1024)  # Raw edges of the rain bucket
+        self.watched = [(self.RAIN, self.rain.cursor())]
+        self.write(self.START, struct.pack("<d", time.time()))
+        self._stop_event = threading.Event()
+        self._thread = threading.Thread(target=self._flush, name="byows-trace")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def watch(self, kind, ring):
+        """ Records the edges of a PulseRing as kind. """
+        self.watched.append((kind, ring.cursor()))
+
+    def write(self, kind, payload, stamp=None):
+        header = self.RECORD.pack(
+            kind, time.monotonic() if stamp is None else stamp, len(payload)
+        )
+        with self.lock:
+            self.file.write(header + payload)
+
+    def adc(self, channels, codes):
+        self.write(
+            self.ADC,
+            b"".join(
+                self.ADC_CODE.pack(channel, code)
+                for channel, code in zip(channels, codes)
+            ),
+        )
+
+    def i2c(self, address, register, data):
+        self.write(self.I2C, bytes(bytearray([address, register] + list(data))))
+
+    def w1(self, serial, name, content):
+        self.write(self.W1, ("%s\0%s\0%s" % (serial, name, content)).encode("utf-8"))
+
+    def flush(self):
+        for kind, cursor in self.watched:
+            stamps = cursor.take()
+            for i in range(0, len(stamps), self.MAX_EDGES):
+                batch = stamps[i : i + self.MAX_EDGES]
+                self.write(kind, array.array("d", batch).tobytes(), batch[0])
+        with self.lock:
+            self.file.flush()
+
+    def _flush(self):
+        while not self._stop_event.wait(self.FLUSH_INTERVAL):
+            self.flush()
+
+    def close(self):
+        self._stop_event.set()
+        self._thread.join()
+        self.flush()
+        self.file.close()
+
+
+class TraceReader(object):
+    """ Reads the records of a trace in file order. A record cut short by
+    a crash ends the trace. """
+
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, "rb")
+        if self.file.read(len(TraceWriter.MAGIC)) != TraceWriter.MAGIC:
+            self.file.close()
+            raise weewx.ViolatedPrecondition("%s is not a byows_rpi trace" % path)
+
+    def records(self):
+        """ Yields the kind, the timestamp and the payload of every record. """
+        header = TraceWriter.RECORD
+        while True:
+            data = self.file.read(header.size)
+            if len(data) < header.size:
+                return
+            kind, stamp, size = header.unpack(data)
+            payload = self.file.read(size)
+            if len(payload) < size:
+                log.info("Trace %s ends with a partial record" % self.path)
+                return
+            yield kind, stamp, payload
+
+    def close(self):
+        self.file.close()
+
+
+class TracedButton(object):
+    """ gpiozero Button whose presses are recorded in ring before calling
+    when_pressed with the same timestamp. """
+
+    def __init__(self, button, ring):
+        self.button = button
+        self.ring = ring
+        self.callback = None
+
+    @property
+    def when_pressed(self):
+        return self.callback
+
+    @when_pressed.setter
+    def when_pressed(self, callback):
+        self.callback = callback
+        self.button.when_pressed = self.pressed if callback is not None else None
+
+    def pressed(self):
+        stamp = time.monotonic()
+        self.ring.append(stamp)
+        self.callback(stamp)
+
+    def close(self):
+        self.button.close()
+
+
+class TracedAdc(object):
+    """ MCP3008 channel whose raw codes are recorded. """
+
+    def __init__(self, adc, channel, trace):
+        self.adc = adc
+        self.channel = channel
+        self.trace = trace
+
+    @property
+    def raw_value(self):
+        code = self.adc.raw_value
+        self.trace.adc((self.channel,), (code,))
+        return code
+
+    @property
+    def value(self):
+        return self.raw_value / 1023.0
+
+    def close(self):
+        self.adc.close()
+
+
+class TracedMcp3008Bus(object):
+    """ Mcp3008Spi whose scans are recorded. """
+
+    def __init__(self, bus, trace):
+        self.bus = bus
+        self.trace = trace
+
+    def read(self, channels, oversampling=1):
+        codes = self.bus.read(channels, oversampling)
+        self.trace.adc(channels, codes)
+        return codes
+
+    def close(self):
+        self.bus.close()
+
+
+class TracedI2cBus(object):
+    """ smbus2.SMBus whose reads are recorded. """
+
+    def __init__(self, bus, trace):
+        self.bus = bus
+        self.trace = trace
+
+    def read_byte_data(self, address, register):
+        value = self.bus.read_byte_data(address, register)
+        self.trace.i2c(address, register, [value])
+        return value
+
+    def write_byte_data(self, address, register, value):
+        self.bus.write_byte_data(address, register, value)
+
+    def read_i2c_block_data(self, address, register, length):
+        data = self.bus.read_i2c_block_data(address, register, length)
+        self.trace.i2c(address, register, data)
+        return data
+
+    def close(self):
+        self.bus.close()
+
+
+class CaptureBackend(object):
+    """ Wraps the hardware backend of the station to record its raw inputs
+    to a TraceWriter: the raw rain bucket edges, the MCP3008 codes and the
+    registers read on the I2C buses. The anemometer edges and the DS18B20
+    files are recorded by the station, through the trace attribute. """
+
+    def __init__(self, backend, trace, rain_bucket_pin):
+        self.backend = backend
+        self.trace = trace
+        self.rain_bucket_pin = rain_bucket_pin
+        self.name = backend.name
+        self.clock = backend.clock
+
+    @property
+    def w1_devices_dir(self):
+        return self.backend.w1_devices_dir
+
+    def button(self, pin):
+        device = self.backend.button(pin)
+        if pin == self.rain_bucket_pin:
+            return TracedButton(device, self.trace.rain)
+        return device
+
+    def adc(self, channel):
+        return TracedAdc(self.backend.adc(channel), channel, self.trace)
+
+    def mcp3008_bus(self, device, speed_hz):
+        return TracedMcp3008Bus(self.backend.mcp3008_bus(device, speed_hz), self.trace)
+
+    def i2c_bus(self, port):
+        return TracedI2cBus(self.backend.i2c_bus(port), self.trace)
+
+    def close(self):
+        self.backend.close()
+        self.trace.close()
+
+
+class ReplayButton(object):
+    """ Button pressed by the replay, with the timestamp of the trace. """
+
+    def __init__(self, pin):
+        self.pin = pin
+        self.when_pressed = None
+
+    def close(self):
+        pass
+
+
+class ReplayAdc(object):
+    """ MCP3008 channel returning the last code of the trace. """
+
+    def __init__(self, codes, channel):
+        self.codes = codes
+        self.channel = channel
+
+    @property
+    def raw_value(self):
+        if self.channel not in self.codes:
+            raise IOError("No code of MCP3008 channel %d yet" % self.channel)
+        return int(round(self.codes[self.channel]))
+
+    @property
+    def value(self):
+        return self.raw_value / 1023.0
+
+    def close(self):
+        pass
+
+
+class ReplayMcp3008Bus(object):
+    """ Mcp3008Spi returning the last codes of the trace. """
+
+    def __init__(self, codes):
+        self.codes = codes
+
+    def read(self, channels, oversampling=1):
+        try:
+            return [self.codes[channel] for channel in channels]
+        except KeyError as e:
+            raise IOError("No code of MCP3008 channel %s yet" % e)
+
+    def close(self):
+        pass
+
+
+class ReplayI2cBus(object):
+    """ smbus2.SMBus serving the registers of the trace, by address. """
+
+    def __init__(self, registers):
+        self.registers = registers
+
+    def device(self, address):
+        if address not in self.registers:
+            raise IOError("No I2C device at 0x%02x in the trace" % address)
+        return self.registers[address]
+
+    def read_byte_data(self, address, register):
+        return self.device(address)[register]
+
+    def write_byte_data(self, address, register, value):
+        self.device(address)[register] = value
+
+    def read_i2c_block_data(self, address, register, length):
+        return list(self.device(address)[register : register + length])
+
+    def close(self):
+        pass
+
+
+class ReplayBackend(object):
+    """ Hardware backend feeding a trace recorded with trace_file back
+    through the station, at speed times real time, or as fast as possible
+    when speed is 0. Options come from the [[replay]] subsection of [BYOWS]:
+
+    trace_file: the trace to replay.
+    speed: how much faster than real time, 0 (the DEFAULT) for as fast as
+        possible.
+
+    The station runs on clock, the clock of the replay: the timestamps of
+    the trace mapped to the wall clock of their session. Its samplers are not
+    started, the replay samples the wind and the vane and builds the
+    packets at their intervals of that clock, so a replay is deterministic.
+    The station is opened once for the whole trace: sensors without records
+    in its first PRELOAD_SECONDS are missing, as they were when it was
+    recorded. """
+
+    name = "replay"
+    trace = None
+    PRELOAD_SECONDS = 10.0
+    # Edges are written up to TraceWriter.FLUSH_INTERVAL late, records are
+    # put back in order within this many seconds
+    REORDER_SECONDS = 5.0
+
+    def __init__(self, params, trace_file=None, speed=0):
+        if not trace_file:
+            raise weewx.ViolatedPrecondition("The replay backend needs a trace_file")
+        self.anem_pin = params.get("anem_pin", 5)
+        # The edges come from the trace, not from a GPIO character device
+        params["anem_edges"] = "callback"
+        self.speed = float(speed)
+        self.reader = TraceReader(trace_file)
+        self.registers = dict()  # I2C address: bytearray of its registers
+        self.codes = dict()  # MCP3008 channel: last code
+        self.buttons = dict()  # TraceWriter kind: ReplayButton
+        self.w1_devices_dir = tempfile.mkdtemp(prefix="byows-replay-w1-")
+        self.now = 0.0
+        self.pace = None  # Replay time and real time the pace is kept from
+        self.events = self.read_events()
+        self.preloaded = []
+        for event in self.events:
+            self.preloaded.append(event)
+            if event[1] in (TraceWriter.ADC, TraceWriter.I2C, TraceWriter.W1):
+                self.apply(*event)
+            if event[0] - self.preloaded[0][0] > self.PRELOAD_SECONDS:
+                break
+        if self.preloaded:
+            self.now = self.preloaded[0][0]
+        log.info("replaying %s" % trace_file)
+
+    def clock(self):
+        """ The clock of the station, the time of the replay. """
+        return self.now
+
+    def read_events(self):
+        """ Yields the time, kind and data of every input of the trace in
+        time order, one per edge. Times are on the wall clock of the
+        session. """
+        heap = []
+        number = 0  # Keeps the order of the events of the same time
+        offset = 0.0
+        horizon = None
+        for kind, stamp, payload in self.reader.records():
+            if kind == TraceWriter.START:
+                while heap:
+                    when, _, event_kind, data = heapq.heappop(heap)
+                    yield when, event_kind, data
+                wall = struct.unpack("<d", payload)[0]
+                offset = wall - stamp
+                horizon = None
+                yield wall, kind, None
+                continue
+            if kind in (TraceWriter.ANEMOMETER, TraceWriter.RAIN):
+                events = [(edge + offset, None) for edge in array.array("d", payload)]
+            elif kind == TraceWriter.ADC:
+                events = [
+                    (
+                        stamp + offset,
+                        dict(
+                            TraceWriter.ADC_CODE.unpack_from(payload, i)
+                            for i in range(0, len(payload), TraceWriter.ADC_CODE.size)
+                        ),
+                    )
+                ]
+            elif kind == TraceWriter.I2C:
+                events = [(stamp + offset, (payload[0], payload[1], payload[2:]))]
+            elif kind == TraceWriter.W1:
+                events = [(stamp + offset, payload.decode("utf-8").split("\0", 2))]
+            else:
+                continue
+            for when, data in events:
+                heapq.heappush(heap, (when, number, kind, data))
+                number += 1
+                horizon = when if horizon is None else max(horizon, when)
+            while heap and heap[0][0] <= horizon - self.REORDER_SECONDS:
+                when, _, event_kind, data = heapq.heappop(heap)
+                yield when, event_kind, data
+        while heap:
+            when, _, event_kind, data = heapq.heappop(heap)
+            yield when, event_kind, data
+
+    def apply(self, when, kind, data):
+        """ Feeds an input of the trace to the devices. """
+        if kind in (TraceWriter.ANEMOMETER, TraceWriter.RAIN):
+            button = self.buttons.get(kind)
+            if button is not None and button.when_pressed is not None:
+                button.when_pressed(when)
+        elif kind == TraceWriter.ADC:
+            self.codes.update(data)
+        elif kind == TraceWriter.I2C:
+            address, register, values = data
+            registers = self.registers.setdefault(address, bytearray(256))
+            registers[register : register + len(values)] = values
+        elif kind == TraceWriter.W1:
+            serial, name, content = data
+            self.write_w1_file(serial, name, content)
+            if name == "temperature":
+                # Conversions of the replayed bus are done when triggered
+                self.write_w1_file("w1_bus_master1", "therm_bulk_read", "0\n")
+
+    def write_w1_file(self, device, name, content):
+        directory = os.path.join(self.w1_devices_dir, device)
+        if not os.path.isdir(directory):
+            os.mkdir(directory)
+        path = os.path.join(directory, name)
+        with open(path + ".tmp", "w") as f:
+            f.write(content)
+        os.rename(path + ".tmp", path)
+
+    def advance(self, when):
+        """ Moves the clock to when, waiting for it at speed. """
+        self.now = when
+        if self.speed > 0:
+            replay_start, real_start = self.pace
+            delay = (when - replay_start) / self.speed - (time.monotonic() - real_start)
+            if delay > 0:
+                time.sleep(delay)
+
+    def packets(self, driver):
+        """ Replays the whole trace through the station of driver, yielding
+        its loop packets. """
+        station = driver.station
+        # Next time, interval and function of the periodic tasks, None for
+        # the packets
+        tasks = [
+            [None, station.wind_gauge.stats.sample_interval, station.samplers["wind"]],
+            [None, 1.0 / station.wind_gauge.vane_sample_rate, station.samplers["vane"]],
+            [None, driver.loop_interval, None],
+        ]
+        for when, kind, data in itertools.chain(self.preloaded, self.events):
+            if kind == TraceWriter.START:
+                # A new session, skip the time the station was down
+                self.pace = (when, time.monotonic())
+                for task in tasks:
+                    start = when
+                    if task[2] is None:
+                        start = -(-when // task[1]) * task[1]
+                    task[0] = start if task[0] is None else max(task[0], start)
+                continue
+            while tasks[0][0] is not None:
+                task = min(tasks, key=lambda task: task[0])
+                if task[0] > when:
+                    break
+                self.advance(task[0])
+                if task[2] is None:
+                    yield driver.loop_packet(int(task[0] + 0.5))
+                else:
+                    task[2].sample()
+                task[0] += task[1]
+            self.advance(when)
+            self.apply(when, kind, data)
+
+    def button(self, pin):
+        device = ReplayButton(pin)
+        kind = TraceWriter.ANEMOMETER if pin == self.anem_pin else TraceWriter.RAIN
+        self.buttons[kind] = device
+        return device
+
+    def adc(self, channel):
+        if channel not in self.codes:
+            raise IOError("No MCP3008 channel %d in the trace" % channel)
+        return ReplayAdc(self.codes, channel)
+
+    def mcp3008_bus(self, device, speed_hz):
+        if not self.codes:
+            raise IOError("No MCP3008 in the trace")
+        return ReplayMcp3008Bus(self.codes)
+
+    def i2c_bus(self, port):
+        return ReplayI2cBus(self.registers)
+
+    def close(self):
+        self.reader.close()
+        shutil.rmtree(self.w1_devices_dir, ignore_errors=True)
@@ -0,0 +1,562 @@
+"""
+Transports of the byows_rpi packets between processes: the shared
+memory of the acquisition daemon and the UDP datagrams of the nodes.
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+import functools
+import logging
+import math
+import mmap
+import os
+import random
+import select
+import socket
+import struct
+import time
+import zlib
+
+import weewx
+
+from user import byows_common
+
+log = logging.getLogger(__name__)
+
+SHARED_MEMORY_PATH = "/dev/shm/byows_rpi"
+UDP_PORT = 7788
+
+
+class SharedMemory(object):
+    """ Layout of the memory map shared by the acquisition daemon and the
+    driver, all numbers in native byte order:
+
+    - a header with the publishing interval, the time of the last packet, the
+      number of packets published and the field names,
+    - a ring of packet slots, each one holding a sequence number, dateTime and
+      one double per field, NaN for None. The sequence number is odd while
+      the slot is written, so a reader can tell a torn read (a seqlock).
+
+    Only the packets are shared: their gusts and rain rates are computed by
+    the daemon, which has every pulse. """
+
+    MAGIC = b"BYOWSHM1"
+    VERSION = 2
+    MAX_FIELDS = 64
+    NAME_SIZE = 32
+    SLOTS = 64
+    # magic, version, fields, slots, padding, interval, last packet
+    HEADER = struct.Struct("=8sIII4xdd")
+    TIMES = struct.Struct("=dd")  # interval and monotonic time of last packet
+    PACKETS = struct.Struct("=Q")
+    FIELD_COUNT = struct.Struct("=I")
+    TIMES_OFFSET = 24
+    PUBLISHED_OFFSET = 32
+    PACKETS_OFFSET = 40
+    FIELD_COUNT_OFFSET = 64
+    NAMES_OFFSET = 128
+    SLOTS_OFFSET = 4096
+    SEQUENCE = struct.Struct("=Q")
+    SLOT = struct.Struct("=d%dd" % MAX_FIELDS)  # after the sequence number
+    SLOT_SIZE = SEQUENCE.size + SLOT.size
+    SIZE = SLOTS_OFFSET + SLOTS * SLOT_SIZE
+
+    def slot_offset(self, number):
+        return self.SLOTS_OFFSET + (number % self.SLOTS) * self.SLOT_SIZE
+
+
+class SharedMemoryPublisher(SharedMemory):
+    """ Writer side of the shared memory, used by the acquisition daemon. The
+    map is created under a temporary name and renamed into place, so readers
+    never see a partial header, and a restarted daemon gets a new file that
+    readers detect and attach to. """
+
+    def __init__(self, path=SHARED_MEMORY_PATH, interval=2.5):
+        self.path = path
+        self.fields = dict()  # name: index in the slots, None when left out
+        self.field_count = 0
+        self.values = [float("nan")] * self.MAX_FIELDS
+        self.published = 0
+        temp_path = "%s.%d" % (path, os.getpid())
+        fd = os.open(temp_path, os.O_RDWR | os.O_CREAT | os.O_TRUNC, 0o644)
+        try:
+            os.ftruncate(fd, self.SIZE)
+            self.mm = mmap.mmap(fd, self.SIZE)
+        finally:
+            os.close(fd)
+        self.HEADER.pack_into(
+            self.mm,
+            0,
+            self.MAGIC,
+            self.VERSION,
+            self.MAX_FIELDS,
+            self.SLOTS,
+            interval,
+            time.monotonic(),
+        )
+        os.rename(temp_path, path)
+
+    def field_index(self, name):
+        """ Returns the slot index of a field, adding new fields to the names
+        in the header. Returns None once all the slots are taken. """
+        if name in self.fields:
+            return self.fields[name]
+        encoded = name.encode("ascii")
+        if len(encoded) >= self.NAME_SIZE:
+            log.error("Field %s left out, its name is too long" % name)
+            index = None
+        elif self.field_count == self.MAX_FIELDS:
+            log.error("Field %s left out, all the fields are taken" % name)
+            index = None
+        else:
+            index = self.field_count
+            offset = self.NAMES_OFFSET + index * self.NAME_SIZE
+            self.mm[offset : offset + len(encoded)] = encoded
+            self.field_count += 1
+            # Publish the name only once it is complete
+            self.FIELD_COUNT.pack_into(
+                self.mm, self.FIELD_COUNT_OFFSET, self.field_count
+            )
+        self.fields[name] = index
+        return index
+
+    def publish(self, packet):
+        """ Writes a loop packet into the next slot of the ring. """
+        values = self.values
+        for i in range(self.field_count):
+            values[i] = float("nan")
+        for name, value in packet.items():
+            if name in ("dateTime", "usUnits"):
+                continue
+            index = self.field_index(name)
+            if index is not None and value is not None:
+                values[index] = float(value)
+        number = self.published
+        offset = self.slot_offset(number)
+        self.SEQUENCE.pack_into(self.mm, offset, 2 * number + 1)
+        self.SLOT.pack_into(
+            self.mm, offset + self.SEQUENCE.size, packet["dateTime"], *values
+        )
+        self.SEQUENCE.pack_into(self.mm, offset, 2 * number + 2)
+        self.published = number + 1
+        self.PACKETS.pack_into(self.mm, self.PACKETS_OFFSET, self.published)
+        struct.pack_into("=d", self.mm, self.PUBLISHED_OFFSET, time.monotonic())
+
+    def close(self):
+        self.mm.close()
+        try:
+            os.unlink(self.path)
+        except OSError:
+            pass
+
+
+class SharedMemoryReader(SharedMemory):
+    """ Reader side of the shared memory, used by the driver when source is
+    shared_memory. Packets are unpacked straight from the map, the driver
+    needs no hardware library and does not touch the sensors. """
+
+    # Seconds between attempts to attach to a daemon that is not running
+    ATTACH_RETRY = 1.0
+
+    def __init__(self, path=SHARED_MEMORY_PATH, timeout=60.0):
+        self.path = path
+        self.timeout = timeout
+        self.mm = None
+        self.inode = None
+        self.names = []
+
+    def attach(self):
+        """ Maps the file published by the daemon, returns False when it does
+        not exist or is not a byows_rpi shared memory. """
+        self.close()
+        try:
+            fd = os.open(self.path, os.O_RDONLY)
+        except OSError:
+            return False
+        try:
+            self.inode = os.fstat(fd).st_ino
+            self.mm = mmap.mmap(fd, 0, access=mmap.ACCESS_READ)
+        finally:
+            os.close(fd)
+        magic, version, fields, slots, _, _ = self.HEADER.unpack_from(self.mm)
+        if (magic, version, fields, slots) != (
+            self.MAGIC,
+            self.VERSION,
+            self.MAX_FIELDS,
+            self.SLOTS,
+        ):
+            log.error("%s is not a byows_rpi shared memory" % self.path)
+            self.close()
+            return False
+        self.names = []
+        log.info("attached to the acquisition daemon at %s" % self.path)
+        return True
+
+    def replaced(self):
+        """ Whether the daemon was restarted and published a new file, or
+        removed its file when it stopped. """
+        try:
+            return os.stat(self.path).st_ino != self.inode
+        except OSError:
+            return True
+
+    def published(self):
+        return self.PACKETS.unpack_from(self.mm, self.PACKETS_OFFSET)[0]
+
+    def next_packet_time(self):
+        """ Returns the monotonic time the daemon should publish its next
+        packet. """
+        interval, published = self.TIMES.unpack_from(self.mm, self.TIMES_OFFSET)
+        return published + interval
+
+    def field_names(self):
+        count = self.FIELD_COUNT.unpack_from(self.mm, self.FIELD_COUNT_OFFSET)[0]
+        while len(self.names) < count:
+            offset = self.NAMES_OFFSET + len(self.names) * self.NAME_SIZE
+            name = self.mm[offset : offset + self.NAME_SIZE].rstrip(b"\0")
+            self.names.append(name.decode("ascii"))
+        return self.names
+
+    def read(self, number):
+        """ Returns packet number, or None when it was overwritten while it
+        was read. """
+        offset = self.slot_offset(number)
+        sequence = 2 * number + 2
+        if self.SEQUENCE.unpack_from(self.mm, offset)[0] != sequence:
+            return None
+        values = self.SLOT.unpack_from(self.mm, offset + self.SEQUENCE.size)
+        if self.SEQUENCE.unpack_from(self.mm, offset)[0] != sequence:
+            return None
+        packet = {"dateTime": int(values[0]), "usUnits": weewx.METRIC}
+        for name, value in zip(self.field_names(), values[1:]):
+            # None and the fields missing from partial packets are left out
+            if not math.isnan(value):
+                packet[name] = value
+        return packet
+
+    def packets(self, poll_interval):
+        """ Yields the packets of the daemon as they are published, skipping
+        those not stamped after the previous one. Raises WeeWxIOError when
+        none is published for timeout seconds, so weeWX restarts the
+        driver. """
+        position = None
+        last_packet = time.monotonic()
+        last_stamp = None  # A restarted daemon may stamp its first packet again
+        while True:
+            if self.mm is None or self.replaced():
+                if self.attach():
+                    position = None
+                elif time.monotonic() - last_packet > self.timeout:
+                    raise weewx.WeeWxIOError(
+                        "No BYOWS acquisition daemon at %s" % self.path
+                    )
+                else:
+                    time.sleep(self.ATTACH_RETRY)
+                    continue
+            published = self.published()
+            if position is None:
+                # Start with the latest packet, older ones were already seen
+                position = max(published - 1, 0)
+            if published - position > self.SLOTS:
+                log.error(
+                    "%d packets overwritten before they were read"
+                    % (published - position - self.SLOTS)
+                )
+                position = published - self.SLOTS
+            while position < published:
+                packet = self.read(position)
+                position += 1
+                if packet is None:
+                    continue
+                last_packet = time.monotonic()
+                if last_stamp is not None and packet["dateTime"] <= last_stamp:
+                    continue
+                last_stamp = packet["dateTime"]
+                yield packet
+            now = time.monotonic()
+            if now - last_packet > self.timeout:
+                raise weewx.WeeWxIOError(
+                    "No packets from the BYOWS acquisition daemon in %d seconds"
+                    % self.timeout
+                )
+            # Sleep until the daemon should have published the next packet
+            delay = self.next_packet_time() - now
+            time.sleep(min(max(delay, 0.0) + 0.005, poll_interval))
+
+    def close(self):
+        if self.mm is not None:
+            self.mm.close()
+            self.mm = None
+
+
+class UdpProtocol(object):
+    """ Datagrams streamed by the sender of a node to the ingest, in network
+    byte order. Each one has a header with the node id, a session picked at
+    random when the sender starts, the id of its schema, a sequence number
+    and the dateTime of the packet, followed by:
+
+    - for a SCHEMA, the field names separated by NUL bytes. Its id is the
+      CRC32 of the names, it is sent when the fields change and every
+      SCHEMA_EVERY packets, so an ingest started later learns it,
+    - for READINGS, one double per field of the schema, NaN for None, so
+      the values arrive exactly as the node measured them.
+
+    Sequence numbers count the READINGS of a session, so the ingest can tell
+    lost, late and duplicated datagrams. """
+
+    MAGIC = b"BYUD"
+    SCHEMA = 1
+    READINGS = 2
+    # magic, kind, version, node, session, schema, sequence, dateTime
+    HEADER = struct.Struct("!4sBBHIIId")
+    VERSION = 1
+    SCHEMA_EVERY = 16
+    MAX_DATAGRAM = 1472  # The UDP payload of an Ethernet frame
+    SEQUENCE_MASK = 0xFFFFFFFF
+
+    @staticmethod
+    def readings_struct(count):
+        return struct.Struct("!%dd" % count)
+
+
+class UdpSender(UdpProtocol):
+    """ Streams the loop packets of a node to the ingest. Sending never
+    blocks the loop, datagrams that cannot be sent are dropped and counted
+    as lost by the ingest. """
+
+    def __init__(self, address, node):
+        self.address = address
+        self.node = node
+        self.session = random.getrandbits(32)
+        self.sequence = 0
+        self.fields = None
+        self.names = None
+        self.schema = None
+        self.readings = None
+        self.sent = 0
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.socket.setblocking(False)
+
+    def send(self, packet):
+        """ Sends a loop packet, preceded by its schema when needed. """
+        fields = tuple(
+            sorted(name for name in packet if name not in ("dateTime", "usUnits"))
+        )
+        if fields != self.fields:
+            names = "\0".join(fields).encode("ascii")
+            if self.HEADER.size + len(names) > self.MAX_DATAGRAM:
+                log.error("Packet of %d fields too big for a datagram" % len(fields))
+                return
+            self.fields = fields
+            self.names = names
+            self.schema = zlib.crc32(names)
+            self.readings = self.readings_struct(len(fields))
+            self.sent = 0
+        stamp = packet["dateTime"]
+        if self.sent % self.SCHEMA_EVERY == 0:
+            self.write(self.SCHEMA, stamp, self.names)
+        nan = float("nan")
+        values = [packet[name] for name in self.fields]
+        body = self.readings.pack(*[nan if v is None else v for v in values])
+        self.write(self.READINGS, stamp, body)
+        self.sequence = (self.sequence + 1) & self.SEQUENCE_MASK
+        self.sent += 1
+
+    def write(self, kind, stamp, body):
+        header = self.HEADER.pack(
+            self.MAGIC,
+            kind,
+            self.VERSION,
+            self.node,
+            self.session,
+            self.schema,
+            self.sequence,
+            stamp,
+        )
+        try:
+            self.socket.sendto(header + body, self.address)
+        except OSError as e:
+            byows_common.metrics.inc("byows_udp_send_errors_total")
+            log.debug("Datagram to %s:%d not sent: %s" % (self.address + (e,)))
+
+    def close(self):
+        self.socket.close()
+
+
+class UdpNode(object):
+    """ What the ingest knows about a sender: its session, the fields of
+    its schemas mapped to weeWX fields and its datagram counters. """
+
+    def __init__(self, node, mapping):
+        self.node = node
+        self.mapping = mapping
+        self.session = None
+        self.schemas = dict()  # id: weeWX fields, None for the dropped ones
+        self.sequence = None  # Expected sequence number
+        self.received = 0
+        self.lost = 0
+        self.late = 0
+        self.unknown_schema = 0
+        label = "node%d" % node
+        for name in ("received", "lost", "late", "unknown_schema"):
+            byows_common.metrics.gauge(
+                "byows_udp_%s_total" % name,
+                label,
+                functools.partial(getattr, self, name),
+            )
+
+    def start_session(self, session):
+        if self.session is not None:
+            log.info("BYOWS node %d restarted" % self.node)
+        self.session = session
+        self.schemas = dict()
+        self.sequence = None
+
+    def add_schema(self, schema, names):
+        fields = []
+        for name in names:
+            field = self.mapping.get(name, name)
+            fields.append(None if field.lower() == "none" else field)
+        self.schemas[schema] = fields
+
+    def check_sequence(self, sequence):
+        """ Counts the datagrams lost before sequence and returns False for
+        late or duplicated ones. """
+        if self.sequence is not None:
+            gap = (sequence - self.sequence) & UdpProtocol.SEQUENCE_MASK
+            if gap > UdpProtocol.SEQUENCE_MASK // 2:
+                self.late += 1
+                return False
+            self.lost += gap
+        self.sequence = (sequence + 1) & UdpProtocol.SEQUENCE_MASK
+        return True
+
+
+class UdpIngest(UdpProtocol):
+    """ Receives the datagrams of the nodes on a single non-blocking socket,
+    used by the driver when source is udp. Datagrams are drained in batches
+    while the loop waits for its next deadline, and their readings merged
+    by timestamp: each weeWX field of the next packet holds the newest
+    reading received for it during the interval. Only the nodes listed in
+    [[udp_nodes]] are accepted, each with its field map. """
+
+    RECEIVE_BUFFER = 1 << 20
+
+    def __init__(self, address=("", UDP_PORT), nodes=None, timeout=60.0):
+        self.timeout = timeout
+        self.nodes = dict(
+            (int(node), UdpNode(int(node), dict(mapping)))
+            for node, mapping in (nodes or {}).items()
+        )
+        self.unknown_nodes = set()
+        self.latest = dict()  # weeWX field: (dateTime, value)
+        self.readings = dict()  # count: Struct, they are few
+        self.buffer = bytearray(self.MAX_DATAGRAM)
+        self.last_datagram = time.monotonic()
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.socket.setsockopt(
+            socket.SOL_SOCKET, socket.SO_RCVBUF, self.RECEIVE_BUFFER
+        )
+        self.socket.bind(address)
+        self.socket.setblocking(False)
+        self.address = self.socket.getsockname()
+
+    def wait(self, timeout):
+        """ Receives datagrams for timeout seconds. Returns False, the loop
+        is never woken up early, so it can be passed to LoopScheduler.wait
+        like LoopEvents. """
+        end = time.monotonic() + timeout
+        while True:
+            self.receive()
+            remaining = end - time.monotonic()
+            if remaining <= 0:
+                return False
+            select.select([self.socket], [], [], remaining)
+
+    def receive(self):
+        """ Handles all the datagrams waiting in the socket. """
+        while True:
+            try:
+                size = self.socket.recv_into(self.buffer)
+            except (BlockingIOError, InterruptedError):
+                return
+            self.last_datagram = time.monotonic()
+            self.handle(size)
+
+    def handle(self, size):
+        if size < self.HEADER.size:
+            byows_common.metrics.inc("byows_udp_invalid_total")
+            return
+        (
+            magic,
+            kind,
+            version,
+            number,
+            session,
+            schema,
+            sequence,
+            stamp,
+        ) = self.HEADER.unpack_from(self.buffer)
+        if magic != self.MAGIC or version != self.VERSION:
+            byows_common.metrics.inc("byows_udp_invalid_total")
+            return
+        node = self.nodes.get(number)
+        if node is None:
+            if number not in self.unknown_nodes:
+                self.unknown_nodes.add(number)
+                log.error(
+                    "Datagrams of BYOWS node %d ignored, not in udp_nodes" % number
+                )
+            return
+        if session != node.session:
+            node.start_session(session)
+        if kind == self.SCHEMA:
+            names = bytes(self.buffer[self.HEADER.size : size]).decode("ascii")
+            node.add_schema(schema, names.split("\0") if names else [])
+            return
+        fields = node.schemas.get(schema)
+        if fields is None:
+            # The schema was lost, the sender sends it again soon
+            node.unknown_schema += 1
+            return
+        if not node.check_sequence(sequence):
+            return
+        node.received += 1
+        readings = self.readings.get(len(fields))
+        if readings is None:
+            readings = self.readings[len(fields)] = self.readings_struct(len(fields))
+        if self.HEADER.size + readings.size != size:
+            byows_common.metrics.inc("byows_udp_invalid_total")
+            return
+        latest = self.latest
+        values = readings.unpack_from(self.buffer, self.HEADER.size)
+        for field, value in zip(fields, values):
+            if field is None or math.isnan(value):
+                continue
+            if field not in latest or latest[field][0] <= stamp:
+                latest[field] = (stamp, value)
+
+    def take(self):
+        """ Returns the readings merged since the last call as a packet's
+        fields. Raises WeeWxIOError when no datagram was received for
+        timeout seconds, so weeWX restarts the driver. """
+        if time.monotonic() - self.last_datagram > self.timeout:
+            raise weewx.WeeWxIOError(
+                "No datagrams from the BYOWS nodes in %d seconds" % self.timeout
+            )
+        data = dict((field, value) for field, (_, value) in self.latest.items())
+        self.latest = dict()
+        return data
+
+    def close(self):
+        self.socket.close()
@@ -16,7 +16,18 @@ AUTHOR = "Jardi Martinez"
 AUTHOR_EMAIL = "https://github.com/jardiamj/BYOWS_RPi"
 
 # ----- Extension File List -----
-filelist = [('bin/user', ['bin/user/byows_rpi.py'])]
+filelist = [
+    (
+        'bin/user',
+        [
+            'bin/user/byows_rpi.py',
+            'bin/user/byows_common.py',
+            'bin/user/byows_filters.py',
+            'bin/user/byows_trace.py',
+            'bin/user/byows_transport.py',
+        ],
+    )
+]
 
 # ----- Configuration details for Weewx.conf -----
 
@@ -30,9 +41,40 @@ driver_config = """
     driver = user.byows_rpi
 
     # [OPTIONAL]
-    # How often should the driver generate packets in seconds
+    # How often should the driver generate packets in seconds, at least 1
     loop_interval = 2.5
 
+    # [OPTIONAL]
+    # What to do with the packets missed when a loop takes longer than
+    # loop_interval: skip, catchup or coalesce.
+    loop_overrun_policy = skip
+
+    # [OPTIONAL]
+    # Sensor events that wake the loop up to emit a partial packet right away:
+    # rain (a bucket tip), gust (the gust crossing event_gust_threshold km/h)
+    # and pressure (a drop of event_pressure_drop hPa within
+    # event_pressure_window seconds). Partial packets are at least
+    # event_min_interval seconds apart. Disabled when empty.
+    loop_events = ""
+    event_min_interval = 1.0
+    event_gust_threshold = 50
+    event_pressure_drop = 1.0
+    event_pressure_window = 600
+
+    # [OPTIONAL]
+    # Adaptive sampling: loop_interval and vane_sample_rate are used in active
+    # weather (wind speed, gust spread above it, spread of the vane directions
+    # over their thresholds, or rain), adaptive_loop_interval and
+    # adaptive_vane_rate once the weather stayed calm for adaptive_hold
+    # seconds.
+    adaptive_sampling = false
+    adaptive_loop_interval = 10
+    adaptive_vane_rate = 1
+    adaptive_wind_speed = 15
+    adaptive_gust_spread = 10
+    adaptive_direction_spread = 0.3
+    adaptive_hold = 600
+
     # [OPTIONAL]
     # Pin to which anemometer is connected, the DEFAULT is pin 5.
     anemometer_pin = 5
@@ -57,11 +99,197 @@ driver_config = """
     # [OPTIONAL]
     # Bucket Size in mm, the DEFAULT is 0.2794 mm.
     bucket_size = 0.2794
+
+    # [OPTIONAL]
+    # Rain bucket edges closer than rain_debounce seconds to the previous one
+    # are contact bounce. rainRate is computed from the interval between the
+    # last two tips and drops to 0 after rain_rate_timeout seconds without one.
+    rain_debounce = 0.1
+    rain_rate_timeout = 900
     
     # [OPTIONAL]
     # Anemometer radious in cm, the DEFAULT is 9.0 cm.    
     anemometer_radius_cm = 9.0
 
+    # [OPTIONAL]
+    # The sensors are probed in parallel at startup, for at most
+    # sensor_probe_timeout seconds. The driver starts without the ones that
+    # are missing, leaving their fields out, and probes them again every
+    # sensor_retry_interval seconds.
+    sensor_probe_timeout = 2.0
+    sensor_retry_interval = 60
+
+    # [OPTIONAL]
+    # A sensor whose reads fail sensor_failures times in a row is not read
+    # for sensor_backoff seconds and reports None. The pause doubles after each
+    # failed retry, up to sensor_max_backoff seconds.
+    sensor_failures = 3
+    sensor_backoff = 10
+    sensor_max_backoff = 600
+
+    # [OPTIONAL]
+    # How often the BME280 and DS18B20 are read in the background, in seconds.
+    # Packets use the latest reading, readings older than 3 intervals are dropped.
+    bme280_interval = 2.5
+    ds18b20_interval = 5.0
+
+    # [OPTIONAL]
+    # Hardware backend, gpiozero for a wired-up Raspberry Pi or simulator to
+    # run the driver on any Linux box, or replay to replay a trace. The
+    # simulator is configured in the [[simulator]] subsection and the replay in
+    # the [[replay]] subsection, see the README for all the options.
+    backend = gpiozero
+
+    # [OPTIONAL]
+    # Records the raw sensor inputs to this append-only trace, which the replay
+    # backend can replay faster than real time, see the README.
+    # trace_file = /var/lib/weewx/byows.trace
+
+    # [OPTIONAL]
+    # SPI bus of the MCP3008 when [[mcp3008_channels]] is used.
+    mcp3008_device = /dev/spidev0.0
+    mcp3008_speed_hz = 1000000
+    mcp3008_oversampling = 4
+    mcp3008_interval = 5.0
+    mcp3008_vref = 3.3
+
+    # [OPTIONAL]
+    # How anemometer pulses are read: callback runs a gpiozero callback per
+    # pulse, cdev reads kernel timestamped pulses in batches from gpiochip.
+    anemometer_edges = callback
+    gpiochip = /dev/gpiochip0
+
+    # [OPTIONAL]
+    # Wind statistics: the wind is sampled every wind_sample_interval seconds,
+    # windGust is the highest wind_gust_seconds running mean of each packet and
+    # windSpeedN/windDirN are rolling means over the last N minutes.
+    wind_sample_interval = 0.25
+    wind_gust_seconds = 3
+    wind_average_minutes = 2, 10
+
+    # [OPTIONAL]
+    # How many times per second the wind vane is read, windDir is the circular
+    # mean of the readings of each packet.
+    vane_sample_rate = 10
+
+    # [OPTIONAL]
+    # Adds the wind rose of each archive interval of [StdArchive] to its last
+    # loop packet: the share of the wind run of each of the 16 sectors
+    # (windRoseN..windRoseNNW), the dominant sector (windRoseDir) and the
+    # standard deviation of the wind direction (windRoseStdDev), from every
+    # vane sample weighted by the time it stands for.
+    wind_rose = false
+
+    # [OPTIONAL]
+    # Readings up to vane_tolerance volts from a wind vane position are decoded
+    # as that position. vane_calibration_file is a file saved by the vane
+    # calibration, see the README, and replaces the nominal vane voltages.
+    vane_tolerance = 0.1
+    # vane_calibration_file = /etc/weewx/byows_vane.json
+
+    # [OPTIONAL]
+    # All the DS18B20 probes are read at once, the 1-Wire bus is rescanned for
+    # new probes every ds18b20_rescan_interval seconds. Probes are reported as
+    # soilTemp1..4 and extraTemp1..3 in order of discovery unless mapped to a
+    # field by serial number in [[ds18b20_probes]].
+    ds18b20_rescan_interval = 300
+
+    # [OPTIONAL]
+    # BME280 settings. In normal mode the sensor measures continuously every
+    # bme280_standby_ms, in forced mode a measurement is started on every read.
+    # Oversampling is 0 (skip), 1, 2, 4, 8 or 16, the IIR filter 0 (off), 2, 4,
+    # 8 or 16 and the standby 0.5, 10, 20, 62.5, 125, 250, 500 or 1000 ms.
+    bme280_mode = normal
+    bme280_temperature_oversampling = 1
+    bme280_pressure_oversampling = 1
+    bme280_humidity_oversampling = 1
+    bme280_iir_filter = 0
+    bme280_standby_ms = 500
+
+    # [OPTIONAL]
+    # Performance metrics: sensor read latencies, errors, retries, pulse and
+    # decode counts and loop timing. metrics_file is written in the Prometheus
+    # text format every metrics_interval seconds, metrics_in_packet adds some
+    # of them to the loop packets as byows* fields.
+    metrics = false
+    # metrics_file = /var/lib/node_exporter/textfile_collector/byows.prom
+    metrics_interval = 60
+    metrics_in_packet = false
+
+    # [OPTIONAL]
+    # Archive store: archive records of the archive_interval of [StdArchive]
+    # are kept in an SQLite database for archive_store_days, so weeWX can catch
+    # up from it after a restart. With source = hardware the store stops with
+    # weeWX and only saves the interval in progress, the acquisition daemon
+    # keeps saving records while weeWX is down.
+    # archive_store = /var/lib/weewx/byows_archive.sdb
+    archive_store_days = 30
+
+    # [OPTIONAL]
+    # Where the packets come from: hardware reads the sensors inside weeWX,
+    # shared_memory reads the packets published at shared_memory_path by the
+    # acquisition daemon (see the README). weeWX restarts the driver when no
+    # packet is published for shared_memory_timeout seconds.
+    # udp receives the packets of the nodes listed in [[udp_nodes]] on
+    # udp_address, and weeWX restarts the driver when none is received for
+    # udp_timeout seconds.
+    source = hardware
+    shared_memory_path = /dev/shm/byows_rpi
+    shared_memory_timeout = 60
+    udp_address = :7788
+    udp_timeout = 60
+
+    # [OPTIONAL]
+    # On a node streaming its packets to the driver of another station with
+    # --send, see the README.
+    # udp_destination = weewx.local:7788
+    # udp_node = 2
+    [[ds18b20_probes]]
+        # 28-0000075a1b2c = soilTemp1
+
+    # MCP3008 channels mapped to weeWX fields, converted from volts with a
+    # linear scale and offset or a polynomial (c0, c1, c2... of V). The
+    # channels, and then the wind vane too, are read through the hardware SPI
+    # bus in a single scan, mcp3008_oversampling times, every mcp3008_interval
+    # seconds, see the README.
+    [[mcp3008_channels]]
+        # [[[radiation]]]
+        #     channel = 1
+        #     scale = 500
+        # [[[soilMoist1]]]
+        #     channel = 3
+        #     polynomial = 0, 60, -8
+
+    # More I2C sensors, sharing the bus of their port with the BME280 and read
+    # in the background, with their readings mapped to weeWX fields or to none.
+    # Only the bme280 type is supported, see the README.
+    [[i2c_devices]]
+        # [[[indoor]]]
+        #     type = bme280
+        #     address = 0x76
+        #     temperature = inTemp
+        #     humidity = inHumidity
+        #     pressure = none
+
+    # Nodes accepted by the udp source, by number, with their fields mapped
+    # to weeWX fields, or to none to drop them.
+    [[udp_nodes]]
+        # [[[2]]]
+        #     outTemp = extraTemp1
+        #     outHumidity = extraHumid1
+
+    # Per-field filters applied before the packets reach weeWX: range checks
+    # (min, max, reject), a rate of change limit (max_rate, units per second,
+    # max_rate_confirm consistent values accept a step change)
+    # and a rolling Hampel filter (hampel_window, hampel_threshold,
+    # hampel_min_deviation). Sensible range checks are built in, see the README.
+    [[filters]]
+        # [[[windSpeed]]]
+        #     hampel_window = 7
+        #     hampel_min_deviation = 5
+        # [[[outTemp]]]
+        #     max_rate = 0.1
+
 """
 
 config_dict = configobj.ConfigObj(StringIO(driver_config))
@@ -0,0 +1,141 @@
+"""
+Tests of the byows_rpi driver, run against its fakes so they need no
+hardware. weeWX must be importable, invoke them from the root dir of this
+repo with:
+    PYTHONPATH=/path/to/weewx/bin python -m pytest -q tests
+"""
+import importlib
+import os
+import sys
+
+import pytest
+
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(TESTS_DIR, "..", "bin"))
+
+
+class FakeClock(object):
+    """ Monotonic clock whose sleeps only move it forward, with a wall clock
+    moving along. """
+
+    def __init__(self, now=1000.0, wall_offset=1.7e9):
+        self.now = now
+        self.wall_offset = wall_offset
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+    def time(self):
+        return self.now + self.wall_offset
+
+
+@pytest.fixture
+def clock():
+    return FakeClock()
+
+
+class FakeDevice(object):
+    """ gpiozero Button or MCP3008, pressed by calling when_pressed. """
+
+    when_pressed = None
+    value = 0.0
+    raw_value = 0
+
+    def close(self):
+        pass
+
+
+class FakeBackend(object):
+    """ Backend of a station whose buttons and vane are FakeDevices, with no
+    I2C sensor and no DS18B20 probe, on a FakeClock. """
+
+    name = "fake"
+    trace = None
+
+    def __init__(self, clock, w1_devices_dir):
+        self.clock = clock
+        self.w1_devices_dir = w1_devices_dir
+        self.buttons = dict()
+
+    def button(self, pin):
+        self.buttons[pin] = FakeDevice()
+        return self.buttons[pin]
+
+    def adc(self, channel):
+        return FakeDevice()
+
+    def i2c_bus(self, port):
+        raise IOError("No I2C bus %s" % port)
+
+    def close(self):
+        pass
+
+
+@pytest.fixture
+def fake_backend(clock, tmp_path):
+    """ Returns a new FakeBackend, on the FakeClock unless given a clock. """
+
+    def make(on_clock=None):
+        return FakeBackend(on_clock or clock, str(tmp_path))
+
+    return make
+
+
+@pytest.fixture
+def station(byows_rpi, fake_backend):
+    """ Returns a ByowsRpiStation built from its params, on a FakeBackend
+    unless given a backend. """
+    stations = []
+
+    def make(**params):
+        params.setdefault("anem_pin", 5)
+        params.setdefault("rain_bucket_pin", 6)
+        params.setdefault("bucket_size", 0.2794)
+        params.setdefault("backend", fake_backend())
+        stations.append(byows_rpi.ByowsRpiStation(**params))
+        return stations[-1]
+
+    yield make
+    for s in stations:
+        s.stop()
+
+
+def driver_module(name):
+    """ Returns a module of the driver, the tests are skipped without weeWX. """
+    pytest.importorskip("weewx")
+    return importlib.import_module("user.%s" % name)
+
+
+@pytest.fixture
+def byows_rpi():
+    return driver_module("byows_rpi")
+
+
+@pytest.fixture
+def byows_common():
+    return driver_module("byows_common")
+
+
+@pytest.fixture
+def byows_filters():
+    return driver_module("byows_filters")
+
+
+@pytest.fixture
+def byows_trace():
+    return driver_module("byows_trace")
+
+
+@pytest.fixture
+def byows_transport():
+    return driver_module("byows_transport")
+
+
+@pytest.fixture
+def metrics(byows_common, monkeypatch):
+    """ Metrics enabled for the duration of a test. """
+    monkeypatch.setattr(byows_common, "metrics", byows_common.Metrics())
+    return byows_common.metrics
@@ -0,0 +1,75 @@
+import pytest
+
+CALM = dict(windSpeed=2.0, windGust=4.0, rain=0.0)
+
+
+@pytest.fixture
+def rates(byows_rpi, clock):
+    def make(**options):
+        options.setdefault("hold", 600.0)
+        return byows_rpi.AdaptiveRates(2.0, 10.0, 10.0, 1.0, clock=clock, **options)
+
+    return make
+
+
+def settle(adaptive, clock, packet=CALM, seconds=600.0, step=10.0):
+    """ Feeds the packet every step seconds for seconds, returns the
+    times the cadence changed. """
+    changes = []
+    end = clock.now + seconds
+    while clock.now < end:
+        clock.sleep(step)
+        if adaptive.update(packet):
+            changes.append(clock.now)
+    return changes
+
+
+def test_starts_active_and_calms_down_after_hold(rates, clock):
+    adaptive = rates()
+    start = clock.now
+    assert (adaptive.loop_interval, adaptive.vane_rate) == (2.0, 10.0)
+    assert settle(adaptive, clock, seconds=1200.0) == [start + 600.0]
+    assert (adaptive.loop_interval, adaptive.vane_rate) == (10.0, 1.0)
+
+
+@pytest.mark.parametrize(
+    "packet, resultant",
+    [
+        (dict(windSpeed=16.0, windGust=18.0), None),
+        (dict(windSpeed=5.0, windGust=16.0), None),
+        (dict(windSpeed=5.0, windGust=6.0), 0.6),
+        (dict(windSpeed=0.0, windGust=0.0, rain=0.02794), None),
+    ],
+)
+def test_any_signal_switches_to_active(rates, clock, packet, resultant):
+    adaptive = rates()
+    settle(adaptive, clock)
+    assert not adaptive.active
+    assert adaptive.update(packet, resultant)
+    assert adaptive.active
+
+
+def test_vane_noise_in_calm_air_is_ignored(rates, clock):
+    adaptive = rates()
+    settle(adaptive, clock)
+    # A scattered vane without wind is not activity
+    assert not adaptive.update(dict(windSpeed=1.0, windGust=2.0), 0.1)
+
+
+def test_hysteresis_holds_the_active_cadence(rates, clock):
+    adaptive = rates()
+    settle(adaptive, clock)
+    adaptive.update(dict(windSpeed=16.0, windGust=18.0))
+    # Between REARM of the threshold and the threshold, it stays active
+    hovering = dict(windSpeed=13.0, windGust=14.0)
+    assert settle(adaptive, clock, hovering, seconds=3600.0) == []
+    assert adaptive.active
+    # Below REARM, it calms down hold seconds after the last activity
+    last_activity = clock.now
+    assert settle(adaptive, clock, seconds=1200.0) == [last_activity + 600.0]
+
+
+def test_calm_cadence_is_clamped(byows_rpi, clock):
+    adaptive = byows_rpi.AdaptiveRates(20.0, 0.5, 10.0, 1.0, clock=clock)
+    assert adaptive.loop_intervals == (20.0, 20.0)
+    assert adaptive.vane_rates == (0.5, 0.5)
@@ -0,0 +1,126 @@
+import sqlite3
+import threading
+import time
+
+import pytest
+
+INTERVAL = 300
+DAY = 86400
+
+
+@pytest.fixture
+def store(byows_rpi, tmp_path):
+    stores = []
+
+    def make(**options):
+        path = str(tmp_path / "archive.sdb")
+        stores.append(byows_rpi.ArchiveStore(path, INTERVAL, **options))
+        return stores[-1]
+
+    yield make
+    for s in stores:
+        s.close()
+
+
+def packet(stamp, **fields):
+    return dict(dateTime=stamp, usUnits=16, **fields)
+
+
+def current_end():
+    """ End of the interval after the one in progress, so it is not over
+    before the end of a test. """
+    return (int(time.time()) // INTERVAL + 2) * INTERVAL
+
+
+def test_records_with_their_counters(store):
+    archive = store()
+    start = 1700000100
+    for i in range(6):
+        stamp = start + 100 * (i + 1)
+        archive.add_packet(packet(stamp, outTemp=10.0 + i, rain=0.2), dict(tips=i))
+    records = archive.records_since(0)
+    assert [r["dateTime"] for r in records] == [start + INTERVAL]
+    record = records[0]
+    assert record["outTemp"] == pytest.approx(11.0)
+    assert record["rain"] == pytest.approx(0.6)
+    assert record["interval"] == INTERVAL // 60
+    # The counters as they were at the end of the record
+    assert archive.last_counters() == dict(tips=2)
+    assert archive.records_since(start + INTERVAL) == []
+
+
+def test_interval_in_progress_survives_a_restart(store):
+    end = current_end()
+    archive = store()
+    archive.add_packet(packet(end - 250, outTemp=10.0, rain=0.2), dict(tips=1))
+    archive.add_packet(packet(end - 200, outTemp=12.0), dict(tips=1))
+    archive.close()
+    archive = store()
+    assert archive.records_since(0) == []
+    archive.add_packet(packet(end - 100, outTemp=14.0, rain=0.2), dict(tips=2))
+    archive.add_packet(packet(end + 10, outTemp=20.0), dict(tips=2))
+    [record] = archive.records_since(0)
+    assert record["dateTime"] == end
+    assert record["outTemp"] == pytest.approx(12.0)
+    assert record["rain"] == pytest.approx(0.4)
+
+
+def test_interval_over_at_the_restart_is_stored(store):
+    archive = store()
+    archive.add_packet(packet(1700000050, outTemp=10.0), dict(tips=7))
+    archive.close()
+    archive = store()
+    [record] = archive.records_since(0)
+    assert record["dateTime"] == 1700000100
+    # The counters of the resumed interval are kept growing
+    assert archive.counters == dict(tips=7)
+
+
+def test_old_records_are_pruned(store):
+    archive = store(days=1)
+    archive.PRUNE_EVERY = 1
+    start = 1700000100
+    for stamp in (start, start + 2 * DAY, start + 2 * DAY + INTERVAL):
+        archive.add_packet(packet(stamp, outTemp=10.0), dict())
+    # The first record is more than a day older than the last one
+    records = archive.records_since(0)
+    assert [r["dateTime"] for r in records] == [start + 2 * DAY]
+
+
+def test_late_packet_is_dropped(store, metrics):
+    archive = store()
+    start = 1700000100
+    archive.add_packet(packet(start + 10, outTemp=10.0), dict())
+    # The wall clock stepped back to the previous interval
+    archive.add_packet(packet(start - 10, outTemp=30.0), dict())
+    archive.add_packet(packet(start + INTERVAL + 10, outTemp=10.0), dict())
+    [record] = archive.records_since(0)
+    assert record["outTemp"] == 10.0
+    assert metrics.value("byows_archive_late_packets_total") == 1
+
+
+def test_readonly_store_waits_for_the_writer(byows_rpi, store, monkeypatch):
+    monkeypatch.setattr(byows_rpi.ArchiveStore, "OPEN_POLL_INTERVAL", 0.01)
+    assert store(readonly=True, open_timeout=0).records_since(0) == []
+    reader = store(readonly=True, open_timeout=10)
+
+    def write():
+        archive = store()
+        archive.add_packet(packet(1700000050, outTemp=10.0), dict())
+        archive.add_packet(packet(1700000150, outTemp=10.0), dict())
+
+    writer = threading.Timer(0.05, write)
+    writer.start()
+    try:
+        records = reader.records_since(0)
+    finally:
+        writer.join()
+    # Either the records, or none when opened before the first save
+    assert [r["dateTime"] for r in records] in ([], [1700000100])
+    assert [r["dateTime"] for r in reader.records_since(0)] == [1700000100]
+    # A readonly store never writes its pending interval
+    reader.accumulator.add(packet(1700000250, outTemp=10.0))
+    reader.close()
+    connection = sqlite3.connect(reader.path)
+    assert connection.execute("SELECT COUNT(*) FROM pending").fetchone() == (0,)
+    connection.close()
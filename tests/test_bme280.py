@@ -0,0 +1,105 @@
+import types
+
+import pytest
+
+
+class RecordingBus(object):
+    """ Fake SMBus of a BME280 with the compensation parameters of the
+    datasheet example and fixed raw data registers, recording the
+    transactions. """
+
+    def __init__(self, byows_rpi, adc_p=415148, adc_t=519888, adc_h=0x8000):
+        self.fake = byows_rpi.FakeBme280Bus(None)
+        self.data_register = byows_rpi.Bme280.REG_DATA
+        self.fake.registers[self.data_register : self.data_register + 8] = bytearray(
+            [
+                adc_p >> 12, (adc_p >> 4) & 0xFF, (adc_p & 0x0F) << 4,
+                adc_t >> 12, (adc_t >> 4) & 0xFF, (adc_t & 0x0F) << 4,
+                adc_h >> 8, adc_h & 0xFF,
+            ]
+        )  # fmt: skip
+        self.reads = []
+        self.writes = []
+
+    def read_byte_data(self, address, register):
+        return self.fake.registers[register]
+
+    def write_byte_data(self, address, register, value):
+        self.writes.append((register, value))
+        self.fake.registers[register] = value
+
+    def read_i2c_block_data(self, address, register, length):
+        self.reads.append((register, length))
+        return list(self.fake.registers[register : register + length])
+
+
+@pytest.fixture
+def no_sleep(byows_rpi, monkeypatch):
+    monkeypatch.setattr(byows_rpi.time, "sleep", lambda seconds: None)
+
+
+def test_datasheet_compensation(byows_rpi, no_sleep):
+    sensor = byows_rpi.Bme280(RecordingBus(byows_rpi))
+    # The example of the datasheet: 25.08 C and 100653.27 Pa
+    t_fine, temperature = sensor.compensate_temperature(519888)
+    assert t_fine == pytest.approx(128422.29, abs=0.01)
+    assert temperature == pytest.approx(25.08, abs=0.005)
+    assert sensor.compensate_pressure(415148, t_fine) == pytest.approx(
+        1006.5327, abs=1e-4
+    )
+
+
+def test_sample_is_one_burst_read(byows_rpi, no_sleep):
+    bus = RecordingBus(byows_rpi)
+    sensor = byows_rpi.Bme280(bus)
+    del bus.reads[:]  # The calibration
+    humidity, pressure, temperature = sensor.sample()
+    assert bus.reads == [(bus.data_register, byows_rpi.Bme280.DATA_LENGTH)]
+    assert temperature == pytest.approx(25.08, abs=0.005)
+    assert pressure == pytest.approx(1006.5327, abs=1e-4)
+    # 0x8000 is a skipped humidity measurement
+    assert humidity is None
+
+
+def test_simulated_round_trip(byows_rpi, no_sleep):
+    model = types.SimpleNamespace(
+        temperature=15.0, humidity=60.0, pressure=1013.25, daily_swing=lambda now: 0.0
+    )
+    sensor = byows_rpi.Bme280(byows_rpi.FakeBme280Bus(model))
+    humidity, pressure, temperature = sensor.sample()
+    assert temperature == pytest.approx(15.0, abs=0.01)
+    assert pressure == pytest.approx(1013.25, abs=0.01)
+    assert humidity == pytest.approx(60.0, abs=0.01)
+
+
+def test_settings(byows_rpi, no_sleep):
+    bus = RecordingBus(byows_rpi)
+    byows_rpi.Bme280(
+        bus,
+        mode="forced",
+        temperature_oversampling=2,
+        pressure_oversampling=16,
+        humidity_oversampling=0,
+        iir_filter=4,
+        standby_ms=1000,
+    )
+    Bme280 = byows_rpi.Bme280
+    assert bus.writes == [
+        (Bme280.REG_CTRL_MEAS, 0b010 << 5 | 0b101 << 2),
+        (Bme280.REG_CONFIG, 0b101 << 5 | 0b010 << 2),
+        (Bme280.REG_CTRL_HUM, 0),
+    ]
+
+
+def test_invalid_setting(byows_rpi):
+    import weewx
+
+    with pytest.raises(weewx.ViolatedPrecondition):
+        byows_rpi.Bme280(RecordingBus(byows_rpi), temperature_oversampling=3)
+
+
+def test_not_a_bme280(byows_rpi):
+    bus = RecordingBus(byows_rpi)
+    bus.fake.registers[byows_rpi.Bme280.REG_CHIP_ID] = 0x58  # A BMP280
+    with pytest.raises(IOError):
+        byows_rpi.Bme280(bus)
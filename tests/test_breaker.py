@@ -0,0 +1,72 @@
+import pytest
+
+
+class FlakySensor(object):
+    """ Read function failing while broken is set, counting its calls. """
+
+    def __init__(self):
+        self.broken = True
+        self.reads = 0
+
+    def __call__(self):
+        self.reads += 1
+        if self.broken:
+            raise IOError("no answer")
+        return 21.5
+
+
+@pytest.fixture
+def sampler(byows_rpi, clock):
+    breaker = byows_rpi.CircuitBreaker(
+        "probe", failures=3, backoff=10.0, max_backoff=40.0, clock=clock
+    )
+    return byows_rpi.SensorSampler("probe", FlakySensor(), 1.0, breaker)
+
+
+def test_opens_after_consecutive_failures(sampler, clock):
+    breaker, sensor = sampler.breaker, sampler.read_func
+    for _ in range(2):
+        assert sampler.sample() is None
+        assert breaker.state == breaker.CLOSED
+    assert sampler.sample() is None
+    assert breaker.state == breaker.OPEN
+    assert breaker.reason == "no answer"
+    # An open breaker does not read the sensor at all
+    for _ in range(9):
+        clock.sleep(1.0)
+        assert sampler.sample() is None
+    assert sensor.reads == 3
+
+
+def test_backoff_doubles_up_to_max_backoff(sampler, clock):
+    breaker, sensor = sampler.breaker, sampler.read_func
+    for _ in range(3):
+        sampler.sample()
+    backoffs = []
+    for _ in range(4):
+        clock.sleep(breaker.retry_time - clock.now)
+        reads = sensor.reads
+        assert sampler.sample() is None
+        # One read while half-open, which opens the breaker again
+        assert sensor.reads == reads + 1
+        assert breaker.state == breaker.OPEN
+        backoffs.append(breaker.backoff)
+    assert backoffs == [20.0, 40.0, 40.0, 40.0]
+
+
+def test_success_closes_and_resets(sampler, clock):
+    breaker, sensor = sampler.breaker, sampler.read_func
+    for _ in range(3):
+        sampler.sample()
+    clock.sleep(10.0)
+    sampler.sample()
+    assert breaker.backoff == 20.0
+    sensor.broken = False
+    clock.sleep(20.0)
+    assert sampler.sample() == 21.5
+    assert breaker.state == breaker.CLOSED
+    assert (breaker.failures, breaker.backoff, breaker.reason) == (0, 10.0, None)
+    # A new failure does not reopen it right away
+    sensor.broken = True
+    assert sampler.sample() is None
+    assert breaker.state == breaker.CLOSED
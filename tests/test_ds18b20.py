@@ -0,0 +1,100 @@
+import os
+
+import pytest
+
+
+def write(path, content):
+    if not os.path.isdir(os.path.dirname(path)):
+        os.makedirs(os.path.dirname(path))
+    with open(path, "w") as f:
+        f.write(content)
+
+
+def w1_slave(milli_c, crc="YES"):
+    """ Returns a w1_slave file like the w1-therm kernel module's. """
+    data = "50 05 4b 46 7f ff 0c 10 1c"
+    return "%s : crc=1c %s\n%s t=%d\n" % (data, crc, data, milli_c)
+
+
+@pytest.fixture
+def w1_tree(tmp_path):
+    """ A fake w1 sysfs tree of two probes whose w1_slave files read 20 C and
+    whose temperature files, the results of a bulk conversion, read 21.5 C
+    and 22.5 C. """
+    root = str(tmp_path)
+    for serial, milli_c in (("28-000000000001", 21500), ("28-000000000002", 22500)):
+        write(os.path.join(root, serial, "w1_slave"), w1_slave(20000))
+        write(os.path.join(root, serial, "temperature"), "%d\n" % milli_c)
+    return root
+
+
+def add_bulk_read(root, state="0"):
+    path = os.path.join(root, "w1_bus_master1", "therm_bulk_read")
+    write(path, state + "\n")
+    return path
+
+
+def test_bulk_conversion(byows_rpi, w1_tree):
+    bulk_file = add_bulk_read(w1_tree)
+    bus = byows_rpi.DS18B20Bus(w1_tree)
+    try:
+        assert bus.bulk_files == [bulk_file]
+        temps = bus.read_temps()
+    finally:
+        bus.close()
+    assert temps == {"soilTemp1": 21.5, "soilTemp2": 22.5}
+    # The conversion was triggered on the bus master
+    with open(bulk_file) as f:
+        assert f.read() == "trigger\n"
+
+
+def test_without_bulk_read(byows_rpi, w1_tree):
+    bus = byows_rpi.DS18B20Bus(w1_tree)
+    try:
+        assert bus.bulk_files == []
+        temps = bus.read_temps()
+    finally:
+        bus.close()
+    assert temps == {"soilTemp1": 20.0, "soilTemp2": 20.0}
+
+
+def test_probe_without_temperature_file(byows_rpi, w1_tree):
+    # An older w1-therm module, the probe is read through w1_slave instead
+    add_bulk_read(w1_tree)
+    os.remove(os.path.join(w1_tree, "28-000000000002", "temperature"))
+    bus = byows_rpi.DS18B20Bus(w1_tree, {"28-000000000002": "extraTemp1"})
+    try:
+        temps = bus.read_temps()
+    finally:
+        bus.close()
+    assert temps == {"soilTemp1": 21.5, "extraTemp1": 20.0}
+
+
+def test_bulk_conversion_error(byows_rpi, w1_tree):
+    bulk_file = add_bulk_read(w1_tree)
+    bus = byows_rpi.DS18B20Bus(w1_tree)
+    try:
+        os.remove(bulk_file)
+        os.rmdir(os.path.dirname(bulk_file))
+        assert not bus.bulk_convert()
+        # The probes are read one by one instead
+        assert bus.read_temps() == {"soilTemp1": 20.0, "soilTemp2": 20.0}
+    finally:
+        bus.close()
+
+
+def test_read_converted_temp(byows_rpi, w1_tree):
+    probe = byows_rpi.DS18B20(w1_tree, "28-000000000001")
+    assert probe.has_temperature_file()
+    assert probe.read_converted_temp() == 21.5
+    with open(probe.temperature_file, "w") as f:
+        f.write("-10250\n")
+    assert probe.read_converted_temp() == -10.25
+
+
+def test_crc_failure(byows_rpi, w1_tree, monkeypatch):
+    monkeypatch.setattr(byows_rpi.time, "sleep", lambda seconds: None)
+    write(os.path.join(w1_tree, "28-000000000001", "w1_slave"), w1_slave(85000, "NO"))
+    probe = byows_rpi.DS18B20(w1_tree, "28-000000000001")
+    with pytest.raises(IOError):
+        probe.read_temp()
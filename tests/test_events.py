@@ -0,0 +1,67 @@
+import pytest
+
+
+@pytest.fixture
+def events(byows_rpi, clock):
+    def make(kinds=("rain", "gust", "pressure"), **options):
+        return byows_rpi.LoopEvents(kinds, clock=clock, sleep=clock.sleep, **options)
+
+    return make
+
+
+def test_unknown_kind(byows_rpi, events):
+    with pytest.raises(byows_rpi.weewx.ViolatedPrecondition):
+        events(["rain", "hail"])
+
+
+def test_kinds_not_configured_are_ignored(events):
+    loop_events = events(["rain"])
+    loop_events.trigger("gust")
+    assert not loop_events.wait(0.0)
+    assert loop_events.take() == set()
+
+
+def test_events_are_rate_limited(events, clock):
+    loop_events = events(min_interval=2.0)
+    clock.sleep(5.0)
+    loop_events.trigger("rain")
+    assert loop_events.wait(10.0)
+    assert loop_events.take() == {"rain"}
+    emitted = clock.now
+    # The next tips are too early for a packet before the deadline
+    loop_events.trigger("rain")
+    assert not loop_events.wait(1.0)
+    assert clock.now == emitted
+    # And are merged with a gust into one packet min_interval later
+    loop_events.trigger("gust")
+    assert loop_events.wait(10.0)
+    assert clock.now == emitted + 2.0
+    assert loop_events.take() == {"rain", "gust"}
+    assert loop_events.take() == set()
+
+
+def test_gust_hysteresis(events):
+    loop_events = events(gust_threshold=50.0)
+    fired = []
+    for gust in (30.0, 52.0, 55.0, 45.0, 60.0, 39.0, 51.0):
+        loop_events.check_gust(gust)
+        fired.append(bool(loop_events.take()))
+    # Re-armed only once the gust fell below 80 % of the threshold
+    assert fired == [False, True, False, False, False, False, True]
+
+
+def test_pressure_drop_within_the_window(events, clock):
+    loop_events = events(pressure_drop=1.0, pressure_window=600.0)
+    fired = []
+    for pressure in (1010.0, 1009.5, 1009.2, 1008.9, 1008.8, 1009.6, 1008.5):
+        loop_events.check_pressure(pressure)
+        fired.append(bool(loop_events.take()))
+        clock.sleep(60.0)
+    # Re-armed by the rise back to within half the drop
+    assert fired == [False, False, False, True, False, False, True]
+    # A slow fall spread over more than the window fires nothing
+    loop_events = events(pressure_drop=1.0, pressure_window=600.0)
+    for step in range(20):
+        loop_events.check_pressure(1010.0 - 0.1 * step)
+        assert not loop_events.take()
+        clock.sleep(120.0)
@@ -0,0 +1,61 @@
+def test_range_check_and_probe_rejects(byows_filters, metrics):
+    stage = byows_filters.PacketFilter(probe_fields=["extraTemp1"])
+    packet = dict(outTemp=45.0, extraTemp1=85.0, outHumidity=101.0, pressure=None)
+    stage.apply(packet, now=0.0)
+    # 85 C is in the range of a probe but is its reset value
+    assert packet == dict(
+        outTemp=45.0, extraTemp1=None, outHumidity=None, pressure=None
+    )
+    assert metrics.value("byows_filter_dropped_total", "extraTemp1") == 1
+
+
+def test_hampel_replaces_an_outlier(byows_filters):
+    hampel = byows_filters.HampelFilter(window=7, threshold=3.0)
+    values = [20.0, 20.1, 19.9, 20.0, 20.2, 19.8, 20.1]
+    assert [hampel.apply(v, t) for t, v in enumerate(values)] == values
+    # The spike is replaced by the median of the window
+    assert hampel.apply(35.0, 7) == 20.1
+    assert hampel.apply(20.0, 8) == 20.0
+    # The window keeps the raw values, so a lasting step is accepted
+    results = [hampel.apply(25.0, t) for t in range(9, 14)]
+    assert results[-1] == 25.0
+
+
+def test_hampel_min_deviation(byows_filters):
+    hampel = byows_filters.HampelFilter(window=5, min_deviation=0.1)
+    for t in range(5):
+        hampel.apply(50.0, t)
+    # A flat window has no spread, a small change still goes through
+    assert hampel.apply(50.2, 5) == 50.2
+    assert hampel.apply(52.0, 6) == 50.0
+
+
+def test_hampel_keeps_constant_memory(byows_filters):
+    hampel = byows_filters.HampelFilter(window=9)
+    for t in range(1000):
+        hampel.apply(float(t % 17), t)
+    assert len(hampel.sorted) == len(hampel.window) == 9
+    assert hampel.sorted == sorted(hampel.window)
+
+
+def test_rate_limit_confirms_a_step(byows_filters, metrics):
+    stage = byows_filters.PacketFilter(
+        dict(outTemp=dict(max_rate=0.1, max_rate_confirm=3))
+    )
+    temps = [20.0, 20.1, 30.0, 30.1, 30.0, 30.2]
+    filtered = []
+    for now, temp in enumerate(temps):
+        packet = dict(outTemp=temp)
+        stage.apply(packet, now=10.0 * now)
+        filtered.append(packet["outTemp"])
+    # Dropped until max_rate_confirm values agree with each other
+    assert filtered == [20.0, 20.1, None, None, 30.0, 30.2]
+    assert metrics.value("byows_filter_dropped_total", "outTemp") == 2
+
+
+def test_rate_limit_drops_a_spike(byows_filters):
+    rate = byows_filters.RateLimit(0.1, confirm=3)
+    results = [rate.apply(v, 10.0 * t) for t, v in enumerate([20.0, 45.0, 20.2])]
+    assert results == [20.0, None, 20.2]
+    # Forgotten after a long outage
+    assert rate.apply(45.0, 20.0 + rate.RESET_SECONDS) == 45.0
@@ -0,0 +1,120 @@
+import threading
+import time
+import types
+
+import pytest
+
+
+@pytest.fixture
+def i2c_backend(byows_rpi, fake_backend):
+    """ A FakeBackend with an outdoor BME280 at 0x77 and an indoor one at
+    0x76 on every port, recording the ports opened. """
+    backend = fake_backend()
+    backend.opened = []
+    models = {
+        0x77: dict(temperature=5.0, humidity=80.0, pressure=1010.0),
+        0x76: dict(temperature=21.0, humidity=45.0, pressure=1011.0),
+    }
+
+    def i2c_bus(port):
+        backend.opened.append(port)
+        devices = dict(
+            (
+                address,
+                byows_rpi.FakeBme280Bus(
+                    types.SimpleNamespace(daily_swing=lambda now: 0.0, **model)
+                ),
+            )
+            for address, model in models.items()
+        )
+        return byows_rpi.FakeI2cBus(devices, lambda: None)
+
+    backend.i2c_bus = i2c_bus
+    return backend
+
+
+def sample(stn, *names):
+    """ Reads the samplers once, as their threads would. """
+    for name in names:
+        sampler = stn.samplers[name]
+        sampler.reading = (sampler.sample(), time.monotonic())
+
+
+def test_devices_share_the_bus_and_map_their_fields(station, i2c_backend):
+    stn = station(
+        backend=i2c_backend,
+        bme280_port=1,
+        bme280_address=0x77,
+        i2c_devices=dict(
+            indoor=dict(
+                port="1",
+                address="0x76",
+                temperature="inTemp",
+                humidity="inHumidity",
+                pressure="none",
+            ),
+            missing=dict(port="1", address="0x40", temperature="extraTemp2"),
+        ),
+    )
+    # One handle for the three devices of the port
+    assert i2c_backend.opened == [1]
+    assert stn.probes.missing() == ["i2c_missing"]
+    sample(stn, "bme280", "i2c_indoor", "i2c_missing")
+    data = stn.get_data()
+    assert data["outTemp"] == pytest.approx(5.0, abs=0.05)
+    assert data["pressure"] == pytest.approx(1010.0, abs=0.05)
+    assert data["inTemp"] == pytest.approx(21.0, abs=0.05)
+    assert data["inHumidity"] == pytest.approx(45.0, abs=0.1)
+    # The device that did not open is left out
+    assert "extraTemp2" not in data
+
+
+def test_samplers_of_a_port_are_staggered(station, i2c_backend):
+    devices = dict(
+        (name, dict(port="1", address="0x76", temperature="extraTemp%d" % n))
+        for n, name in enumerate(("a", "b", "c"), 1)
+    )
+    devices["other"] = dict(port="3", address="0x76", temperature="extraTemp4")
+    stn = station(
+        backend=i2c_backend, bme280_port=1, bme280_interval=2.0, i2c_devices=devices
+    )
+    phases = [stn.samplers[name].phase for name in ("bme280", "i2c_a", "i2c_b")]
+    assert phases + [stn.samplers["i2c_c"].phase] == pytest.approx([0, 0.5, 1, 1.5])
+    # Alone on its port
+    assert stn.samplers["i2c_other"].phase == 0.0
+    assert sorted(i2c_backend.opened) == [1, 3]
+
+
+def test_transactions_are_serialized(byows_rpi, metrics):
+    class SlowBus(object):
+        def __init__(self):
+            self.busy = 0
+            self.most_busy = 0
+
+        def read_byte_data(self, address, register):
+            self.busy += 1
+            self.most_busy = max(self.most_busy, self.busy)
+            time.sleep(0.001)
+            self.busy -= 1
+            return register
+
+    manager = byows_rpi.I2cBusManager(lambda port: SlowBus())
+    bus = manager.bus(1)
+    assert manager.bus(1) is bus
+
+    def read():
+        for register in range(20):
+            assert bus.read_byte_data(0x76, register) == register
+
+    threads = [threading.Thread(target=read) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert bus.bus.most_busy == 1
+    assert metrics.value("byows_i2c_wait_seconds", "i2c-1") is not None
+
+
+def test_unknown_device_type(byows_rpi):
+    with pytest.raises(byows_rpi.weewx.ViolatedPrecondition):
+        byows_rpi.I2cDevice("uv", dict(type="veml6075"))
@@ -0,0 +1,117 @@
+import os
+import struct
+import time
+
+import pytest
+
+
+def test_cursor_takes_every_edge_once(byows_common, clock):
+    ring = byows_common.PulseRing(8, clock)
+    cursor = ring.cursor()
+    for _ in range(5):
+        clock.sleep(0.5)
+        ring.append()
+    assert cursor.pending() == 5
+    assert cursor.take() == [1000.5, 1001.0, 1001.5, 1002.0, 1002.5]
+    ring.extend([1003.0, 1003.5])
+    assert cursor.take_count() == 2
+    assert cursor.take() == []
+    assert cursor.overruns == 0
+
+
+def test_ring_overrun_is_detected(byows_common, clock):
+    ring = byows_common.PulseRing(8, clock)
+    slow, fast = ring.cursor(), ring.cursor()
+    for i in range(20):
+        ring.append(float(i))
+        if i % 4 == 3:
+            fast.take()
+    # The slow consumer gets the last ring full, and counts the lost edges
+    assert slow.take() == [float(i) for i in range(12, 20)]
+    assert slow.overruns == 12
+    assert fast.overruns == 0
+    ring.extend([20.0])
+    assert slow.take() == [20.0]
+    assert slow.overruns == 12
+
+
+class EdgePipe(object):
+    """ A pipe standing in for the line event fd of a GPIO character device,
+    fed with struct gpioevent_data records. """
+
+    def __init__(self, byows_rpi, monkeypatch, tmp_path):
+        self.event = struct.Struct(byows_rpi.GpioCdevEdgeReader.EVENT_FORMAT)
+        self.read_fd, self.write_fd = os.pipe()
+        self.chip = str(tmp_path / "gpiochip0")
+        open(self.chip, "w").close()
+
+        def ioctl(fd, request, buf, mutate):
+            struct.pack_into("=i", buf, 44, self.read_fd)
+
+        monkeypatch.setattr(byows_rpi.fcntl, "ioctl", ioctl)
+
+    def write(self, stamps):
+        os.write(
+            self.write_fd,
+            b"".join(self.event.pack(int(stamp * 1e9), 2) for stamp in stamps),
+        )
+
+    def close(self):
+        os.close(self.write_fd)
+
+
+@pytest.fixture
+def edge_pipe(byows_rpi, monkeypatch, tmp_path):
+    pipe = EdgePipe(byows_rpi, monkeypatch, tmp_path)
+    yield pipe
+    pipe.close()
+
+
+@pytest.fixture
+def cdev_ring(byows_rpi, byows_common, edge_pipe):
+    """ Returns a PulseRing fed by a GpioCdevEdgeReader reading edge_pipe. """
+    readers = []
+
+    def make():
+        ring = byows_common.PulseRing(256)
+        readers.append(byows_rpi.GpioCdevEdgeReader(edge_pipe.chip, 5, ring.extend))
+        return ring
+
+    yield make
+    for reader in readers:
+        reader.close()
+
+
+def wait_for(ring, count, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while ring.count < count and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return ring.count
+
+
+def test_cdev_edges_reach_the_ring(edge_pipe, cdev_ring, metrics):
+    ring = cdev_ring()
+    start = time.monotonic()
+    stamps = [start + 0.001 * i for i in range(5)]
+    edge_pipe.write(stamps)
+    assert wait_for(ring, 5) == 5
+    assert list(ring.stamps[:5]) == pytest.approx(stamps, abs=1e-6)
+    assert metrics.value("byows_gpio_fifo_full_total", "gpio5") is None
+
+
+def test_full_fifo_is_drained_and_counted(byows_rpi, edge_pipe, cdev_ring, metrics):
+    depth = byows_rpi.GpioCdevEdgeReader.FIFO_DEPTH
+    start = time.monotonic()
+    # Queued before the reader starts, more than a FIFO full
+    edge_pipe.write([start + 0.001 * i for i in range(2 * depth + 5)])
+    ring = cdev_ring()
+    assert wait_for(ring, 2 * depth + 5) == 2 * depth + 5
+    assert metrics.value("byows_gpio_fifo_full_total", "gpio5") == 1
+    assert list(ring.stamps[: ring.count]) == sorted(ring.stamps[: ring.count])
+
+
+def test_realtime_stamps_are_moved_to_the_monotonic_clock(edge_pipe, cdev_ring):
+    ring = cdev_ring()
+    edge_pipe.write([time.time()])
+    assert wait_for(ring, 1) == 1
+    assert ring.stamps[0] == pytest.approx(time.monotonic(), abs=1.0)
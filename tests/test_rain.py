@@ -0,0 +1,60 @@
+import pytest
+
+BUCKET_CM = 0.02794
+
+
+def tip(station, clock, at):
+    """ Presses the bucket switch at the clock time at. """
+    clock.now = at
+    station.backend.buttons[station.rain_bucket_pin].when_pressed()
+
+
+def test_bounces_are_debounced(station, clock, metrics):
+    stn = station(rain_debounce=0.1)
+    for at in (1000.0, 1000.02, 1000.05, 1030.0, 1030.08):
+        tip(stn, clock, at)
+    assert stn.rain_tips == 2
+    assert metrics.value("byows_rain_bounces_total") == 3
+    assert stn.get_rainfall() == pytest.approx(2 * BUCKET_CM)
+
+
+def test_tips_are_not_lost_between_packets(station, clock):
+    stn = station()
+    total = 0.0
+    at = 1000.0
+    for packet in range(10):
+        for _ in range(packet % 4):
+            at += 2.0
+            tip(stn, clock, at)
+        total += stn.get_rainfall()
+    assert total == pytest.approx(13 * BUCKET_CM)
+    assert stn.get_rainfall() == 0.0
+
+
+def test_tips_trigger_the_rain_event(byows_rpi, station, clock):
+    events = byows_rpi.LoopEvents(["rain"], clock=clock, sleep=clock.sleep)
+    stn = station(events=events)
+    tip(stn, clock, 1000.0)
+    assert events.take() == {"rain"}
+
+
+def test_rain_rate_from_the_tip_interval(station, clock):
+    stn = station(rain_rate_timeout=900.0)
+    assert stn.get_rain_rate(1000.0) == 0.0
+    tip(stn, clock, 1000.0)
+    # A single tip gives no interval
+    assert stn.get_rain_rate(1001.0) == 0.0
+    tip(stn, clock, 1036.0)
+    rate = BUCKET_CM * 3600 / 36.0
+    assert stn.get_rain_rate(1036.0) == pytest.approx(rate)
+    assert stn.get_rain_rate(1072.0) == pytest.approx(rate)
+
+
+def test_rain_rate_decays_to_zero(station, clock):
+    stn = station(rain_rate_timeout=900.0)
+    tip(stn, clock, 1000.0)
+    tip(stn, clock, 1036.0)
+    rates = [stn.get_rain_rate(1036.0 + seconds) for seconds in (72, 144, 600)]
+    assert rates == pytest.approx([BUCKET_CM * 3600 / s for s in (72, 144, 600)])
+    assert rates == sorted(rates, reverse=True)
+    assert stn.get_rain_rate(1036.0 + 901) == 0.0
@@ -0,0 +1,67 @@
+import random
+
+import pytest
+
+
+def test_full_rose_sums_to_100(byows_rpi):
+    rose = byows_rpi.WindRose()
+    generator = random.Random(25)
+    now = 0.0
+    for _ in range(3000):
+        now += 0.1
+        rose.add(generator.uniform(0.0, 360.0), generator.uniform(0.0, 40.0), now)
+    fields = rose.take()
+    shares = [fields[field] for field in rose.FIELDS]
+    assert all(share > 0 for share in shares)
+    assert sum(shares) == pytest.approx(100.0)
+    # Directions all around the compass
+    assert fields["windRoseStdDev"] > 90.0
+
+
+def test_sectors_are_centred_on_their_direction(byows_rpi):
+    rose = byows_rpi.WindRose()
+    for i, direction in enumerate([0.0, 11.0, 349.0, 11.3, 90.0, 359.9]):
+        rose.add(direction, 10.0, float(i))
+    fields = rose.take()
+    # The first sample only starts the clock, 11.3 is past the N sector
+    assert fields["windRoseN"] == pytest.approx(60.0)
+    assert fields["windRoseNNE"] == pytest.approx(20.0)
+    assert fields["windRoseE"] == pytest.approx(20.0)
+    assert fields["windRoseDir"] == 0.0
+
+
+def test_steady_wind_and_calm(byows_rpi):
+    rose = byows_rpi.WindRose()
+    for i in range(100):
+        rose.add(225.0, 12.0, i * 0.5)
+    fields = rose.take()
+    assert fields["windRoseSW"] == pytest.approx(100.0)
+    assert fields["windRoseDir"] == 225.0
+    assert fields["windRoseStdDev"] == pytest.approx(0.0, abs=1e-3)
+    # A take starts a new rose, without wind there are no shares
+    for i in range(100, 110):
+        rose.add(90.0, 0.0, i * 0.5)
+    fields = rose.take()
+    assert fields["windRoseE"] is None and fields["windRoseDir"] is None
+    assert fields["windRoseStdDev"] == pytest.approx(0.0, abs=1e-3)
+    assert rose.take()["windRoseStdDev"] is None
+
+
+def test_samples_are_weighted_by_time(byows_rpi):
+    rose = byows_rpi.WindRose()
+    now = 0.0
+    rose.add(0.0, 10.0, now)
+    # Fast samples from the north, then slow ones from the south, with a
+    # gap of more than MAX_GAP that counts as MAX_GAP
+    for _ in range(40):
+        now += 0.25
+        rose.add(0.0, 10.0, now)
+    for _ in range(5):
+        now += 2.0
+        rose.add(180.0, 10.0, now)
+    now += 60.0
+    rose.add(180.0, 10.0, now)
+    fields = rose.take()
+    # 10 s from the north, 10 s and the 5 s of the gap from the south
+    assert fields["windRoseN"] == pytest.approx(40.0)
+    assert fields["windRoseS"] == pytest.approx(60.0)
@@ -0,0 +1,64 @@
+import pytest
+
+
+@pytest.fixture
+def scheduler(byows_rpi, clock):
+    def make(interval):
+        return byows_rpi.LoopScheduler(
+            interval, clock=clock, sleep=clock.sleep, wall_clock=clock.time
+        )
+
+    return make
+
+
+def run(loop, packets):
+    """ Returns the timestamps of the next packets of the scheduler. """
+    stamps = []
+    while len(stamps) < packets:
+        stamp = loop.timestamp(loop.wait())
+        if stamp is not None:
+            stamps.append(stamp)
+    return stamps
+
+
+def is_increasing(stamps):
+    return all(a < b for a, b in zip(stamps, stamps[1:]))
+
+
+@pytest.mark.parametrize("interval", [1.0, 2.0, 5.0])
+def test_whole_second_intervals(scheduler, interval):
+    loop = scheduler(interval)
+    stamps = run(loop, 20)
+    assert is_increasing(stamps)
+    assert {b - a for a, b in zip(stamps, stamps[1:])} == {int(interval)}
+    assert loop.missed == 0
+
+
+def test_half_second_interval_is_raised(scheduler):
+    loop = scheduler(0.5)
+    assert loop.interval == 1.0
+    stamps = run(loop, 20)
+    assert is_increasing(stamps)
+    assert stamps[-1] - stamps[0] == 19
+    loop.set_interval(0.5)
+    assert loop.interval == 1.0
+
+
+def test_stamps_never_repeat(scheduler, clock):
+    """ Half second deadlines, like event packets between regular ones, get
+    no dateTime already given out. """
+    loop = scheduler(1.0)
+    stamps = [loop.timestamp(clock.now + 0.5 * i) for i in range(20)]
+    given = [stamp for stamp in stamps if stamp is not None]
+    assert len(given) < len(stamps)
+    assert is_increasing(given)
+    # Every second gets a packet all the same
+    assert given == list(range(given[0], given[-1] + 1))
+
+
+def test_wall_clock_stepping_back(scheduler, clock):
+    loop = scheduler(1.0)
+    before = run(loop, 5)
+    clock.wall_offset -= 3600
+    after = run(loop, 2)
+    assert after[0] > before[-1]
@@ -0,0 +1,100 @@
+import array
+import json
+import time
+
+import pytest
+
+TIPS = (10.0, 20.0, 30.5)
+SECONDS = 60
+
+
+def vane_code(byows_rpi):
+    """ Returns a code of the wind vane and its direction. """
+    codes = byows_rpi.WindGauge.nominal_vane_codes()
+    code = sorted(codes)[4]
+    return code, codes[code]
+
+
+@pytest.fixture
+def trace_file(byows_rpi, byows_trace, tmp_path):
+    """ A minute of a station with the vane at a fixed code, the anemometer
+    turning at one revolution per second and TIPS of the rain bucket. """
+    path = str(tmp_path / "byows.trace")
+    writer = byows_trace.TraceWriter(path)
+    start = time.monotonic()
+    writer.adc((0,), (vane_code(byows_rpi)[0],))
+
+    def edges(kind, stamps):
+        stamps = [start + stamp for stamp in stamps]
+        writer.write(kind, array.array("d", stamps).tobytes(), stamps[0])
+
+    edges(writer.ANEMOMETER, [0.5 * i for i in range(1, 2 * SECONDS + 2)])
+    edges(writer.RAIN, TIPS)
+    writer.close()
+    return path
+
+
+def replay(byows_rpi, path):
+    """ Returns the packets of a replay of the trace at path, and the
+    bucket size of its station. """
+    driver = byows_rpi.ByowsRpi(
+        backend="replay", loop_interval=1, replay=dict(trace_file=path)
+    )
+    try:
+        return list(driver.genLoopPackets()), driver.station.bucket_size
+    finally:
+        driver.closePort()
+
+
+def test_replay_feeds_the_trace_through_the_station(byows_rpi, trace_file):
+    start = time.monotonic()
+    packets, bucket_size = replay(byows_rpi, trace_file)
+    # As fast as possible, not in real time
+    assert time.monotonic() - start < SECONDS / 4
+    stamps = [packet["dateTime"] for packet in packets]
+    assert stamps == list(range(stamps[0], stamps[0] + len(stamps)))
+    assert len(packets) >= SECONDS - 1
+    rain = sum(packet["rain"] for packet in packets)
+    assert rain == pytest.approx(len(TIPS) * bucket_size / 10.0)
+    # A steady wind from the direction of the vane code
+    speeds = set(round(packet["windSpeed"], 6) for packet in packets[5:-5])
+    assert len(speeds) == 1 and speeds.pop() > 0
+    assert packets[-5]["windDir"] == pytest.approx(vane_code(byows_rpi)[1])
+
+
+def test_replay_is_deterministic(byows_rpi, trace_file):
+    first, _ = replay(byows_rpi, trace_file)
+    second, _ = replay(byows_rpi, trace_file)
+    assert json.dumps(first) == json.dumps(second)
+
+
+def test_trace_has_the_captured_inputs(byows_trace, station, fake_backend, tmp_path):
+    path = str(tmp_path / "capture.trace")
+    trace = byows_trace.TraceWriter(path)
+    capture = byows_trace.CaptureBackend(fake_backend(time.monotonic), trace, 6)
+    stn = station(backend=capture, rain_bucket_pin=6, rain_debounce=0.0)
+    for _ in range(3):
+        capture.backend.buttons[6].when_pressed()
+        stn.wind_gauge.spin()
+    tips = list(stn.tips.stamps[: stn.tips.count])
+    pulses = list(stn.wind_gauge.pulses.stamps[: stn.wind_gauge.pulses.count])
+    stn.stop()
+    capture.close()
+    backend = byows_trace.ReplayBackend(dict(), path)
+    try:
+        events = list(backend.preloaded) + list(backend.events)
+    finally:
+        backend.close()
+    replayed = dict()
+    for when, kind, _ in events:
+        replayed.setdefault(kind, []).append(when)
+
+    def intervals(stamps):
+        return [b - a for a, b in zip(stamps, stamps[1:])]
+
+    # Within the resolution of the wall clock the edges are mapped to
+    for kind, captured in ((trace.RAIN, tips), (trace.ANEMOMETER, pulses)):
+        assert len(replayed[kind]) == 3
+        assert intervals(replayed[kind]) == pytest.approx(
+            intervals(captured), abs=1e-6
+        )
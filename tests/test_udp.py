@@ -0,0 +1,116 @@
+import time
+
+import pytest
+
+
+@pytest.fixture
+def ingest(byows_transport):
+    """ An ingest on a loopback port picked by the kernel, accepting node 1
+    with outTemp mapped to extraTemp1 and rain dropped, and node 2 as is. """
+    nodes = {"1": {"outTemp": "extraTemp1", "rain": "none"}, "2": {}}
+    ingest = byows_transport.UdpIngest(("127.0.0.1", 0), nodes, timeout=60)
+    yield ingest
+    ingest.close()
+
+
+@pytest.fixture
+def sender(byows_transport, ingest):
+    senders = []
+
+    def make(node):
+        senders.append(byows_transport.UdpSender(ingest.address, node))
+        return senders[-1]
+
+    yield make
+    for s in senders:
+        s.close()
+
+
+def receive(ingest, datagrams):
+    """ Receives until datagrams were handled, or a second went by. """
+    deadline = time.monotonic() + 1.0
+    while time.monotonic() < deadline:
+        ingest.wait(0.01)
+        nodes = ingest.nodes.values()
+        handled = sum(n.received + n.late + n.unknown_schema for n in nodes)
+        if handled >= datagrams:
+            return
+
+
+def test_fields_are_mapped(ingest, sender):
+    sender(1).send({"dateTime": 100, "usUnits": 16, "outTemp": 11.6, "rain": 0.2})
+    receive(ingest, 1)
+    assert ingest.take() == {"extraTemp1": 11.6}
+
+
+def test_nodes_are_merged_by_time(ingest, sender):
+    one, two = sender(1), sender(2)
+    two.send({"dateTime": 101, "usUnits": 16, "pressure": 1001.0, "outHumidity": 50.0})
+    one.send({"dateTime": 100, "usUnits": 16, "outTemp": 11.0, "pressure": None})
+    two.send({"dateTime": 99, "usUnits": 16, "pressure": 999.0, "outHumidity": None})
+    receive(ingest, 3)
+    # The newest reading of each field wins, None readings are left out
+    expected = {"pressure": 1001.0, "outHumidity": 50.0, "extraTemp1": 11.0}
+    assert ingest.take() == expected
+    assert ingest.take() == {}
+
+
+def test_schema_changes(ingest, sender):
+    node = sender(2)
+    node.send({"dateTime": 100, "usUnits": 16, "outTemp": 10.0})
+    node.send({"dateTime": 101, "usUnits": 16, "outTemp": 10.5, "windSpeed": 3.0})
+    receive(ingest, 2)
+    assert ingest.take() == {"outTemp": 10.5, "windSpeed": 3.0}
+    assert len(ingest.nodes[2].schemas) == 2
+
+
+def test_lost_and_late_datagrams(ingest, sender):
+    node = sender(2)
+    packet = {"dateTime": 100, "usUnits": 16, "outTemp": 10.0}
+    node.send(packet)
+    node.sequence += 3  # Three datagrams lost on the way
+    node.send(packet)
+    node.sequence -= 2  # A late one
+    node.send(packet)
+    receive(ingest, 3)
+    counters = ingest.nodes[2]
+    assert (counters.received, counters.lost, counters.late) == (2, 3, 1)
+
+
+def test_sequence_wraps_around(byows_transport):
+    node = byows_transport.UdpNode(1, {})
+    mask = byows_transport.UdpProtocol.SEQUENCE_MASK
+    assert node.check_sequence(mask - 1)
+    assert node.check_sequence(1)  # mask and 0 were lost
+    assert node.lost == 2
+    assert not node.check_sequence(mask)
+    assert node.late == 1
+
+
+def test_unknown_schema_and_node(byows_transport, ingest, sender):
+    node = sender(2)
+    node.sent = 1  # The schema is not sent, as if it was lost
+    node.fields = ("outTemp",)
+    node.names = b"outTemp"
+    node.schema = 1234
+    node.readings = byows_transport.UdpProtocol.readings_struct(1)
+    node.send({"dateTime": 100, "usUnits": 16, "outTemp": 10.0})
+    sender(3).send({"dateTime": 100, "usUnits": 16, "outTemp": 10.0})
+    receive(ingest, 1)
+    time.sleep(0.05)
+    ingest.receive()
+    assert ingest.nodes[2].unknown_schema == 1
+    assert ingest.unknown_nodes == {3}
+    assert ingest.take() == {}
+
+
+def test_timeout(byows_transport):
+    import weewx
+
+    ingest = byows_transport.UdpIngest(("127.0.0.1", 0), {}, timeout=0)
+    try:
+        time.sleep(0.01)
+        with pytest.raises(weewx.WeeWxIOError):
+            ingest.take()
+    finally:
+        ingest.close()
@@ -0,0 +1,39 @@
+import math
+
+import pytest
+
+
+def test_get_average_wraps_around_north(byows_rpi):
+    assert byows_rpi.get_average([350.0, 10.0]) == pytest.approx(0.0, abs=1e-9)
+    assert byows_rpi.get_average([355.0, 15.0]) == pytest.approx(5.0)
+
+
+def test_get_average_is_in_range(byows_rpi):
+    # A tiny negative mean must not come back as 360
+    average = byows_rpi.get_average([359.999999, 0.0000001])
+    assert 0.0 <= average < 360.0
+
+
+def test_get_average_without_angles(byows_rpi):
+    assert byows_rpi.get_average([]) is None
+    assert byows_rpi.get_average([float("nan")]) is None
+
+
+def test_circular_mean_resultant_length(byows_rpi):
+    direction, resultant = byows_rpi.circular_mean([90.0, 90.0, float("nan")])
+    assert direction == pytest.approx(90.0)
+    assert resultant == pytest.approx(1.0)
+    _, resultant = byows_rpi.circular_mean([0.0, 180.0])
+    assert resultant == pytest.approx(0.0, abs=1e-9)
+
+
+def test_vane_sampler_average_across_north(byows_rpi):
+    readings = iter([90.0, 350.0, 10.0, None, 350.0, 10.0])
+    vane = byows_rpi.VaneSampler(lambda: next(readings), 5)
+    for _ in range(6):
+        vane.sample()
+    # The oldest sample was overwritten, the undecoded one is ignored
+    direction, resultant = vane.take_average()
+    assert direction == pytest.approx(0.0, abs=1e-9)
+    assert resultant == pytest.approx(math.cos(math.radians(10.0)))
+    assert vane.take_average() == (None, None)